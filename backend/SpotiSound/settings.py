@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'instrumentation.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +80,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'SpotiSound.wsgi.application'
+ASGI_APPLICATION = 'SpotiSound.asgi.application'
+# Serve the reads of the views using async_views.AsyncReadMixin through their coroutine handlers. Turned on by
+# SpotiSound.asgi through the environment, under WSGI the views stay sync.
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
 
 
 # Database
@@ -140,7 +145,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ],
 }
 
@@ -149,6 +154,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=50),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # the blacklist is only queried for refresh tokens users.blacklist's Bloom filter may contain
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.FilteredTokenRefreshSerializer',
     'UPDATE_LAST_LOGIN': False,
 
     'ALGORITHM': 'HS256',
@@ -177,4 +184,107 @@ SIMPLE_JWT = {
 }
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-MEDIA_URL = '/media/'
\ No newline at end of file
+MEDIA_URL = '/media/'
+
+# Uploads are stored once per content hash under MEDIA_ROOT/blobs/, see library.blobs.
+STORAGES = {
+    'default': {
+        'BACKEND': 'library.blobs.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Set to e.g. 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache) to let the front server stream song audio.
+SONG_STREAM_SENDFILE_HEADER = None
+SONG_STREAM_SENDFILE_PREFIX = '/protected-media/'
+
+# Plays are buffered in memory and flushed in bulk; set BUFFERED to False to write every play synchronously.
+PLAY_COUNTER = {
+    'BUFFERED': True,
+    'MAX_PENDING': 1000,
+    'FLUSH_INTERVAL': 5.0,
+}
+
+# Written by `manage.py build_typeahead_snapshot`, loaded on the first typeahead request.
+TYPEAHEAD_SNAPSHOT = BASE_DIR / 'typeahead.snapshot.json.gz'
+
+# Square WebP/JPEG derivatives generated next to every uploaded picture by a background pool. Each process
+# remembers the last READY_CACHE_SIZE pictures known to have them and tries a failed one again after
+# RETRY_AFTER seconds.
+IMAGE_DERIVATIVES = {
+    'SIZES': (64, 300, 640),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    'MAX_PENDING': 1000,
+    'READY_CACHE_SIZE': 10_000,
+    'RETRY_AFTER': 600,
+}
+
+# Resumable uploads (api/v1/library/upload/): part files are assembled in DIR, sessions idle for EXPIRY are
+# removed by `manage.py gc_uploads`.
+CHUNKED_UPLOAD = {
+    'DIR': BASE_DIR / 'uploads',
+    'CHUNK_SIZE': 8 * 1024 * 1024,
+    'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+    'EXPIRY': timedelta(hours=24),
+}
+
+# Rendered song/album/author detail responses, invalidated by per-object versions (library.cache).
+# 'library.cache.DjangoCacheBackend' with OPTIONS {'ALIAS': ..., 'TIMEOUT': ...} shares them between processes.
+RESPONSE_CACHE = {
+    'BACKEND': 'library.cache.LocalLRUBackend',
+    'OPTIONS': {
+        'MAX_BYTES': 32 * 1024 * 1024,
+        'TIMEOUT': 300,
+        'MAX_VERSIONS': 100_000,
+    },
+}
+
+# Per-user sets of liked song ids behind the is_liked flag of song lists (playlists.likes), same backends
+# as RESPONSE_CACHE.
+LIKED_SONGS = {
+    'BACKEND': 'library.cache.LocalLRUBackend',
+    'OPTIONS': {
+        'MAX_BYTES': 8 * 1024 * 1024,
+        'TIMEOUT': 300,
+    },
+}
+
+# Item-item neighbours built by `manage.py build_recommendations` (library.recommendations). The similarity
+# blocks stay within MEMORY_BUDGET bytes whatever the number of songs.
+RECOMMENDATIONS = {
+    'NEIGHBOURS': 50,
+    'MEMORY_BUDGET': 256 * 1024 * 1024,
+    'MAX_USER_SONGS': 500,
+}
+
+# Safe-method requests build request.user from the token and this per-process cache of user state instead of
+# loading the User row (users.authentication).
+STATELESS_AUTH = {
+    'MAX_USERS': 10000,
+    'TTL': 60,
+}
+
+# Bloom filter over the blacklisted refresh token JTIs (users.blacklist); `manage.py purge_token_blacklist`
+# deletes the expired entries.
+TOKEN_BLACKLIST_FILTER = {
+    'CAPACITY': 100_000,
+    'ERROR_RATE': 0.001,
+    'SYNC_INTERVAL': 1.0,
+    'REBUILD_INTERVAL': 3600,
+}
+
+# Query count, SQL time, duplicated queries, serialization time and response size of the last BUFFER_SIZE
+# requests of each process (instrumentation.RequestProfilingMiddleware), summed up per route by
+# api/v1/library/stats/requests/. Requests over SLOW_REQUEST_TIME seconds or SLOW_REQUEST_QUERIES queries are
+# logged as warnings and the last SLOW_LOG_SIZE of them kept. ENABLED False leaves the middleware out.
+REQUEST_PROFILING = {
+    'ENABLED': True,
+    'BUFFER_SIZE': 2000,
+    'SLOW_LOG_SIZE': 100,
+    'SLOW_REQUEST_TIME': 1.0,
+    'SLOW_REQUEST_QUERIES': 100,
+}
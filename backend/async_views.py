@@ -0,0 +1,44 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.functional import classproperty
+
+
+class AsyncReadMixin:
+    """
+    For APIViews with coroutine read handlers (aget) next to the sync ones. With settings.ASYNC_VIEWS, set
+    by the ASGI entry point, the view is async as a whole: coroutine handlers are awaited after
+    authentication and permission checks ran in a thread (they may query the database), methods without one
+    run through the regular APIView.dispatch in a thread. Otherwise the view is the plain sync APIView, a
+    WSGI server would run an async view in an event loop of its own per request.
+    Coroutine handlers must keep ORM calls off the event loop (async ORM or sync_to_async).
+    """
+
+    @classproperty
+    def view_is_async(cls):
+        return getattr(settings, 'ASYNC_VIEWS', False)
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, 'a' + method, None) if method in self.http_method_names else None
+        if handler is None:
+            return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
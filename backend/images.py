@@ -0,0 +1,254 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models.signals import post_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_DERIVATIVES = {
+    'SIZES': (64, 300, 640),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    'MAX_PENDING': 1000,
+    'READY_CACHE_SIZE': 10_000,
+    'RETRY_AFTER': 600,
+}
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+# (model, image field, readiness field) of every register_derivatives call
+_registered = []
+
+
+def derivative_settings() -> dict:
+    return {**DEFAULT_IMAGE_DERIVATIVES, **getattr(settings, 'IMAGE_DERIVATIVES', {})}
+
+
+def derivative_name(name: str, size: int, fmt: str) -> str:
+    """
+    Derivatives live next to the original: pictures/albums/cover.png -> pictures/albums/cover.64.webp
+    """
+    root, _ = os.path.splitext(name)
+    return f'{root}.{size}.{fmt}'
+
+
+def generate_derivatives(storage, name: str) -> list[str]:
+    """
+    Write the missing square derivatives of an image and return their names.
+    """
+    config = derivative_settings()
+    missing = [(size, fmt) for size in config['SIZES'] for fmt in config['FORMATS']
+               if not storage.exists(derivative_name(name, size, fmt))]
+    if not missing:
+        return []
+
+    with storage.open(name, 'rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGB')
+
+    written = []
+    # largest first so each resize starts from the smallest image that is still big enough
+    for size in sorted({size for size, _ in missing}, reverse=True):
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        for fmt in config['FORMATS']:
+            if (size, fmt) not in missing:
+                continue
+            buffer = BytesIO()
+            image.save(buffer, PIL_FORMATS[fmt], quality=config['QUALITY'], optimize=True)
+            # content-addressed storage would rename the derivative after its hash, it must keep its name
+            save = getattr(storage, 'save_exact', storage.save)
+            written.append(save(derivative_name(name, size, fmt), ContentFile(buffer.getvalue())))
+    return written
+
+
+def mark_ready(name: str) -> None:
+    """
+    Record on the rows showing the image name that its derivatives exist.
+    """
+    for model, field_name, ready_field in _registered:
+        model.objects.filter(**{field_name: name, ready_field: False}).update(**{ready_field: True})
+
+
+class DerivativePool:
+    """
+    Bounded background pool generating derivatives. Names already queued are not queued twice and
+    new work is dropped once max_pending names are waiting; a later save or read schedules it again.
+    The last ready_size names known to be ready are kept in an LRU, a name that failed is not tried
+    again for retry_after seconds.
+    """
+
+    def __init__(self, workers: int, max_pending: int, ready_size: int = 10_000, retry_after: float = 600):
+        self.max_pending = max_pending
+        self.ready_size = ready_size
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-derivatives')
+        self._pending = set()
+        self._ready = OrderedDict()
+        # name -> monotonic time it may be tried again
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ensure(self, storage, name: str, probe: bool = False, record: bool = False) -> bool:
+        """
+        True if the derivatives of name exist, otherwise schedule them and return False. With probe the
+        storage is checked even if name is known to be ready; with record, readiness found on the storage
+        is recorded on the rows in the background.
+        """
+        if not probe and self.is_ready(name):
+            return True
+        if self._failed_recently(name):
+            return False
+        config = derivative_settings()
+        if storage.exists(derivative_name(name, max(config['SIZES']), config['FORMATS'][-1])):
+            self._set_ready(name)
+            if record:
+                self._executor.submit(self._record, name)
+            return True
+        self.submit(storage, name)
+        return False
+
+    def submit(self, storage, name: str) -> bool:
+        with self._lock:
+            if name in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(name)
+        self._executor.submit(self._run, storage, name)
+        return True
+
+    def is_ready(self, name: str) -> bool:
+        with self._lock:
+            if name not in self._ready:
+                return False
+            self._ready.move_to_end(name)
+            return True
+
+    def _set_ready(self, name: str) -> None:
+        with self._lock:
+            self._ready[name] = None
+            self._ready.move_to_end(name)
+            while len(self._ready) > self.ready_size:
+                self._ready.popitem(last=False)
+
+    def _failed_recently(self, name: str) -> bool:
+        with self._lock:
+            retry_at = self._failed.get(name)
+            if retry_at is None:
+                return False
+            if retry_at > time.monotonic():
+                return True
+            del self._failed[name]
+            return False
+
+    def _fail(self, name):
+        # tried again after retry_after
+        with self._lock:
+            self._failed[name] = time.monotonic() + self.retry_after
+            while len(self._failed) > self.ready_size:
+                self._failed.popitem(last=False)
+
+    def _run(self, storage, name):
+        try:
+            generate_derivatives(storage, name)
+        except FileNotFoundError:
+            self._fail(name)
+            logger.warning('No derivatives of %s, the file is missing', name)
+        except UnidentifiedImageError:
+            self._fail(name)
+            logger.warning('No derivatives of %s, it is not an image', name)
+        except Exception:
+            self._fail(name)
+            logger.exception('Failed to generate derivatives of %s', name)
+        else:
+            self._set_ready(name)
+            self._record(name)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    @staticmethod
+    def _record(name):
+        try:
+            mark_ready(name)
+        except Exception:
+            logger.exception('Failed to record the derivatives of %s', name)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> DerivativePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = derivative_settings()
+            _pool = DerivativePool(config['WORKERS'], config['MAX_PENDING'], config['READY_CACHE_SIZE'],
+                                   config['RETRY_AFTER'])
+        return _pool
+
+
+def register_derivatives(model, field_name: str) -> None:
+    """
+    Generate derivatives in the background whenever an instance of model is saved with a picture. The
+    model has a <field_name>_derivatives_ready boolean, kept up to date with the saved picture.
+    """
+    ready_field = f'{field_name}_derivatives_ready'
+    default = model._meta.get_field(field_name).get_default()
+    _registered.append((model, field_name, ready_field))
+
+    def on_save(sender, instance, **kwargs):
+        field_file = getattr(instance, field_name)
+        if not field_file:
+            ready = False
+        elif field_file.name == default:
+            # shared by most rows, not probed on every save; reads schedule it and record it on the rows
+            ready = get_pool().is_ready(field_file.name)
+        else:
+            # recorded before the derivatives are scheduled, the pool then sets it once they are written
+            ready = get_pool().ensure(field_file.storage, field_file.name, probe=True)
+        if getattr(instance, ready_field) != ready:
+            model.objects.filter(pk=instance.pk).update(**{ready_field: ready})
+            setattr(instance, ready_field, ready)
+
+    post_save.connect(on_save, sender=model, weak=False,
+                      dispatch_uid=f'image-derivatives-{model._meta.label}-{field_name}')
+
+
+class ImageDerivativesField(serializers.Field):
+    """
+    Read-only {size: {format: url}} of an image's derivatives, or None while they are not generated yet
+    (they are then scheduled, which is how rows uploaded before the pipeline get theirs). Rows recording
+    that their derivatives are ready cost no storage lookup.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return super().get_attribute(instance), getattr(instance, f'{self.source}_derivatives_ready', False)
+
+    def to_representation(self, value):
+        value, ready = value
+        if not value:
+            return None
+        if not ready and not get_pool().ensure(value.storage, value.name, record=True):
+            return None
+
+        config = derivative_settings()
+        request = self.context.get('request', None)
+        derivatives = {}
+        for size in config['SIZES']:
+            derivatives[str(size)] = {}
+            for fmt in config['FORMATS']:
+                url = value.storage.url(derivative_name(value.name, size, fmt))
+                derivatives[str(size)][fmt] = request.build_absolute_uri(url) if request is not None else url
+        return derivatives
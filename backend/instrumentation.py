@@ -0,0 +1,263 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST_PROFILING = {
+    'ENABLED': True,
+    'BUFFER_SIZE': 2000,
+    'SLOW_LOG_SIZE': 100,
+    'SLOW_REQUEST_TIME': 1.0,
+    'SLOW_REQUEST_QUERIES': 100,
+}
+# duplicated queries kept per request, and how much of their SQL
+MAX_DUPLICATES = 5
+SIGNATURE_LENGTH = 300
+# IN lists of any length share a signature
+IN_LIST = re.compile(r'\(%s(?:, %s)*\)')
+
+_profile = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    __slots__ = ('queries', 'sql_time', 'statements', 'serialization_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.serialization_time = 0.0
+
+    def duplicates(self) -> tuple[tuple[str, int], ...]:
+        signatures = Counter()
+        for sql, count in self.statements.items():
+            signatures[IN_LIST.sub('(%s, ...)', sql)[:SIGNATURE_LENGTH]] += count
+        return tuple((signature, count) for signature, count in signatures.most_common(MAX_DUPLICATES)
+                     if count > 1)
+
+
+class RequestRecord(NamedTuple):
+    method: str
+    route: str
+    status: int
+    started_at: float
+    duration: float
+    queries: int
+    sql_time: float
+    # (signature, executions) of the queries run more than once
+    duplicates: tuple
+    serialization_time: float
+    # None for streamed responses of unknown length
+    response_size: int | None
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.sql_time += time.perf_counter() - started
+        profile.statements[sql] += 1
+
+
+def _install_query_recorder(sender=None, connection=None, **kwargs):
+    # first rather than last, a connection.execute_wrapper() block around the first query of a new
+    # connection pops the last wrapper on exit
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+@contextmanager
+def serializing():
+    """
+    Count the block as serialization time of the current request, less the queries it ran (lazy
+    relations still show up in the query count and SQL time).
+    """
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    started, sql_time = time.perf_counter(), profile.sql_time
+    try:
+        yield
+    finally:
+        profile.serialization_time += time.perf_counter() - started - (profile.sql_time - sql_time)
+
+
+class RequestLog:
+    """
+    The last size requests in a ring buffer, the last slow_size slow ones in another, per process.
+    """
+
+    def __init__(self, size: int, slow_size: int):
+        self._records = deque(maxlen=size)
+        self._slow = deque(maxlen=slow_size)
+        self._lock = threading.Lock()
+
+    def add(self, record: RequestRecord, slow: bool) -> None:
+        with self._lock:
+            self._records.append(record)
+            if slow:
+                self._slow.append(record)
+
+    def routes(self, order: str = 'total_time', limit: int = 20) -> list[dict]:
+        """
+        Per method and route, the requests in the buffer summed up, the top limit by order.
+        """
+        with self._lock:
+            records = list(self._records)
+        groups = {}
+        for record in records:
+            groups.setdefault((record.method, record.route), []).append(record)
+
+        routes = []
+        for (method, route), group in groups.items():
+            durations = sorted(record.duration for record in group)
+            sizes = [record.response_size for record in group if record.response_size is not None]
+            duplicates = Counter()
+            for record in group:
+                for signature, count in record.duplicates:
+                    duplicates[signature] += count
+            routes.append({
+                'method': method, 'route': route, 'requests': len(group),
+                'total_time': sum(durations),
+                'mean_time': sum(durations) / len(group),
+                'p95_time': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                'max_time': durations[-1],
+                'queries': sum(record.queries for record in group) / len(group),
+                'max_queries': max(record.queries for record in group),
+                'sql_time': sum(record.sql_time for record in group) / len(group),
+                'serialization_time': sum(record.serialization_time for record in group) / len(group),
+                'response_size': sum(sizes) / len(sizes) if sizes else None,
+                'duplicate_queries': sum(duplicates.values()),
+                'duplicates': [{'sql': signature, 'executions': count}
+                               for signature, count in duplicates.most_common(MAX_DUPLICATES)],
+            })
+        routes.sort(key=lambda route: route[order], reverse=True)
+        return routes[:limit]
+
+    def slow(self, limit: int = 20) -> list[dict]:
+        with self._lock:
+            records = list(self._slow)[-limit:]
+        return [{**record._asdict(), 'duplicates': [{'sql': signature, 'executions': count}
+                                                   for signature, count in record.duplicates]}
+                for record in reversed(records)]
+
+    def __len__(self):
+        return len(self._records)
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_request_log() -> RequestLog:
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                config = {**DEFAULT_REQUEST_PROFILING, **getattr(settings, 'REQUEST_PROFILING', {})}
+                _log = RequestLog(config['BUFFER_SIZE'], config['SLOW_LOG_SIZE'])
+    return _log
+
+
+class RequestProfilingMiddleware:
+    """
+    Records the query count, SQL time, duplicated queries, serialization time and response size of every
+    routed request into the RequestLog, and logs the slow ones. Queries are counted on every connection
+    through an execute wrapper reading the request's profile from a context variable, so those the async
+    views run in sync_to_async threads are counted too. The body of a streamed response is produced after
+    the request is recorded, its queries are not. With profiling disabled it is left out of the middleware
+    chain and no execute wrapper is installed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = {**DEFAULT_REQUEST_PROFILING, **getattr(settings, 'REQUEST_PROFILING', {})}
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.slow_time = config['SLOW_REQUEST_TIME']
+        self.slow_queries = config['SLOW_REQUEST_QUERIES']
+        self.log = get_request_log()
+
+        connection_created.connect(_install_query_recorder, dispatch_uid='instrumentation.query_recorder')
+        # connections opened before the middleware was loaded
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection=connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile, started = RequestProfile(), (time.time(), time.perf_counter())
+        token = _profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        self.record(request, response, profile, started)
+        return response
+
+    async def __acall__(self, request):
+        profile, started = RequestProfile(), (time.time(), time.perf_counter())
+        token = _profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        self.record(request, response, profile, started)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this, the rendering is serialization time
+        profile = _profile.get()
+        if profile is not None:
+            started, sql_time = time.perf_counter(), profile.sql_time
+
+            def rendered(response):
+                profile.serialization_time += time.perf_counter() - started - (profile.sql_time - sql_time)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, profile: RequestProfile, started: tuple[float, float]) -> None:
+        if request.resolver_match is None:
+            return
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        record = RequestRecord(
+            method=request.method, route=request.resolver_match.view_name, status=response.status_code,
+            started_at=started[0], duration=time.perf_counter() - started[1], queries=profile.queries,
+            sql_time=profile.sql_time, duplicates=profile.duplicates(),
+            serialization_time=profile.serialization_time, response_size=size,
+        )
+        slow = record.duration >= self.slow_time or record.queries >= self.slow_queries
+        self.log.add(record, slow)
+        if slow:
+            logger.warning('Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, %d duplicated, '
+                           '%.0f ms serializing, %s bytes', record.method, request.path, record.route,
+                           record.duration * 1000, record.queries, record.sql_time * 1000,
+                           sum(count for _, count in record.duplicates), record.serialization_time * 1000,
+                           size)
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from images import register_derivatives
+        from .blobs import register_blob_fields
+        from .models import Song, Album, Author
+        for model in (Song, Album, Author):
+            register_derivatives(model, 'picture')
+        register_blob_fields(Song, 'audio', 'picture')
+        register_blob_fields(Album, 'picture')
+        register_blob_fields(Author, 'picture')
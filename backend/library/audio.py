@@ -0,0 +1,263 @@
+from typing import NamedTuple
+
+READ, SKIP = 'read', 'skip'
+# how far past the tags an MP3 frame header is looked for
+MP3_SCAN_LIMIT = 64 * 1024
+PROBE_READ_SIZE = 4096
+
+MP3_VERSIONS = {0: 2.5, 2: 2, 3: 1}
+MP3_LAYERS = {1: 3, 2: 2, 3: 1}
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+
+class AudioInfo(NamedTuple):
+    duration: float | None = None
+    bitrate: int | None = None
+    sample_rate: int | None = None
+    channels: int | None = None
+
+
+def _parse(info: dict):
+    """
+    Generator reading container headers: yields (READ, n) to receive the next n bytes (fewer at the end
+    of the file) or (SKIP, n) to pass over n bytes, and fills info as it goes.
+    """
+    head = yield READ, 10
+    start = 0
+    if head[:3] == b'ID3' and len(head) == 10:
+        # ID3v2 tag: syncsafe size, plus a 10 byte footer when flagged
+        size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + size + (10 if head[5] & 0x10 else 0)
+        yield SKIP, start - 10
+        head = yield READ, 12
+    else:
+        head += yield READ, 2
+    if len(head) < 12:
+        return
+
+    if head[:4] == b'fLaC':
+        yield from _parse_flac(info, head, start)
+    elif head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        yield from _parse_wav(info, start + 12)
+    else:
+        yield from _parse_mp3(info, head, start)
+
+
+def _parse_flac(info, head, start):
+    # the first metadata block is always STREAMINFO (type 0, 34 bytes), head holds its first 4 bytes
+    if head[4] & 0x7f != 0:
+        return
+    streaminfo = head[8:12] + (yield READ, 30)
+    if len(streaminfo) < 34:
+        return
+    value = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = value >> 44
+    samples = value & ((1 << 36) - 1)
+    info['sample_rate'] = sample_rate or None
+    info['channels'] = ((value >> 41) & 0x7) + 1
+    info['audio_start'] = start
+    if sample_rate and samples:
+        info['duration'] = samples / sample_rate
+
+
+def _parse_wav(info, offset):
+    while True:
+        header = yield READ, 8
+        if len(header) < 8:
+            return
+        chunk_id, size = header[:4], int.from_bytes(header[4:8], 'little')
+        offset += 8
+        if chunk_id == b'fmt ' and size >= 16:
+            fmt = yield READ, 16
+            if len(fmt) < 16:
+                return
+            info['channels'] = int.from_bytes(fmt[2:4], 'little')
+            info['sample_rate'] = int.from_bytes(fmt[4:8], 'little')
+            byte_rate = int.from_bytes(fmt[8:12], 'little')
+            info['bitrate'] = byte_rate * 8 or None
+            yield SKIP, size - 16 + (size & 1)
+        elif chunk_id == b'data':
+            info['audio_start'] = offset
+            # streaming writers leave the size at 0 or 0xffffffff, the file size is used instead
+            if info.get('bitrate') and 0 < size < 0xffffffff:
+                info['duration'] = size * 8 / info['bitrate']
+            return
+        else:
+            yield SKIP, size + (size & 1)
+        offset += size + (size & 1)
+
+
+def _mp3_header(data: bytes) -> dict | None:
+    if len(data) < 4 or data[0] != 0xff or data[1] & 0xe0 != 0xe0:
+        return None
+    version = MP3_VERSIONS.get((data[1] >> 3) & 0x3)
+    layer = MP3_LAYERS.get((data[1] >> 1) & 0x3)
+    bitrate_index, rate_index = data[2] >> 4, (data[2] >> 2) & 0x3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    samples = 384 if layer == 1 else 1152 if layer == 2 or version == 1 else 576
+    padding = (data[2] >> 1) & 0x1
+    mono = data[3] >> 6 == 3
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': 1 if mono else 2,
+        'samples': samples,
+        'length': length,
+        'side_info': (17 if mono else 32) if version == 1 else (9 if mono else 17),
+    }
+
+
+def _same_stream(header, following) -> bool:
+    return following is not None and all(header[key] == following[key] for key in ('version', 'layer', 'sample_rate'))
+
+
+def _parse_mp3(info, buffer, start):
+    position, eof = 0, False
+    while True:
+        position = buffer.find(b'\xff', position)
+        if position == -1:
+            position = len(buffer)
+        elif position + 4 <= len(buffer):
+            header = _mp3_header(buffer[position:position + 4])
+            if header is None:
+                position += 1
+                continue
+            # random bytes often look like one frame header, the next frame must start with a matching one
+            following = position + header['length']
+            if following + 4 <= len(buffer):
+                if _same_stream(header, _mp3_header(buffer[following:following + 4])):
+                    break
+                position += 1
+                continue
+            if eof and position == 0:
+                break
+        if eof or len(buffer) > MP3_SCAN_LIMIT:
+            return
+        more = yield READ, PROBE_READ_SIZE
+        eof = len(more) < PROBE_READ_SIZE
+        buffer += more
+
+    info.update(sample_rate=header['sample_rate'], channels=header['channels'], audio_start=start + position)
+    # a Xing/Info (LAME) or VBRI tag in the first frame holds the frame count of VBR files
+    xing = position + 4 + header['side_info']
+    vbri = position + 4 + 32
+    needed = max(xing, vbri) + 18 - len(buffer)
+    if needed > 0:
+        buffer += yield READ, needed
+    frames = None
+    if buffer[xing:xing + 4] in (b'Xing', b'Info') and len(buffer) >= xing + 12 and buffer[xing + 7] & 0x1:
+        frames = int.from_bytes(buffer[xing + 8:xing + 12], 'big')
+    elif buffer[vbri:vbri + 4] == b'VBRI' and len(buffer) >= vbri + 18:
+        frames = int.from_bytes(buffer[vbri + 14:vbri + 18], 'big')
+    if frames:
+        info['duration'] = frames * header['samples'] / header['sample_rate']
+    else:
+        info['bitrate'] = header['bitrate']
+
+
+class AudioProbe:
+    """
+    Incremental container header parser for MP3 (ID3v2, Xing/VBRI), FLAC and WAV. Chunks are fed as they
+    arrive; only the bytes the parser asked for are buffered and skipped regions are never kept.
+    """
+
+    def __init__(self):
+        self._info = {}
+        self._buffer = bytearray()
+        self._parser = _parse(self._info)
+        self._request = next(self._parser)
+
+    @property
+    def done(self) -> bool:
+        return self._parser is None
+
+    def feed(self, data: bytes) -> None:
+        position = 0
+        while self._parser is not None and position < len(data):
+            kind, size = self._request
+            if kind == SKIP:
+                step = min(size, len(data) - position)
+                position += step
+                if step < size:
+                    self._request = SKIP, size - step
+                    continue
+                self._send(None)
+            else:
+                step = size - len(self._buffer)
+                self._buffer += data[position:position + step]
+                position += step
+                if len(self._buffer) == size:
+                    chunk = bytes(self._buffer)
+                    self._buffer.clear()
+                    self._send(chunk)
+
+    def _send(self, value):
+        try:
+            self._request = self._parser.send(value)
+            if self._request[0] == SKIP and self._request[1] <= 0:
+                self._send(None)
+        except StopIteration:
+            self._parser = None
+        except Exception:
+            # a malformed header only leaves the metadata unknown, it never fails the upload
+            self._parser = None
+
+    def result(self, size: int) -> AudioInfo:
+        """
+        Finish the probe of a file of the given size. Durations the headers did not give (constant bitrate
+        MP3, WAV written as a stream) and average bitrates are derived from the size.
+        """
+        if self._parser is not None:
+            # the file ended inside a header, whatever was parsed so far is kept
+            if self._request[0] == READ:
+                chunk = bytes(self._buffer)
+                self._buffer.clear()
+                self._send(chunk)
+            self._parser = None
+
+        info = self._info
+        audio_size = size - info.get('audio_start', 0)
+        duration, bitrate = info.get('duration'), info.get('bitrate')
+        if duration is None and bitrate and audio_size > 0:
+            duration = audio_size * 8 / bitrate
+        if bitrate is None and duration:
+            bitrate = round(audio_size * 8 / duration)
+        return AudioInfo(duration=duration, bitrate=bitrate, sample_rate=info.get('sample_rate'),
+                         channels=info.get('channels'))
+
+
+def probe_file(file) -> AudioInfo:
+    """
+    Probe a stored or uploaded file, reading only its headers.
+    """
+    probe = AudioProbe()
+    file.seek(0)
+    while not probe.done:
+        kind, size = probe._request
+        if kind == SKIP:
+            file.seek(size, 1)
+            probe._send(None)
+            continue
+        data = file.read(max(size - len(probe._buffer), 1))
+        if not data:
+            break
+        probe.feed(data)
+    file.seek(0)
+    return probe.result(file.size)
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.utils import timezone
+
+from .models import Blob
+from utils import increment_counters
+
+BLOB_PREFIX = 'blobs/'
+BLOB_GRACE_PERIOD = timedelta(hours=1)
+
+
+def is_blob_name(name: str | None) -> bool:
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def blob_name(digest: str, extension: str) -> str:
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def touch_blob(name: str, size: int) -> None:
+    # marks the blob as just used so gc_blobs leaves it alone while the row referencing it is saved
+    now = timezone.now()
+    if not Blob.objects.filter(name=name).update(last_used_at=now):
+        Blob.objects.bulk_create([Blob(name=name, size=size, last_used_at=now)], ignore_conflicts=True)
+
+
+def touch_blobs(sizes: dict[str, int], batch_size: int = 500) -> None:
+    """
+    touch_blob for many {name: size} at once.
+    """
+    now = timezone.now()
+    Blob.objects.bulk_create([Blob(name=name, size=size, last_used_at=now) for name, size in sizes.items()],
+                             batch_size=batch_size, update_conflicts=True, unique_fields=['name'],
+                             update_fields=['last_used_at'])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every upload once, under the SHA-256 of its content (blobs/ab/cd/<sha256><ext>), whatever name
+    the client sent. The content is hashed while it is copied to a temporary file that is then renamed into
+    place, or discarded when the blob already exists. Content already in a temporary file is moved instead.
+    """
+
+    def save_exact(self, name, content):
+        """
+        Store content under name as is, for files derived from a stored file (image derivatives).
+        """
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        digest, hexdigest, size = hashlib.sha256(), None, 0
+
+        on_disk = hasattr(content, 'temporary_file_path')
+        if on_disk and getattr(content, 'sha256', None):
+            # hashed while it was received (library.uploads.AudioUploadHandler), nothing to read
+            source, hexdigest, size = content.temporary_file_path(), content.sha256, content.size
+        elif on_disk:
+            # already on disk (large or chunked uploads): hash it in place and move it, no copy
+            source = content.temporary_file_path()
+            for chunk in content.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+        else:
+            tmp_dir = self.path(BLOB_PREFIX + 'tmp')
+            os.makedirs(tmp_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            source = tmp.name
+
+        name = blob_name(hexdigest or digest.hexdigest(), extension)
+        # touched before the file is looked at: collect_garbage deletes the file before its row delete
+        # commits, so once the touch went through an existing file stays and a collected one is gone
+        touch_blob(name, size)
+        path = self.path(name)
+        if os.path.exists(path):
+            if not on_disk:
+                os.unlink(source)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file_move_safe(source, path)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+        return name
+
+    def delete_blob(self, name: str) -> None:
+        """
+        Delete a blob and everything derived from it (files named <sha256>.*).
+        """
+        directory, filename = posixpath.split(name)
+        digest = os.path.splitext(filename)[0]
+        _, files = self.listdir(directory) if self.exists(directory) else ([], [])
+        for file in files:
+            if file == filename or file.startswith(digest + '.'):
+                self.delete(posixpath.join(directory, file))
+
+
+def _loaded_names(instance, field_names) -> dict:
+    # only fields already loaded are read, deferred ones must not trigger a query per instance
+    names = {}
+    for field_name in field_names:
+        if field_name in instance.__dict__:
+            value = instance.__dict__[field_name]
+            names[field_name] = getattr(value, 'name', value) or None
+    return names
+
+
+def register_blob_fields(model, *field_names) -> None:
+    """
+    Keep Blob.refcount in line with the blob names referenced by model's file fields. Saves and deletes
+    of single instances are tracked; bulk operations must adjust refcounts themselves.
+    """
+    uid = f'blob-refcount-{model._meta.label}'
+
+    def on_init(sender, instance, **kwargs):
+        instance._blob_names = _loaded_names(instance, field_names)
+
+    def on_save(sender, instance, created, **kwargs):
+        old = getattr(instance, '_blob_names', {}) if not created else {}
+        new = _loaded_names(instance, field_names)
+        changes = defaultdict(int)
+        for field, name in new.items():
+            if created or (field in old and old[field] != name):
+                if is_blob_name(name):
+                    changes[(name,)] += 1
+                if is_blob_name(old.get(field)):
+                    changes[(old[field],)] -= 1
+        increment_counters(Blob, ('name',), {key: n for key, n in changes.items() if n}, count_field='refcount')
+        instance._blob_names = new
+
+    def on_delete(sender, instance, **kwargs):
+        changes = defaultdict(int)
+        for name in getattr(instance, '_blob_names', {}).values():
+            if is_blob_name(name):
+                changes[(name,)] -= 1
+        increment_counters(Blob, ('name',), changes, count_field='refcount')
+
+    post_init.connect(on_init, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(on_save, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(on_delete, sender=model, weak=False, dispatch_uid=uid)
+
+
+def collect_garbage(grace_period: timedelta = BLOB_GRACE_PERIOD, storage=None) -> int:
+    """
+    Delete blobs nothing references any more and that were not used within the grace period.
+    Returns the number of blobs deleted.
+    """
+    storage = storage or default_storage
+    cutoff = timezone.now() - grace_period
+    deleted = 0
+    for blob in Blob.objects.filter(refcount__lte=0, last_used_at__lt=cutoff).iterator():
+        with transaction.atomic():
+            if not Blob.objects.filter(pk=blob.pk, refcount__lte=0, last_used_at__lt=cutoff).delete()[0]:
+                continue
+            if hasattr(storage, 'delete_blob'):
+                storage.delete_blob(blob.name)
+            else:
+                storage.delete(blob.name)
+            deleted += 1
+    return deleted
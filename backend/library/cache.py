@@ -0,0 +1,240 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+from instrumentation import serializing
+
+SONG, ALBUM, AUTHOR = 'song', 'album', 'author'
+
+DEFAULT_RESPONSE_CACHE = {
+    'BACKEND': 'library.cache.LocalLRUBackend',
+    'OPTIONS': {},
+}
+
+
+def _initial_version() -> int:
+    # a version key lost to eviction must not restart at a number older entries were stored under
+    return time.time_ns()
+
+
+class LocalLRUBackend:
+    """
+    In-process cache evicting the least recently used entries once max_bytes of payload are stored, and
+    the least recently used versions beyond max_versions. Versions are per process and a worker does not
+    see the bumps of the others, so entries also expire after timeout seconds, which bounds how stale
+    another worker can be.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, timeout: float | None = 300,
+                 max_versions: int = 100_000):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_versions = max_versions
+        self.size = 0
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                self.size -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            expires = time.monotonic() + self.timeout if self.timeout is not None else None
+            self._entries[key] = (expires, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_version(self, key: str) -> int:
+        with self._lock:
+            version = self._versions.get(key)
+            if version is not None:
+                self._versions.move_to_end(key)
+                return version
+            version = self._versions[key] = _initial_version()
+            self._trim_versions()
+            return version
+
+    def bump_version(self, key: str) -> None:
+        with self._lock:
+            version = self._versions.pop(key, None)
+            self._versions[key] = (version or _initial_version()) + 1
+            self._trim_versions()
+
+    def _trim_versions(self):
+        # a dropped version restarts above every value it had, the entries stored under it become unreachable
+        while len(self._versions) > self.max_versions:
+            self._versions.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.size = 0
+
+
+class DjangoCacheBackend:
+    """
+    Entries and versions in one of settings.CACHES, shared by every process using that cache.
+    """
+
+    def __init__(self, alias: str = 'default', timeout: int | None = 3600):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key: str) -> bytes | None:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.cache.set(key, value, self.timeout)
+
+    def get_version(self, key: str) -> int:
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, _initial_version(), None)
+            version = self.cache.get(key)
+        return version
+
+    def bump_version(self, key: str) -> None:
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, _initial_version(), None)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+
+def _complete(data) -> bool:
+    # picture derivatives come out as None while they are generated, such a response must not be kept
+    if isinstance(data, dict):
+        if data.get('picture') and 'picture_derivatives' in data and data['picture_derivatives'] is None:
+            return False
+        return all(_complete(value) for value in data.values())
+    if isinstance(data, list):
+        return all(_complete(value) for value in data)
+    return True
+
+
+class ResponseCache:
+    """
+    Rendered detail responses keyed by object and a per-object version. Changing an object bumps its
+    version (library.signals), which makes every entry stored for it unreachable; they age out of the
+    backend on their own. Looking up an entry costs no database query.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+        self.renderer = JSONRenderer()
+
+    def respond(self, request, kind: str, pk, build) -> HttpResponse:
+        """
+        The cached response for the object, or build() -> serializer data rendered and cached.
+        """
+        key, body = self._lookup(request, kind, pk)
+        if body is not None:
+            return self._response(body, 'HIT')
+        with serializing():
+            return self._store(key, build())
+
+    async def arespond(self, request, kind: str, pk, build) -> HttpResponse:
+        """
+        respond() for async views, build is a coroutine function.
+        """
+        if isinstance(self.backend, LocalLRUBackend):
+            key, body = self._lookup(request, kind, pk)
+        else:
+            # a shared cache is network I/O, kept off the event loop
+            key, body = await sync_to_async(self._lookup)(request, kind, pk)
+        if body is not None:
+            return self._response(body, 'HIT')
+        with serializing():
+            data = await build()
+            if isinstance(self.backend, LocalLRUBackend):
+                return self._store(key, data)
+            return await sync_to_async(self._store)(key, data)
+
+    def _lookup(self, request, kind: str, pk) -> tuple[str, bytes | None]:
+        # the version is read before the object is loaded, so a concurrent change can only leave an
+        # entry under the version it makes obsolete
+        version = self.backend.get_version(f'version:{kind}:{pk}')
+        # absolute media urls depend on the host the request came in on
+        key = f'response:{kind}:{pk}:{version}:{request.scheme}://{request.get_host()}'
+
+        body = self.backend.get(key)
+        if body is not None:
+            self.hits[kind] += 1
+        else:
+            self.misses[kind] += 1
+        return key, body
+
+    def _store(self, key: str, data) -> HttpResponse:
+        body = self.renderer.render(data)
+        if _complete(data):
+            self.backend.set(key, body)
+        return self._response(body, 'MISS')
+
+    def bump(self, kind: str, *pks) -> None:
+        def bump():
+            for pk in pks:
+                self.backend.bump_version(f'version:{kind}:{pk}')
+        # readers must not cache the old rows under the new version before they are committed
+        transaction.on_commit(bump)
+
+    def stats(self) -> dict:
+        stats = {}
+        for kind in (SONG, ALBUM, AUTHOR):
+            hits, misses = self.hits[kind], self.misses[kind]
+            stats[kind] = {'hits': hits, 'misses': misses,
+                           'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None}
+        if isinstance(self.backend, LocalLRUBackend):
+            stats['bytes'] = self.backend.size
+        return stats
+
+    @staticmethod
+    def _response(body, status):
+        response = HttpResponse(body, content_type='application/json')
+        response['X-Cache'] = status
+        return response
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = {**DEFAULT_RESPONSE_CACHE, **getattr(settings, 'RESPONSE_CACHE', {})}
+                options = {key.lower(): value for key, value in config['OPTIONS'].items()}
+                _cache = ResponseCache(import_string(config['BACKEND'])(**options))
+    return _cache
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import ChartEntry, ChartTotal, ChartWatermark, Genre, Granularity, PlayEvent, RollupWatermark, \
+    SongPlayRollup
+from .rollups import bucket_start, PLAYS_WATERMARK
+from utils import increment_counters
+
+CHART_SIZE = 100
+
+# window name -> (rollup granularity it is summed from, length)
+CHART_WINDOWS = {
+    'day': (Granularity.HOUR, timedelta(hours=24)),
+    'week': (Granularity.DAY, timedelta(days=7)),
+    'month': (Granularity.DAY, timedelta(days=30)),
+}
+
+
+def top_songs(window: str, genre_id: int | None = None, size: int = CHART_SIZE,
+              now: datetime | None = None) -> list[dict]:
+    """
+    Rank songs by plays in the window, summing SongPlayRollup buckets instead of raw play events.
+    """
+    granularity, length = CHART_WINDOWS[window]
+    start = bucket_start((now or timezone.now()) - length, granularity)
+
+    rollups = SongPlayRollup.objects.filter(granularity=granularity, bucket__gte=start)
+    if genre_id is not None:
+        rollups = rollups.filter(song__genres=genre_id)
+    return list(rollups.values('song_id').annotate(plays=Sum('count')).order_by('-plays', 'song_id')[:size])
+
+
+def _add_totals(window: str, rows) -> None:
+    increment_counters(ChartTotal, ('window', 'song_id'), {(window, row['song_id']): row['n'] for row in rows},
+                       count_field='plays')
+
+
+def _advance_totals(window: str, now: datetime) -> None:
+    """
+    Bring the ChartTotals of window up to the rolled up plays and the window ending at now: add the play
+    events folded into the rollups since the last refresh, subtract the buckets that left the window.
+    The first refresh of a window sums its buckets.
+    """
+    granularity, length = CHART_WINDOWS[window]
+    start = bucket_start(now - length, granularity)
+    # rollup_plays holds this lock while it folds, the rollups stay as of rollups.last_id until the commit
+    rollups, _ = RollupWatermark.objects.select_for_update().get_or_create(name=PLAYS_WATERMARK)
+    state = ChartWatermark.objects.select_for_update().filter(window=window).first()
+
+    if state is None:
+        ChartTotal.objects.filter(window=window).delete()
+        _add_totals(window, SongPlayRollup.objects.filter(granularity=granularity, bucket__gte=start)
+                    .values('song_id').annotate(n=Sum('count')))
+        ChartWatermark.objects.create(window=window, start=start, last_id=rollups.last_id)
+        return
+
+    if rollups.last_id > state.last_id:
+        # within the window of the last refresh, the buckets leaving it are subtracted with these plays in
+        _add_totals(window, PlayEvent.objects.filter(id__gt=state.last_id, id__lte=rollups.last_id,
+                                                     played_at__gte=state.start)
+                    .values('song_id').annotate(n=Count('id')))
+        state.last_id = rollups.last_id
+    if start > state.start:
+        rows = SongPlayRollup.objects.filter(granularity=granularity, bucket__gte=state.start, bucket__lt=start) \
+            .values('song_id').annotate(n=Sum('count'))
+        _add_totals(window, ({'song_id': row['song_id'], 'n': -row['n']} for row in rows))
+        ChartTotal.objects.filter(window=window, plays__lte=0).delete()
+        state.start = start
+    state.save()
+
+
+def refresh_charts(windows=None, size: int = CHART_SIZE) -> int:
+    """
+    Update the play totals of every window incrementally, rank the global and per-genre charts from them
+    and swap them in atomically. Returns the number of entries.
+    """
+    now = timezone.now()
+    windows = list(windows or CHART_WINDOWS)
+    genre_ids = [None, *Genre.objects.values_list('id', flat=True)]
+    entries = []
+    with transaction.atomic():
+        for window in windows:
+            _advance_totals(window, now)
+            totals = ChartTotal.objects.filter(window=window)
+            for genre_id in genre_ids:
+                rows = totals if genre_id is None else totals.filter(song__genres=genre_id)
+                for rank, (song_id, plays) in enumerate(
+                        rows.order_by('-plays', 'song_id').values_list('song_id', 'plays')[:size], start=1):
+                    entries.append(ChartEntry(window=window, genre_id=genre_id, rank=rank, song_id=song_id,
+                                              plays=plays, computed_at=now))
+
+        ChartEntry.objects.filter(window__in=windows).delete()
+        ChartEntry.objects.bulk_create(entries, batch_size=500)
+    return len(entries)
@@ -0,0 +1,125 @@
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Prefetch
+from django.utils import timezone
+
+from .models import Song, Album, Author, Genre, PlayEvent
+from playlists.models import Playlist, Collection, SongPlaylist, SongCollection
+
+EXPORT_CHUNK_SIZE = 2000
+# rows are stamped before their transaction commits, the next export reads the last minute again
+EXPORT_OVERLAP = timedelta(minutes=1)
+WRITE_SIZE = 64 * 1024
+
+
+class Watermark(NamedTuple):
+    # rows updated after since (everything if None) and plays after after_play_id
+    since: datetime | None = None
+    after_play_id: int = 0
+
+
+class CatalogExport:
+    """
+    The catalog (genres, authors, albums, songs with their authors, album and genres), plays, playlists and
+    liked songs as NDJSON records, {"type": ..., ...} one per line. Tables are read chunk_size rows at a
+    time, with the prefetches of every chunk, so memory does not grow with the tables. The last record is
+    the watermark to pass to the next export, which then only holds the rows changed since; records may
+    repeat across exports and are meant to be upserted by type and id. Deletions are not exported.
+    """
+
+    def __init__(self, watermark: Watermark = Watermark(), chunk_size: int = EXPORT_CHUNK_SIZE):
+        self.watermark = watermark
+        self.chunk_size = chunk_size
+        self.until = timezone.now()
+        last_play_id = PlayEvent.objects.aggregate(Max('id'))['id__max'] or 0
+        self.next_watermark = Watermark(self.until - EXPORT_OVERLAP, max(last_play_id, watermark.after_play_id))
+        self.counts = Counter()
+
+    def _changed(self, queryset):
+        queryset = queryset.filter(updated_at__lte=self.until)
+        if self.watermark.since is not None:
+            queryset = queryset.filter(updated_at__gt=self.watermark.since)
+        return queryset.order_by('id')
+
+    def _records(self):
+        for genre in Genre.objects.order_by('id').values('id', 'title').iterator(self.chunk_size):
+            yield 'genre', genre
+        fields = ('id', 'title', 'user_id', 'created_at', 'updated_at')
+        for author in self._changed(Author.objects.all()).values(*fields).iterator(self.chunk_size):
+            yield 'author', author
+        for album in self._changed(Album.objects.all()).values(*fields, 'author_id').iterator(self.chunk_size):
+            yield 'album', album
+
+        songs = self._changed(Song.objects.select_related('album').only(
+            'id', 'title', 'audio', 'picture', 'user_id', 'created_at', 'updated_at', 'duration', 'bitrate',
+            'sample_rate', 'channels', 'album__id', 'album__title',
+        )).prefetch_related(Prefetch('authors', queryset=Author.objects.only('id', 'title')), 'genres')
+        for song in songs.iterator(self.chunk_size):
+            yield 'song', {
+                'id': song.id, 'title': song.title, 'audio': song.audio.name, 'picture': song.picture.name,
+                'user_id': song.user_id, 'created_at': song.created_at, 'updated_at': song.updated_at,
+                'duration': song.duration, 'bitrate': song.bitrate, 'sample_rate': song.sample_rate,
+                'channels': song.channels, 'album': {'id': song.album.id, 'title': song.album.title},
+                'authors': [{'id': author.id, 'title': author.title} for author in song.authors.all()],
+                'genres': [{'id': genre.id, 'title': genre.title} for genre in song.genres.all()],
+            }
+
+        plays = PlayEvent.objects.filter(id__gt=self.watermark.after_play_id,
+                                         id__lte=self.next_watermark.after_play_id).order_by('id')
+        for play in plays.values('id', 'user_id', 'song_id', 'played_at').iterator(self.chunk_size):
+            yield 'play', play
+
+        playlists = self._changed(Playlist.objects.only('id', 'title', 'user_id', 'revision', 'updated_at')) \
+            .prefetch_related(Prefetch('songplaylist_set', queryset=SongPlaylist.objects.order_by('position')
+                                       .only('playlist_id', 'song_id')))
+        for playlist in playlists.iterator(self.chunk_size):
+            yield 'playlist', {
+                'id': playlist.id, 'title': playlist.title, 'user_id': playlist.user_id,
+                'revision': playlist.revision, 'updated_at': playlist.updated_at,
+                'songs': [row.song_id for row in playlist.songplaylist_set.all()],
+            }
+        collections = self._changed(Collection.objects.only('id', 'user_id', 'revision', 'updated_at')) \
+            .prefetch_related(Prefetch('songcollection_set', queryset=SongCollection.objects
+                                       .order_by('created_at', 'id').only('collection_id', 'song_id')))
+        for collection in collections.iterator(self.chunk_size):
+            yield 'collection', {
+                'id': collection.id, 'user_id': collection.user_id, 'revision': collection.revision,
+                'updated_at': collection.updated_at,
+                'songs': [row.song_id for row in collection.songcollection_set.all()],
+            }
+
+        yield 'watermark', self.next_watermark._asdict()
+
+    def lines(self):
+        for kind, record in self._records():
+            self.counts[kind] += 1
+            yield json.dumps({'type': kind, **record}, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+    def chunks(self, compress: bool = False):
+        """
+        The lines encoded in blocks of about WRITE_SIZE bytes, gzipped if compress.
+        """
+        # wbits 31: a gzip member rather than a raw zlib stream
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        block, size = [], 0
+        for line in self.lines():
+            data = line.encode()
+            block.append(data)
+            size += len(data)
+            if size >= WRITE_SIZE:
+                data = b''.join(block)
+                block, size = [], 0
+                if compressor is not None:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+        data = b''.join(block)
+        if compressor is not None:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
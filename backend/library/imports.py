@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from typing import NamedTuple
+
+from django.db import transaction
+
+from . import typeahead
+from .audio import AudioProbe, AudioInfo
+from .blobs import BLOB_PREFIX, blob_name, touch_blobs
+from .cache import get_response_cache, ALBUM, AUTHOR
+from .models import Song, Album, Author, Genre, Blob
+from .search import index_songs
+from .tags import Tags, read_tags
+from utils import increment_counters
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav')
+READ_SIZE = 1024 * 1024
+UNKNOWN_AUTHOR = 'Unknown artist'
+UNKNOWN_ALBUM = 'Unknown album'
+TITLE_LENGTH = Song._meta.get_field('title').max_length
+GENRE_LENGTH = Genre._meta.get_field('title').max_length
+
+
+class ImportedFile(NamedTuple):
+    # path relative to the import root, as the manifest knows it
+    path: str
+    size: int
+    mtime: int
+    audio: str
+    audio_info: AudioInfo
+    # without the picture, which is stored on its own
+    tags: Tags
+    picture: str | None
+    picture_size: int
+    # where the audio and the cover art are until place_files() puts them under their blob names: temporary
+    # copies, or the source file itself when it is linked
+    audio_source: str | None = None
+    picture_source: str | None = None
+
+
+def scan(root: str):
+    """
+    (path relative to root, size, mtime) of the audio files under root, in a stable order.
+    """
+    for directory, directories, files in os.walk(root):
+        directories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                yield os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns
+
+
+def _place(source: str, media_root: str, name: str) -> None:
+    # blobs are renamed or linked into place, a reader never sees a partial file
+    path = os.path.join(media_root, name)
+    if os.path.exists(path):
+        os.unlink(source)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(source, path)
+
+
+def _link(source: str, media_root: str, name: str) -> None:
+    path = os.path.join(media_root, name)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(source, path)
+    except FileExistsError:
+        pass
+    except OSError:
+        # on another filesystem, copied instead
+        descriptor, tmp = tempfile.mkstemp(dir=os.path.join(media_root, BLOB_PREFIX + 'tmp'))
+        os.close(descriptor)
+        shutil.copyfile(source, tmp)
+        _place(tmp, media_root, name)
+
+
+def _stage_bytes(data: bytes, extension: str, media_root: str) -> tuple[str, str]:
+    name = blob_name(hashlib.sha256(data).hexdigest(), extension)
+    with tempfile.NamedTemporaryFile(dir=os.path.join(media_root, BLOB_PREFIX + 'tmp'), delete=False) as tmp:
+        tmp.write(data)
+    return name, tmp.name
+
+
+def read_file(root: str, path: str, media_root: str, link: bool) -> ImportedFile:
+    """
+    Run in an import worker process: read the tags of root/path, hash and probe the file while it is
+    copied to a temporary file (read before it is linked), and write its cover art to another. Nothing is
+    written to the database, the parent places the files with place_files().
+    """
+    source = os.path.join(root, path)
+    os.makedirs(os.path.join(media_root, BLOB_PREFIX + 'tmp'), exist_ok=True)
+    digest, probe = hashlib.sha256(), AudioProbe()
+    copy = None if link else tempfile.NamedTemporaryFile(dir=os.path.join(media_root, BLOB_PREFIX + 'tmp'),
+                                                         delete=False)
+    try:
+        with open(source, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            tags = read_tags(file, stat.st_size)
+            while chunk := file.read(READ_SIZE):
+                digest.update(chunk)
+                probe.feed(chunk)
+                if copy is not None:
+                    copy.write(chunk)
+        if copy is not None:
+            copy.close()
+    except BaseException:
+        if copy is not None:
+            copy.close()
+            os.unlink(copy.name)
+        raise
+
+    name = blob_name(digest.hexdigest(), os.path.splitext(path)[1].lower())
+    picture, picture_source = (_stage_bytes(tags.picture, tags.picture_extension, media_root) if tags.picture
+                               else (None, None))
+    return ImportedFile(path=path, size=stat.st_size, mtime=stat.st_mtime_ns, audio=name,
+                        audio_info=probe.result(stat.st_size), tags=tags._replace(picture=None),
+                        picture=picture, picture_size=len(tags.picture) if tags.picture else 0,
+                        audio_source=source if link else copy.name, picture_source=picture_source)
+
+
+def place_files(files: list[ImportedFile], media_root: str, link: bool) -> None:
+    """
+    Put the files read by read_file under their blob names. The blob rows are touched first, in the
+    process holding the database, before an existing blob is reused, as ContentAddressedStorage does, so
+    gc_blobs cannot collect it in between.
+    """
+    sizes = {}
+    for file in files:
+        sizes[file.audio] = file.size
+        if file.picture:
+            sizes[file.picture] = file.picture_size
+    touch_blobs(sizes)
+    for file in files:
+        if link:
+            _link(file.audio_source, media_root, file.audio)
+        else:
+            _place(file.audio_source, media_root, file.audio)
+        if file.picture:
+            _place(file.picture_source, media_root, file.picture)
+
+
+class Manifest:
+    """
+    The files of an import root already in the library, a JSON line each, so an interrupted import
+    resumes without reading them again. A file is read again once its size or mtime changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a+', encoding='utf-8') as file:
+            file.seek(0)
+            content = file.read()
+            # the last line may have been cut short by a crash
+            if content and not content.endswith('\n'):
+                file.write('\n')
+        for line in content.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self.done[entry['path']] = (entry['size'], entry['mtime'])
+
+    def __contains__(self, file: tuple) -> bool:
+        path, size, mtime = file
+        return self.done.get(path) == (size, mtime)
+
+    def add(self, files: list[ImportedFile]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as manifest:
+            for file in files:
+                manifest.write(json.dumps({'path': file.path, 'size': file.size, 'mtime': file.mtime}) + '\n')
+                self.done[file.path] = (file.size, file.mtime)
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+
+class LibraryImporter:
+    """
+    Inserts the songs of imported files in batches, a few bulk INSERTs per batch. Authors, albums and genres
+    are looked up in maps loaded once, the user's own authors and albums are reused by title. The signals
+    bulk_create skips are made up for: blob refcounts, the search index, the typeahead suggestions of the new
+    rows and the response cache versions of the albums and authors that got songs. Waveforms are left to
+    compute_waveforms.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.authors, self.albums = {}, {}
+        for pk, title in Author.objects.filter(user=user).order_by('id').values_list('id', 'title'):
+            self.authors.setdefault(title, pk)
+        for pk, author_id, title in (Album.objects.filter(user=user).order_by('id')
+                                     .values_list('id', 'author_id', 'title')):
+            self.albums.setdefault((author_id, title), pk)
+        self.genres = dict(Genre.objects.values_list('title', 'id'))
+        self.imported = self.duplicates = 0
+
+    def _create_authors(self, titles) -> None:
+        missing = list(dict.fromkeys(title for title in titles if title not in self.authors))
+        for author in Author.objects.bulk_create([Author(title=title, user=self.user) for title in missing]):
+            self.authors[author.title] = author.id
+
+    def _create_albums(self, albums: dict) -> Counter:
+        # albums {(author id, title): cover}, the first song's cover art becomes the album's
+        missing = {key: picture for key, picture in albums.items() if key not in self.albums}
+        created = Album.objects.bulk_create([
+            Album(title=title, user=self.user, author_id=author_id, **({'picture': picture} if picture else {}))
+            for (author_id, title), picture in missing.items()])
+        for album in created:
+            self.albums[(album.author_id, album.title)] = album.id
+        return Counter(picture for picture in missing.values() if picture)
+
+    def _create_genres(self, titles) -> None:
+        missing = list(dict.fromkeys(title for title in titles if title not in self.genres))
+        if missing:
+            # unique titles, another import may have created some of them since the map was loaded
+            Genre.objects.bulk_create([Genre(title=title) for title in missing], ignore_conflicts=True)
+            self.genres.update(Genre.objects.filter(title__in=missing).values_list('title', 'id'))
+
+    @transaction.atomic
+    def add(self, files: list[ImportedFile]) -> None:
+        """
+        Insert the songs of files, except those whose audio the user already has: files of a batch that
+        was committed before the manifest was written, and the same content found twice.
+        """
+        existing = set(Song.objects.filter(user=self.user, audio__in=[file.audio for file in files])
+                       .values_list('audio', flat=True))
+        new = []
+        for file in files:
+            if file.audio in existing:
+                self.duplicates += 1
+                continue
+            existing.add(file.audio)
+            new.append(file)
+        if not new:
+            return
+
+        artists = [[title[:TITLE_LENGTH] for title in file.tags.artists] or [UNKNOWN_AUTHOR] for file in new]
+        new_authors = {title for titles in artists for title in titles if title not in self.authors}
+        self._create_authors(title for titles in artists for title in titles)
+        album_keys = [(self.authors[titles[0]], (file.tags.album or UNKNOWN_ALBUM)[:TITLE_LENGTH])
+                      for file, titles in zip(new, artists)]
+        albums = {}
+        for key, file in zip(album_keys, new):
+            if not albums.get(key):
+                albums[key] = file.picture
+        new_albums = [key for key in albums if key not in self.albums]
+        references = self._create_albums(albums)
+        genres = [list(dict.fromkeys(title[:GENRE_LENGTH] for title in file.tags.genres)) for file in new]
+        self._create_genres(title for titles in genres for title in titles)
+
+        songs = Song.objects.bulk_create([
+            Song(title=(file.tags.title or os.path.splitext(os.path.basename(file.path))[0])[:TITLE_LENGTH],
+                 audio=file.audio, user=self.user, album_id=self.albums[key], duration=file.audio_info.duration,
+                 bitrate=file.audio_info.bitrate, sample_rate=file.audio_info.sample_rate,
+                 channels=file.audio_info.channels, **({'picture': file.picture} if file.picture else {}))
+            for file, key in zip(new, album_keys)])
+        Song.authors.through.objects.bulk_create([
+            Song.authors.through(song_id=song.id, author_id=self.authors[title])
+            for song, titles in zip(songs, artists) for title in dict.fromkeys(titles)])
+        Song.genres.through.objects.bulk_create([
+            Song.genres.through(song_id=song.id, genre_id=self.genres[title])
+            for song, titles in zip(songs, genres) for title in titles])
+
+        sizes = {}
+        for file in new:
+            references[file.audio] += 1
+            sizes[file.audio] = file.size
+            if file.picture:
+                references[file.picture] += 1
+                sizes[file.picture] = file.picture_size
+        touch_blobs(sizes)
+        increment_counters(Blob, ('name',), {(name,): n for name, n in references.items()}, count_field='refcount')
+
+        index_songs([song.id for song in songs])
+        get_response_cache().bump(ALBUM, *{song.album_id for song in songs})
+        get_response_cache().bump(AUTHOR, *{self.authors[title] for titles in artists for title in titles})
+        self.imported += len(songs)
+
+        suggestions = ([(typeahead.SONG, song.id, song.title) for song in songs]
+                       + [(typeahead.ALBUM, self.albums[key], key[1]) for key in new_albums]
+                       + [(typeahead.AUTHOR, self.authors[title], title) for title in new_authors])
+
+        def suggest():
+            for kind, pk, title in suggestions:
+                typeahead.update_index(kind, pk, title)
+        transaction.on_commit(suggest)
@@ -0,0 +1,179 @@
+import asyncio
+import importlib
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import clear_url_caches
+from rest_framework_simplejwt.tokens import AccessToken
+
+from library.models import Author, Album, Song
+from playlists.models import Playlist, Collection, SongPlaylist, SongCollection
+from playlists.positions import spread_keys
+
+HOST = 'localhost'
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the read endpoints served through the WSGI and the ASGI handler, with the '
+            'same number of concurrent connections each, the views sync under WSGI and async under ASGI as '
+            'the two servers run them. WSGI requests are handled by a pool of worker threads, as by a threaded '
+            'WSGI server. The synthetic data is committed and deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=64)
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and handler.')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads.')
+        parser.add_argument('--songs', type=int, default=100)
+        parser.add_argument('--db-latency', type=float, default=0.0,
+                            help='Milliseconds added to every query, as a database across the network would.')
+
+    def handle(self, *args, **options):
+        if options['db_latency']:
+            delay = options['db_latency'] / 1000
+
+            def slow(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def add_latency(sender, connection, **kwargs):
+                if slow not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(slow)
+
+            connection_created.connect(add_latency)
+
+        user = User.objects.create_user('asgi-bench')
+        try:
+            endpoints = self.create_data(user, options['songs'])
+            headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+            self.stdout.write(f'{"endpoint":<40} {"handler":<6} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9}')
+            for endpoint in endpoints:
+                for name, run, async_views in (('WSGI', self.run_wsgi, False), ('ASGI', self.run_asgi, True)):
+                    with self.views(async_views):
+                        self.report(endpoint, name, *asyncio.run(run(endpoint, headers, **options)))
+        finally:
+            if options['db_latency']:
+                connection_created.disconnect(add_latency)
+            user.delete()
+
+    @staticmethod
+    def reload_urls():
+        # the views are built when the URLconfs are imported, the root one includes the apps' modules
+        for name in ('library.urls', 'playlists.urls', settings.ROOT_URLCONF):
+            importlib.reload(importlib.import_module(name))
+        clear_url_caches()
+
+    @contextmanager
+    def views(self, async_views):
+        try:
+            with override_settings(ASYNC_VIEWS=async_views):
+                self.reload_urls()
+                yield
+        finally:
+            self.reload_urls()
+
+    def create_data(self, user, songs):
+        # no pictures, derivatives are then complete and song responses are cacheable
+        author = Author.objects.create(title='bench', user=user, picture='')
+        album = Album.objects.create(title='bench', user=user, author=author, picture='')
+        song_objects = Song.objects.bulk_create(
+            [Song(title=f'bench {i}', user=user, album=album, audio='tracks/bench.mp3', picture='')
+             for i in range(songs)])
+        Song.authors.through.objects.bulk_create(
+            [Song.authors.through(song_id=song.id, author_id=author.id) for song in song_objects])
+        playlist = Playlist.objects.create(title='bench', user=user, picture='')
+        SongPlaylist.objects.bulk_create([SongPlaylist(playlist=playlist, song=song, position=position)
+                                          for song, position in zip(song_objects, spread_keys(songs))])
+        collection, _ = Collection.objects.get_or_create(user=user, defaults={'picture': ''})
+        SongCollection.objects.bulk_create([SongCollection(collection=collection, song=song)
+                                            for song in song_objects[::2]])
+        return [f'/api/v1/library/song/{song_objects[0].id}/',
+                f'/api/v1/library/song/short?album_id={album.id}',
+                f'/api/v1/playlist/{playlist.id}/',
+                '/api/v1/playlist/liked/']
+
+    @staticmethod
+    async def clients(call, connections, requests):
+        latencies = []
+
+        async def client(count):
+            for _ in range(count):
+                started = time.perf_counter()
+                status = await call()
+                if status != 200:
+                    raise RuntimeError(f'Request failed with status {status}')
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client(requests // connections + (i < requests % connections))
+                               for i in range(connections)])
+        return time.perf_counter() - started, latencies
+
+    async def run_wsgi(self, endpoint, headers, connections, requests, workers, **options):
+        handler = WSGIHandler()
+        url = urlsplit(endpoint)
+
+        def request():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(), 'wsgi.errors': StringIO(),
+                **{f'HTTP_{name.upper()}': value for name, value in headers.items()},
+            }
+            statuses = []
+            response = handler(environ, lambda status, response_headers: statuses.append(status))
+            b''.join(response)
+            # fires request_finished, which closes the database connection like a server would
+            response.close()
+            return int(statuses[0].split()[0])
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(workers) as pool:
+            return await self.clients(lambda: loop.run_in_executor(pool, request), connections, requests)
+
+    async def run_asgi(self, endpoint, headers, connections, requests, **options):
+        handler = ASGIHandler()
+        url = urlsplit(endpoint)
+
+        async def request():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': url.path, 'raw_path': url.path.encode(),
+                'query_string': url.query.encode(), 'root_path': '', 'server': (HOST, 80),
+                'client': ('127.0.0.1', 50000),
+                'headers': [(b'host', HOST.encode())] + [(name.lower().encode(), value.encode())
+                                                        for name, value in headers.items()],
+            }
+            received, statuses = asyncio.Event(), []
+
+            async def receive():
+                if not received.is_set():
+                    received.set()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client stays connected until the handler returns
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            await handler(scope, receive, send)
+            return statuses[0]
+
+        return await self.clients(request, connections, requests)
+
+    def report(self, endpoint, name, elapsed, latencies):
+        latencies = sorted(latencies)
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        self.stdout.write(f'{endpoint:<40} {name:<6} {len(latencies) / elapsed:9.1f} {p50:9.2f} {p99:9.2f}')
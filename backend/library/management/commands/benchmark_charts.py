@@ -0,0 +1,82 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from library.charts import refresh_charts, CHART_WINDOWS, CHART_SIZE
+from library.models import Author, Album, Genre, Song, PlayEvent
+from library.rollups import rollup_plays
+
+BATCH_SIZE = 10_000
+
+
+class Command(BaseCommand):
+    help = ('Compare chart refresh from rollups against a naive GROUP BY over play events on synthetic data. '
+            'Everything is created inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plays', type=int, default=10_000_000)
+        parser.add_argument('--songs', type=int, default=50_000)
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def timed(self, label, func):
+        started = time.perf_counter()
+        result = func()
+        self.stdout.write(f'{label:<40} {time.perf_counter() - started:10.3f}s')
+        return result
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(random.Random(options['seed']), **options)
+            transaction.set_rollback(True)
+
+    def run(self, rnd, plays, songs, users, genres, **options):
+        now = timezone.now()
+        user_ids = [u.id for u in User.objects.bulk_create(
+            [User(username=f'chart-bench-{i}') for i in range(users)], batch_size=BATCH_SIZE)]
+        owner = User.objects.get(id=user_ids[0])
+        author = Author.objects.create(title='bench', user=owner)
+        album = Album.objects.create(title='bench', user=owner, author=author)
+        genre_ids = [g.id for g in Genre.objects.bulk_create(
+            [Genre(title=f'chart-bench-{i}') for i in range(genres)])]
+        song_ids = [s.id for s in Song.objects.bulk_create(
+            [Song(title=f'bench {i}', user=owner, album=album, audio='tracks/bench.mp3') for i in range(songs)],
+            batch_size=BATCH_SIZE)]
+        Song.genres.through.objects.bulk_create(
+            [Song.genres.through(song_id=song_id, genre_id=rnd.choice(genre_ids)) for song_id in song_ids],
+            batch_size=BATCH_SIZE)
+
+        def insert_plays(count, span):
+            for offset in range(0, count, BATCH_SIZE):
+                PlayEvent.objects.bulk_create([
+                    # popularity is skewed towards low song indexes, like real charts
+                    PlayEvent(song_id=song_ids[int(rnd.paretovariate(1.2)) % len(song_ids)],
+                              user_id=rnd.choice(user_ids),
+                              played_at=now - timedelta(seconds=rnd.random() * span.total_seconds()))
+                    for _ in range(min(BATCH_SIZE, count - offset))
+                ])
+
+        self.timed(f'insert {plays} play events', lambda: insert_plays(plays, timedelta(days=30)))
+
+        def naive():
+            for window, (_, length) in CHART_WINDOWS.items():
+                events = PlayEvent.objects.filter(played_at__gte=now - length)
+                for genre_id in [None, *genre_ids]:
+                    rows = events if genre_id is None else events.filter(song__genres=genre_id)
+                    list(rows.values('song_id').annotate(plays=Count('id')).order_by('-plays')[:CHART_SIZE])
+
+        self.timed('naive GROUP BY over play events', naive)
+        self.timed('initial rollup (one-off)', rollup_plays)
+        self.timed('first chart refresh (sums the rollups)', refresh_charts)
+
+        increment = max(plays // 100, 1)
+        self.timed(f'insert {increment} new play events', lambda: insert_plays(increment, timedelta(hours=1)))
+        self.timed('incremental rollup', rollup_plays)
+        self.timed('incremental chart refresh', refresh_charts)
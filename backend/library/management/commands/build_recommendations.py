@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.recommendations import build_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the song neighbour table behind the recommendations from plays and likes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and rebuild every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            songs = build_neighbours()
+            self.stdout.write(f'Computed neighbours of {songs} songs in {time.perf_counter() - started:.3f}s.')
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
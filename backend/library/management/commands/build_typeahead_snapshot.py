@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from library.typeahead import write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Write the typeahead snapshot (titles and play weights) loaded by the suggestion index at startup.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Wrote {write_snapshot(options["path"])} titles.')
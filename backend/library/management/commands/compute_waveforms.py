@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from library.models import Song, SongWaveform
+from library.waveforms import compute_waveform, UnsupportedAudio
+
+
+class Command(BaseCommand):
+    help = 'Compute the waveform peaks of songs that have none or whose audio changed since.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every song.')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and look for new songs every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            songs = Song.objects.exclude(audio='').only('id', 'audio')
+            if not options['all']:
+                songs = songs.exclude(waveform__source=F('audio'))
+            computed = skipped = 0
+            for song in songs.iterator():
+                try:
+                    compute_waveform(song)
+                    computed += 1
+                except (UnsupportedAudio, OSError) as error:
+                    # recorded without levels so it is not retried until the audio changes
+                    SongWaveform.objects.update_or_create(
+                        song=song, defaults={'source': song.audio.name, 'levels': [], 'peaks': b'',
+                                             'computed_at': timezone.now()})
+                    self.stderr.write(f'Song {song.id}: {error}')
+                    skipped += 1
+            self.stdout.write(f'Computed {computed} waveforms, skipped {skipped} songs.')
+            if options['interval'] is None:
+                return
+            options['all'] = False
+            time.sleep(options['interval'])
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from library.exports import CatalogExport, Watermark, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Export the catalog, plays, playlists and liked songs as NDJSON, only what changed since a watermark '
+            'when one is given. The last record is the watermark of the next export; with --state it is read '
+            'from and written back to a file, so running the command again exports the changes since the last '
+            'run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help='File to write, - for stdout.')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--since', default=None, help='ISO 8601 datetime.')
+        parser.add_argument('--after-play-id', type=int, default=0)
+        parser.add_argument('--state', default=None, help='JSON file holding the watermark between runs.')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        since, after_play_id = options['since'], options['after_play_id']
+        if options['state'] and os.path.exists(options['state']):
+            with open(options['state'], encoding='utf-8') as file:
+                state = json.load(file)
+            since, after_play_id = state['since'], state['after_play_id']
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None:
+                raise CommandError('since is not a valid ISO 8601 datetime.')
+
+        export = CatalogExport(Watermark(since, after_play_id), options['chunk_size'])
+        if options['output'] == '-':
+            for data in export.chunks(options['gzip']):
+                sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            # written under a temporary name, an interrupted export never looks complete
+            with open(options['output'] + '.tmp', 'wb') as file:
+                for data in export.chunks(options['gzip']):
+                    file.write(data)
+            os.replace(options['output'] + '.tmp', options['output'])
+
+        if options['state']:
+            with open(options['state'] + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump({'since': export.next_watermark.since.isoformat(),
+                           'after_play_id': export.next_watermark.after_play_id}, file)
+            os.replace(options['state'] + '.tmp', options['state'])
+        # stdout may be the export itself
+        self.stderr.write('Exported ' + ', '.join(f'{count} {kind}' for kind, count in export.counts.items()
+                                                  if kind != 'watermark') + '.')
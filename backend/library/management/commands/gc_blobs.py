@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from library.blobs import collect_garbage, BLOB_GRACE_PERIOD
+
+
+class Command(BaseCommand):
+    help = 'Delete stored blobs (and their derivatives) that are no longer referenced.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=int(BLOB_GRACE_PERIOD.total_seconds() // 60))
+
+    def handle(self, *args, **options):
+        deleted = collect_garbage(timedelta(minutes=options['grace_minutes']))
+        self.stdout.write(f'Deleted {deleted} blobs.')
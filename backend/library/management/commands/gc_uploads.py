@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from library.uploads import collect_stale_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable upload sessions (and their part files) that have been idle for too long.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None,
+                            help='Idle time after which a session is stale, CHUNKED_UPLOAD["EXPIRY"] by default.')
+
+    def handle(self, *args, **options):
+        expiry = timedelta(hours=options['hours']) if options['hours'] is not None else None
+        deleted = collect_stale_sessions(expiry)
+        self.stdout.write(f'Deleted {deleted} upload sessions.')
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from library.imports import LibraryImporter, Manifest, place_files, read_file, scan
+
+
+class Command(BaseCommand):
+    help = ('Import the audio files (MP3, FLAC, WAV) under a directory as songs of a user. Tags, cover art and '
+            'audio headers are read and the files copied by a pool of worker processes, blobs are recorded and '
+            'songs inserted in batches by the command itself. Files are listed in a manifest once imported, '
+            'running the command again resumes an interrupted import. Waveforms are left to compute_waveforms.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--user', required=True, help='Username the songs, albums and authors belong to.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--link', action='store_true',
+                            help='Hard-link the files into MEDIA_ROOT instead of copying them (copied across '
+                                 'filesystems). The source files must then never be modified in place.')
+        parser.add_argument('--manifest', default=None,
+                            help='Defaults to a file per directory under BASE_DIR/imports/.')
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options['directory'])
+        if not os.path.isdir(root):
+            raise CommandError(f'{root} is not a directory.')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist.')
+        manifest = Manifest(options['manifest'] or os.path.join(
+            settings.BASE_DIR, 'imports', hashlib.sha256(root.encode()).hexdigest()[:16] + '.jsonl'))
+
+        files = list(scan(root))
+        pending = [file for file in files if file not in manifest]
+        self.stdout.write(f'{len(files)} audio files, {len(files) - len(pending)} already imported.')
+        importer = LibraryImporter(user)
+        media_root = default_storage.location
+        workers = max(1, options['workers'])
+        batch, failed, read_bytes = [], 0, 0
+        started = time.perf_counter()
+
+        def flush():
+            importer.add(batch)
+            manifest.add(batch)
+            elapsed = time.perf_counter() - started
+            done = importer.imported + importer.duplicates
+            self.stdout.write(f'{done}/{len(pending)} files, {done / elapsed:.1f} files/s, '
+                              f'{read_bytes / elapsed / 1024 ** 2:.1f} MB/s')
+            batch.clear()
+
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+        # spawned workers (macOS, Windows) set Django up before the first file
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            queue = iter(pending)
+            running = {}
+            while True:
+                # a bounded number of files in flight, the results are inserted as they come
+                while len(running) < workers * 4:
+                    file = next(queue, None)
+                    if file is None:
+                        break
+                    running[pool.submit(read_file, root, file[0], media_root, options['link'])] = file[0]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                read = []
+                for future in finished:
+                    path = running.pop(future)
+                    try:
+                        read.append(future.result())
+                    except Exception as error:
+                        self.stderr.write(f'{path}: {error}')
+                        failed += 1
+                # the workers never write to the database, which a batch being inserted holds locked
+                try:
+                    place_files(read, media_root, options['link'])
+                except Exception as error:
+                    self.stderr.write(f'{", ".join(file.path for file in read)}: {error}')
+                    failed += len(read)
+                    continue
+                batch.extend(read)
+                read_bytes += sum(file.size for file in read)
+                if len(batch) >= options['batch_size']:
+                    flush()
+        if batch:
+            flush()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Imported {importer.imported} songs, skipped {importer.duplicates} already in the '
+                          f'library, {failed} failed, in {elapsed:.1f}s '
+                          f'({(importer.imported + importer.duplicates) / elapsed if elapsed else 0:.1f} files/s).')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from library.audio import probe_file
+from library.models import Song
+
+
+class Command(BaseCommand):
+    help = 'Fill in duration, bitrate, sample rate and channels of songs uploaded before they were probed.'
+
+    def handle(self, *args, **options):
+        probed = 0
+        songs = Song.objects.filter(duration__isnull=True).exclude(audio='').only('id', 'audio')
+        for song in songs.iterator():
+            if not song.audio.storage.exists(song.audio.name):
+                continue
+            with song.audio.open('rb') as file:
+                info = probe_file(file)
+            Song.objects.filter(pk=song.pk).update(**info._asdict())
+            probed += 1
+        self.stdout.write(f'Probed {probed} songs.')
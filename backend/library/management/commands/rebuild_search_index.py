@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from library.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of songs, albums, authors and genres.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Indexed {rebuild_index()} songs.')
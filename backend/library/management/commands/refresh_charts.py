@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.charts import refresh_charts, CHART_WINDOWS, CHART_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Update the top songs charts with the plays rolled up since the last refresh and the buckets that '
+            'left the windows (run rollup_plays first).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', action='append', choices=list(CHART_WINDOWS), dest='windows')
+        parser.add_argument('--size', type=int, default=CHART_SIZE)
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and refresh every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            entries = refresh_charts(options['windows'], options['size'])
+            self.stdout.write(f'Refreshed {entries} chart entries in {time.perf_counter() - started:.3f}s.')
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
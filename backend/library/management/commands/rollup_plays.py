@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.rollups import rollup_plays, ROLLUP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Fold new play events into the hourly, daily and monthly play rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and roll up every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            folded = rollup_plays(batch_size=options['batch_size'])
+            self.stdout.write(f'Rolled up {folded} play events.')
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0027_play_events_and_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=10)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('plays', models.IntegerField()),
+                ('computed_at', models.DateTimeField()),
+                ('genre', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chart_entries', to='library.genre')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chart_entries', to='library.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', 'genre', 'rank'], name='library_cha_window_749c97_idx')],
+            },
+        ),
+    ]
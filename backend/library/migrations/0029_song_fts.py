@@ -0,0 +1,40 @@
+from django.db import migrations
+
+CREATE_SEARCH_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS library_song_fts USING fts5("
+    "title, authors, album, genres, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+DROP_SEARCH_TABLE = 'DROP TABLE IF EXISTS library_song_fts'
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SEARCH_TABLE)
+
+    Song = apps.get_model('library', 'Song')
+    rows = [
+        (song.id, song.title, ' '.join(author.title for author in song.authors.all()), song.album.title,
+         ' '.join(genre.title for genre in song.genres.all()))
+        for song in Song.objects.select_related('album').prefetch_related('authors', 'genres').iterator(2000)
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO library_song_fts (rowid, title, authors, album, genres) VALUES (%s, %s, %s, %s, %s)', rows
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_SEARCH_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0028_chartentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
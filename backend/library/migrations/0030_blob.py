@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:23
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0029_song_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(db_default=0)),
+                ('refcount', models.IntegerField(db_default=0)),
+                ('last_used_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount', 'last_used_at'], name='library_blo_refcoun_23c966_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0032_song_audio_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongWaveform',
+            fields=[
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='waveform', serialize=False, to='library.song')),
+                ('source', models.CharField(max_length=255)),
+                ('levels', models.JSONField()),
+                ('peaks', models.BinaryField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
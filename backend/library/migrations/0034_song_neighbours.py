@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0033_song_waveform'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongNeighbours',
+            fields=[
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbours', serialize=False, to='library.song')),
+                ('neighbours', models.BinaryField()),
+                ('scores', models.BinaryField()),
+                ('computed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
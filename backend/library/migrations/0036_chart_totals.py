@@ -0,0 +1,36 @@
+# Generated by Django 5.0.4 on 2026-10-18 14:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0035_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=10, unique=True)),
+                ('start', models.DateTimeField()),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=10)),
+                ('plays', models.IntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chart_totals', to='library.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', '-plays'], name='library_cha_window_3e300d_idx')],
+                'unique_together': {('window', 'song')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0036_chart_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='picture_derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='picture_derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='picture_derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
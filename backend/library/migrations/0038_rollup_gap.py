@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0037_picture_derivatives_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='gap_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='gap_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
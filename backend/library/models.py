@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.db.models.functions import Now
 from users.models import User
 
 
@@ -6,12 +9,21 @@ class Song(models.Model):
     title = models.CharField(max_length=100)
     audio = models.FileField(upload_to='tracks/')
     picture = models.ImageField(upload_to='pictures/tracks/', default='pictures/tracks/default.jpg')
+    # set by images.DerivativePool once the derivatives of picture are written
+    picture_derivatives_ready = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # watermark of incremental exports, see library.exports
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     users_plays = models.ManyToManyField(User, through='UserSongPlay', related_name='songs_user_played', blank=True)
     genres = models.ManyToManyField('Genre', related_name='songs')
     album = models.ForeignKey('Album', related_name='songs', on_delete=models.CASCADE)
     authors = models.ManyToManyField('Author', related_name='songs')
+    # probed from the audio container headers on upload, see library.audio
+    duration = models.FloatField(null=True, blank=True)
+    bitrate = models.IntegerField(null=True, blank=True)
+    sample_rate = models.IntegerField(null=True, blank=True)
+    channels = models.SmallIntegerField(null=True, blank=True)
 
 
 class UserSongPlay(models.Model):
@@ -26,17 +38,158 @@ class UserSongPlay(models.Model):
 class Album(models.Model):
     title = models.CharField(max_length=100)
     picture = models.ImageField(upload_to='pictures/albums/', default='pictures/albums/default.jpg')
+    # set by images.DerivativePool once the derivatives of picture are written
+    picture_derivatives_ready = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_albums')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     author = models.ForeignKey('Author', related_name='albums', on_delete=models.CASCADE)
 
 
 class Author(models.Model):
     title = models.CharField(max_length=100)
     picture = models.ImageField(upload_to='pictures/albums/', default='pictures/albums/default.jpg')
+    # set by images.DerivativePool once the derivatives of picture are written
+    picture_derivatives_ready = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_authors')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class Genre(models.Model):
     title = models.CharField(max_length=30, unique=True)
+
+
+class PlayEvent(models.Model):
+    # append-only, written in batches by library.plays
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='play_events')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='play_events')
+    played_at = models.DateTimeField()
+
+
+class Granularity(models.TextChoices):
+    HOUR = 'hour'
+    DAY = 'day'
+    MONTH = 'month'
+
+
+class SongPlayRollup(models.Model):
+    granularity = models.CharField(max_length=5, choices=Granularity.choices)
+    bucket = models.DateTimeField()
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='play_rollups')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('granularity', 'bucket', 'song'),)
+        indexes = [models.Index(fields=['song', 'granularity', 'bucket'])]
+
+
+class UserPlayRollup(models.Model):
+    granularity = models.CharField(max_length=5, choices=Granularity.choices)
+    bucket = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='play_rollups')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='user_play_rollups')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('granularity', 'bucket', 'user', 'song'),)
+        indexes = [models.Index(fields=['user', 'granularity', 'bucket'])]
+
+
+class RollupWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    # the first id missing after last_id while later ones exist, and since when (see library.rollups)
+    gap_id = models.BigIntegerField(null=True, blank=True)
+    gap_since = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ChartEntry(models.Model):
+    # materialized by library.charts.refresh_charts, genre is null for the global chart
+    window = models.CharField(max_length=10)
+    genre = models.ForeignKey(Genre, null=True, blank=True, on_delete=models.CASCADE, related_name='chart_entries')
+    rank = models.PositiveSmallIntegerField()
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='chart_entries')
+    plays = models.IntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['window', 'genre', 'rank'])]
+
+
+class ChartTotal(models.Model):
+    # plays of a song within a chart window, kept up to date by library.charts.refresh_charts
+    window = models.CharField(max_length=10)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='chart_totals')
+    plays = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('window', 'song'),)
+        indexes = [models.Index(fields=['window', '-plays'])]
+
+
+class ChartWatermark(models.Model):
+    # what the ChartTotals of a window hold: the buckets from start on, the play events up to last_id
+    window = models.CharField(max_length=10, unique=True)
+    start = models.DateTimeField()
+    last_id = models.BigIntegerField(default=0)
+
+
+class Blob(models.Model):
+    # a file stored by library.blobs.ContentAddressedStorage and how many rows reference it
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(db_default=0)
+    refcount = models.IntegerField(db_default=0)
+    last_used_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        indexes = [models.Index(fields=['refcount', 'last_used_at'])]
+
+
+class UploadSession(models.Model):
+    # a resumable upload, its chunks are written in place into a part file by library.uploads
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['updated_at'])]
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    sha256 = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = (('session', 'index'),)
+
+
+class SongWaveform(models.Model):
+    # written by library.waveforms: int8 min/max pairs of every zoom level, finest first
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, primary_key=True, related_name='waveform')
+    source = models.CharField(max_length=255)
+    levels = models.JSONField()
+    peaks = models.BinaryField()
+    computed_at = models.DateTimeField()
+
+
+class SongNeighbours(models.Model):
+    # written by library.recommendations: the most similar songs, best first, as int64 ids and float32 scores
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, primary_key=True, related_name='neighbours')
+    neighbours = models.BinaryField()
+    scores = models.BinaryField()
+    computed_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,62 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class SongCursorPagination(CursorPagination):
+    # keyset pagination: every page is a WHERE on the ordering column, never an OFFSET scan
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
+
+class SongListCursorPagination(SongCursorPagination):
+    """
+    Pages the through rows of a song list (SongPlaylist, SongCollection) newest first and merges the
+    cursors into the serialized playlist instead of wrapping it in 'results'.
+    """
+    ordering = '-created_at'
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            **data,
+        })
+
+
+class SongPositionCursorPagination(SongListCursorPagination):
+    # playlists are in the order their owner arranged, keyset on the (playlist, position) index
+    ordering = 'position'
+
+
+class SearchResultsPagination(LimitOffsetPagination):
+    """
+    Limit/offset over a ranked search. The total is never counted: one extra row is fetched
+    to know whether there is a next page.
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def paginate_search(self, search, request):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        results = search(self.limit + 1, self.offset)
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,145 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Song, UserSongPlay, PlayEvent
+from users.models import User
+from utils import increment_counters
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+DEFAULT_PLAY_COUNTER = {
+    'BUFFERED': True,
+    'MAX_PENDING': 1000,
+    'FLUSH_INTERVAL': 5.0,
+}
+
+
+def play_counter_settings() -> dict:
+    return {**DEFAULT_PLAY_COUNTER, **getattr(settings, 'PLAY_COUNTER', {})}
+
+
+def apply_plays(events: list[tuple[int, int, datetime]]) -> None:
+    """
+    Write (song_id, user_id, played_at) plays in one transaction: append them to PlayEvent and add them
+    to UserSongPlay.count with atomic count = count + n updates, so concurrent writers never lose
+    increments. Plays of songs or users deleted in the meantime are dropped.
+    """
+    if not events:
+        return
+
+    with transaction.atomic():
+        song_ids = set(Song.objects.filter(id__in={e[0] for e in events}).values_list('id', flat=True))
+        user_ids = set(User.objects.filter(id__in={e[1] for e in events}).values_list('id', flat=True))
+        events = [e for e in events if e[0] in song_ids and e[1] in user_ids]
+
+        PlayEvent.objects.bulk_create(
+            [PlayEvent(song_id=song_id, user_id=user_id, played_at=played_at)
+             for song_id, user_id, played_at in events],
+            batch_size=FLUSH_BATCH_SIZE,
+        )
+
+        increments = defaultdict(int)
+        for song_id, user_id, _ in events:
+            increments[(user_id, song_id)] += 1
+        increment_counters(UserSongPlay, ('user_id', 'song_id'), increments, batch_size=FLUSH_BATCH_SIZE)
+
+
+class PlayCounterBuffer:
+    """
+    In-process write-behind buffer for plays. Plays are kept in memory and written with apply_plays
+    once max_pending are buffered, every flush_interval seconds from a background thread, and at
+    interpreter shutdown.
+    """
+
+    def __init__(self, max_pending: int, flush_interval: float):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, song_id: int, user_id: int, played_at: datetime) -> None:
+        with self._lock:
+            self._pending.append((song_id, user_id, played_at))
+            full = len(self._pending) >= self.max_pending
+            if self._thread is None:
+                self._start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write everything buffered so far and return the number of plays flushed.
+        On failure the plays are put back so the next flush retries them.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                apply_plays(pending)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = pending
+                raise
+            return len(pending)
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='play-counter-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush %d buffered plays', len(self))
+            finally:
+                connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_play_buffer() -> PlayCounterBuffer:
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            config = play_counter_settings()
+            _buffer = PlayCounterBuffer(config['MAX_PENDING'], config['FLUSH_INTERVAL'])
+        return _buffer
+
+
+def record_play(song_id: int, user_id: int) -> bool:
+    """
+    Count one play. Returns True if it was buffered, False if it was written synchronously.
+    """
+    played_at = timezone.now()
+    if not play_counter_settings()['BUFFERED']:
+        apply_plays([(song_id, user_id, played_at)])
+        return False
+    get_play_buffer().record(song_id, user_id, played_at)
+    return True
@@ -0,0 +1,28 @@
+from django.db.models import Prefetch, QuerySet
+
+from .models import Song, Author
+
+SONG_READ_FIELDS = ('id', 'title', 'picture', 'picture_derivatives_ready', 'audio', 'duration', 'album')
+ALBUM_READ_FIELDS = ('album__id', 'album__title', 'album__picture', 'album__picture_derivatives_ready')
+AUTHOR_READ_FIELDS = ('id', 'title', 'picture', 'picture_derivatives_ready')
+
+
+def song_read_queryset(queryset: QuerySet | None = None, context: dict | None = None) -> QuerySet:
+    """
+    Shape a Song queryset for SongReadSerializer so a list of any length is serialized in a fixed number
+    of queries. Honours the same 'album'/'authors' context flags the serializer uses to drop fields.
+    """
+    if queryset is None:
+        queryset = Song.objects.all()
+    context = context or {}
+
+    fields = list(SONG_READ_FIELDS)
+    if context.get('album', True):
+        queryset = queryset.select_related('album')
+        fields.extend(ALBUM_READ_FIELDS)
+    if context.get('authors', True):
+        queryset = queryset.prefetch_related(
+            Prefetch('authors', queryset=Author.objects.only(*AUTHOR_READ_FIELDS))
+        )
+    return queryset.only(*fields)
+
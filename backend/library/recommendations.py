@@ -0,0 +1,208 @@
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ChartEntry, SongNeighbours, UserSongPlay
+from playlists.models import SongCollection
+
+DEFAULT_RECOMMENDATIONS = {
+    # neighbours kept per song
+    'NEIGHBOURS': 50,
+    # bytes of similarity rows computed at once, the block size follows from it and the number of songs
+    'MEMORY_BUDGET': 256 * 1024 * 1024,
+    # co-occurrences expanded at once within a block, about 48 bytes each
+    'MAX_PAIRS': 4 * 1024 * 1024,
+    # a user's heaviest songs only, bounds what a single heavy listener costs
+    'MAX_USER_SONGS': 500,
+    'LIKE_WEIGHT': 2.0,
+    # songs of a user the suggestions are gathered from
+    'PROFILE_SIZE': 50,
+}
+READ_BATCH = 100_000
+# float64 block and batch sums plus the int64 argpartition indices, per similarity
+BYTES_PER_SCORE = 24
+
+
+def recommendation_settings() -> dict:
+    return {**DEFAULT_RECOMMENDATIONS, **getattr(settings, 'RECOMMENDATIONS', {})}
+
+
+class Matrix(NamedTuple):
+    # user x song weights in CSR form, songs numbered by their position in song_ids
+    song_ids: np.ndarray
+    indptr: np.ndarray
+    items: np.ndarray
+    weights: np.ndarray
+
+
+def _rows(queryset, fields) -> np.ndarray:
+    parts, batch = [np.empty((0, len(fields)), dtype=np.int64)], []
+    for row in queryset.values_list(*fields).iterator(chunk_size=READ_BATCH):
+        batch.append(row)
+        if len(batch) == READ_BATCH:
+            parts.append(np.array(batch, dtype=np.int64))
+            batch = []
+    if batch:
+        parts.append(np.array(batch, dtype=np.int64))
+    return np.concatenate(parts)
+
+
+def build_matrix(plays: np.ndarray, likes: np.ndarray, like_weight: float, max_user_songs: int) -> Matrix:
+    """
+    The matrix of (user, song, plays) and (user, song) like rows, weighted log(1 + plays) + like_weight.
+    """
+    users = np.concatenate([plays[:, 0], likes[:, 0]])
+    if not len(users):
+        return Matrix(np.empty(0, np.int64), np.zeros(1, np.int64), np.empty(0, np.int32), np.empty(0, np.float32))
+    songs = np.concatenate([plays[:, 1], likes[:, 1]])
+    weights = np.concatenate([np.log1p(plays[:, 2]), np.full(len(likes), like_weight)])
+    song_ids, items = np.unique(songs, return_inverse=True)
+    _, rows = np.unique(users, return_inverse=True)
+
+    # plays and a like of the same song add up
+    keys, inverse = np.unique(rows.astype(np.int64) * len(song_ids) + items, return_inverse=True)
+    weights = np.bincount(inverse, weights=weights)
+    rows, items = keys // len(song_ids), keys % len(song_ids)
+
+    order = np.lexsort((-weights, rows))
+    rows, items, weights = rows[order], items[order], weights[order]
+    counts = np.bincount(rows)
+    keep = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts) < max_user_songs
+    rows, items, weights = rows[keep], items[keep], weights[keep]
+
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(counts)))))
+    return Matrix(song_ids, indptr, items.astype(np.int32), weights.astype(np.float32))
+
+
+def item_neighbours(matrix: Matrix, k: int, memory_budget: int, max_pairs: int):
+    """
+    Top k cosine neighbours of every song, a block of songs at a time so only a block of similarity rows
+    is ever in memory. Yields (first song of the block, neighbours, scores), both best first per song; a
+    block whose songs co-occur with fewer than k others has fewer columns.
+    """
+    n_items = len(matrix.song_ids)
+    k = min(k, n_items - 1)
+    if k <= 0:
+        return
+    norms = np.sqrt(np.bincount(matrix.items, weights=matrix.weights.astype(np.float64) ** 2, minlength=n_items))
+    norms[norms == 0] = 1
+
+    # the same entries by song (CSC): the users of every song
+    order = np.argsort(matrix.items, kind='stable')
+    song_users = np.repeat(np.arange(len(matrix.indptr) - 1), np.diff(matrix.indptr))[order]
+    song_weights = matrix.weights[order]
+    song_indptr = np.concatenate(([0], np.cumsum(np.bincount(matrix.items, minlength=n_items))))
+
+    # a block scores the songs co-occurring with its own only, at most n_items columns
+    block = max(1, min(n_items, memory_budget // (BYTES_PER_SCORE * n_items)))
+    for start in range(0, n_items, block):
+        stop = min(start + block, n_items)
+        low, high = song_indptr[start], song_indptr[stop]
+        users, weights = song_users[low:high], song_weights[low:high]
+        local = np.repeat(np.arange(stop - start), np.diff(song_indptr[start:stop + 1]))
+        lengths = matrix.indptr[users + 1] - matrix.indptr[users]
+        ends = np.cumsum(lengths)
+
+        def batches():
+            # each (song, user) entry of the block meets the user's row, max_pairs entries at a time
+            first = 0
+            while first < len(users):
+                last = max(first + 1,
+                           int(np.searchsorted(ends, ends[first] - lengths[first] + max_pairs, side='right')))
+                batch = lengths[first:last]
+                positions = (np.repeat(matrix.indptr[users[first:last]], batch)
+                             + np.arange(int(batch.sum())) - np.repeat(np.cumsum(batch) - batch, batch))
+                yield first, last, batch, positions
+                first = last
+
+        candidates = np.empty(0, dtype=matrix.items.dtype)
+        for *_, positions in batches():
+            candidates = np.union1d(candidates, matrix.items[positions])
+        columns = len(candidates)
+        size = (stop - start) * columns
+        dots = np.zeros(size)
+        for first, last, batch, positions in batches():
+            dots += np.bincount(np.repeat(local[first:last], batch) * columns
+                                + np.searchsorted(candidates, matrix.items[positions]),
+                                weights=np.repeat(weights[first:last], batch) * matrix.weights[positions],
+                                minlength=size)
+
+        scores = dots.reshape(stop - start, columns)
+        scores /= norms[candidates][None, :]
+        scores /= norms[start:stop, None]
+        own = np.searchsorted(candidates, np.arange(start, stop))
+        found = own < columns
+        found[found] = candidates[own[found]] == np.arange(start, stop)[found]
+        scores[np.flatnonzero(found), own[found]] = 0
+        width = min(k, columns)
+        top = np.argpartition(scores, -width, axis=1)[:, -width:] if width else np.empty((stop - start, 0), np.intp)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        best = np.argsort(-top_scores, axis=1)
+        yield (start, candidates[np.take_along_axis(top, best, axis=1)].astype(np.int64),
+               np.take_along_axis(top_scores, best, axis=1))
+
+
+def build_neighbours(config: dict | None = None) -> int:
+    """
+    Recompute the SongNeighbours table from plays and likes. Returns the number of songs with neighbours.
+    """
+    config = config or recommendation_settings()
+    now = timezone.now()
+    matrix = build_matrix(_rows(UserSongPlay.objects.filter(count__gt=0), ('user_id', 'song_id', 'count')),
+                          _rows(SongCollection.objects.all(), ('collection__user_id', 'song_id')),
+                          config['LIKE_WEIGHT'], config['MAX_USER_SONGS'])
+
+    written = 0
+    for start, neighbours, scores in item_neighbours(matrix, config['NEIGHBOURS'], config['MEMORY_BUDGET'],
+                                                     config['MAX_PAIRS']):
+        rows = []
+        for offset in range(len(neighbours)):
+            similar = scores[offset] > 0
+            if not similar.any():
+                continue
+            rows.append(SongNeighbours(
+                song_id=int(matrix.song_ids[start + offset]),
+                neighbours=matrix.song_ids[neighbours[offset][similar]].astype('<i8').tobytes(),
+                scores=scores[offset][similar].astype('<f4').tobytes(),
+                computed_at=now))
+        SongNeighbours.objects.bulk_create(rows, batch_size=500, update_conflicts=True, unique_fields=['song'],
+                                           update_fields=['neighbours', 'scores', 'computed_at'])
+        written += len(rows)
+    # songs that lost every neighbour since the last run
+    SongNeighbours.objects.filter(computed_at__lt=now).delete()
+    return written
+
+
+def recommend(user, limit: int) -> list[int]:
+    """
+    Ids of songs similar to the ones the user plays most and liked last, best first, without the songs
+    they already played or liked. Falls back to the weekly chart when there is nothing to go on.
+    """
+    config = recommendation_settings()
+    profile = {}
+    for song_id, count in (UserSongPlay.objects.filter(user=user, count__gt=0).order_by('-count')
+                           .values_list('song_id', 'count')[:config['PROFILE_SIZE']]):
+        profile[song_id] = float(np.log1p(count))
+    for song_id in (SongCollection.objects.filter(collection__user=user).order_by('-created_at')
+                    .values_list('song_id', flat=True)[:config['PROFILE_SIZE']]):
+        profile[song_id] = profile.get(song_id, 0) + config['LIKE_WEIGHT']
+
+    candidates, weights = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.float32)]
+    for song_id, neighbours, scores in (SongNeighbours.objects.filter(song_id__in=list(profile))
+                                        .values_list('song_id', 'neighbours', 'scores')):
+        candidates.append(np.frombuffer(neighbours, dtype='<i8'))
+        weights.append(np.frombuffer(scores, dtype='<f4') * profile[song_id])
+    song_ids, inverse = np.unique(np.concatenate(candidates), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(weights), minlength=len(song_ids))
+    ranked = [int(song_id) for song_id in song_ids[np.argsort(-totals, kind='stable')] if song_id not in profile]
+    if not ranked:
+        ranked = [song_id for song_id in (ChartEntry.objects.filter(window='week', genre=None).order_by('rank')
+                                          .values_list('song_id', flat=True)) if song_id not in profile]
+
+    # the profile is the top of the user's songs only, drop the rest of what they played as well
+    ranked = ranked[:limit * 4]
+    played = set(UserSongPlay.objects.filter(user=user, song_id__in=ranked, count__gt=0)
+                 .values_list('song_id', flat=True))
+    return [song_id for song_id in ranked if song_id not in played][:limit]
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncHour, TruncDay, TruncMonth
+from django.utils import timezone
+
+from .models import PlayEvent, SongPlayRollup, UserPlayRollup, RollupWatermark, Granularity
+from utils import increment_counters
+
+PLAYS_WATERMARK = 'plays'
+ROLLUP_BATCH_SIZE = 50_000
+# ids are handed out before their transaction commits, a missing id is waited for this long before it is
+# taken for a rolled back or deleted event
+GAP_TIMEOUT = timedelta(minutes=1)
+
+TRUNCATE = {
+    Granularity.HOUR: TruncHour,
+    Granularity.DAY: TruncDay,
+    Granularity.MONTH: TruncMonth,
+}
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    """
+    Start of the bucket containing value, matching what the Trunc functions store.
+    """
+    value = timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+    if granularity in (Granularity.DAY, Granularity.MONTH):
+        value = value.replace(hour=0)
+    if granularity == Granularity.MONTH:
+        value = value.replace(day=1)
+    return value
+
+
+def _fold(events, granularity, trunc):
+    rows = events.annotate(bucket=trunc('played_at')).values('bucket', 'song_id').annotate(n=Count('id'))
+    increment_counters(SongPlayRollup, ('granularity', 'bucket', 'song_id'),
+                       {(granularity, row['bucket'], row['song_id']): row['n'] for row in rows})
+
+    rows = events.annotate(bucket=trunc('played_at')).values('bucket', 'user_id', 'song_id').annotate(n=Count('id'))
+    increment_counters(UserPlayRollup, ('granularity', 'bucket', 'user_id', 'song_id'),
+                       {(granularity, row['bucket'], row['user_id'], row['song_id']): row['n'] for row in rows})
+
+
+def rollup_plays(batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Fold the PlayEvents written since the watermark into the hourly, daily and monthly rollups,
+    batch_size events per transaction. Returns the number of events folded.
+
+    Only the run of consecutive ids after the watermark is folded: an event committed late with a lower id
+    than ones already visible stops the fold until it shows up, or for GAP_TIMEOUT at most. Every event up
+    to the watermark is then folded exactly once, which the charts rely on.
+    """
+    folded = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=PLAYS_WATERMARK)
+            ids = list(PlayEvent.objects.filter(id__gt=watermark.last_id).order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return folded
+
+            # the ids before the first gap
+            run = next((i for i, pk in enumerate(ids) if pk != watermark.last_id + 1 + i), len(ids))
+            if run == 0:
+                now = timezone.now()
+                if watermark.gap_id != watermark.last_id + 1:
+                    watermark.gap_id, watermark.gap_since = watermark.last_id + 1, now
+                    watermark.save()
+                    return folded
+                if now - watermark.gap_since < GAP_TIMEOUT:
+                    return folded
+                # given up on, every id up to the next event was already missing when the wait started
+                watermark.last_id = ids[0] - 1
+                watermark.save()
+                continue
+
+            upper = ids[run - 1]
+            events = PlayEvent.objects.filter(id__gt=watermark.last_id, id__lte=upper)
+            for granularity, trunc in TRUNCATE.items():
+                _fold(events, granularity, trunc)
+            folded += run
+
+            watermark.last_id = upper
+            watermark.save()
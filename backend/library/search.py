@@ -0,0 +1,105 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Song
+
+SEARCH_TABLE = 'library_song_fts'
+# bm25 column weights: title, authors, album, genres
+BM25_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+INDEX_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_enabled() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def build_match_query(text: str) -> str | None:
+    """
+    Turn free text into an FTS5 query: every word quoted (so no user input is parsed as syntax),
+    all of them required and matched as prefixes.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _document_rows(song_ids):
+    songs = Song.objects.filter(id__in=song_ids).select_related('album').only('id', 'title', 'album__title') \
+        .prefetch_related('authors', 'genres')
+    for song in songs:
+        yield (
+            song.id,
+            song.title,
+            ' '.join(author.title for author in song.authors.all()),
+            song.album.title,
+            ' '.join(genre.title for genre in song.genres.all()),
+        )
+
+
+def index_songs(song_ids) -> None:
+    """
+    (Re)build the search documents of the given songs; songs that no longer exist are dropped.
+    """
+    if not fts_enabled():
+        return
+    song_ids = list(song_ids)
+    with connection.cursor() as cursor:
+        for i in range(0, len(song_ids), INDEX_BATCH_SIZE):
+            chunk = song_ids[i:i + INDEX_BATCH_SIZE]
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(chunk))})', chunk)
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, authors, album, genres) VALUES (%s, %s, %s, %s, %s)',
+                list(_document_rows(chunk)),
+            )
+
+
+def remove_songs(song_ids) -> None:
+    if not fts_enabled():
+        return
+    song_ids = list(song_ids)
+    with connection.cursor() as cursor:
+        for i in range(0, len(song_ids), INDEX_BATCH_SIZE):
+            chunk = song_ids[i:i + INDEX_BATCH_SIZE]
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+
+def rebuild_index() -> int:
+    if not fts_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+    song_ids = list(Song.objects.values_list('id', flat=True))
+    index_songs(song_ids)
+    return len(song_ids)
+
+
+def search_song_ids(text: str, limit: int, offset: int = 0) -> list[int]:
+    """
+    Ids of the songs matching text across song, author, album and genre titles, best bm25 match first.
+    """
+    match = build_match_query(text)
+    if match is None:
+        return []
+
+    if not fts_enabled():
+        words = _TOKEN_RE.findall(text)
+        condition = Q()
+        for word in words:
+            condition &= (Q(title__icontains=word) | Q(album__title__icontains=word)
+                          | Q(authors__title__icontains=word) | Q(genres__title__icontains=word))
+        songs = Song.objects.filter(condition).distinct().order_by('id').values_list('id', flat=True)
+        return list(songs[offset:offset + limit])
+
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s OFFSET %s',
+            [match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
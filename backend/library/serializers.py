@@ -1,37 +1,57 @@
 from rest_framework import serializers
 from utils import validate_exist_and_return_array, validate_exist_and_return
-from .models import Song, Album, Author, Genre, UserSongPlay
+from .models import Song, Album, Author, Genre, UserSongPlay, UserPlayRollup, Granularity, \
+    ChartEntry, UploadSession
+from .charts import CHART_WINDOWS, CHART_SIZE
+from .audio import probe_file
+from .plays import record_play
+from .typeahead import update_index, SONG, ALBUM, AUTHOR, MAX_SUGGESTIONS
+from .uploads import upload_settings, create_part_file, missing_chunks
 from relations import RelatedFieldOptimized
+from images import ImageDerivativesField
 
 
 class AuthorReadSerializer(serializers.ModelSerializer):
+    picture_derivatives = ImageDerivativesField(source='picture')
+
     class Meta:
         model = Author
-        fields = ['id', 'title', 'picture']
+        fields = ['id', 'title', 'picture', 'picture_derivatives']
 
 
 class AlbumReadSerializer(serializers.ModelSerializer):
+    picture_derivatives = ImageDerivativesField(source='picture')
 
     class Meta:
         model = Album
-        fields = ['id', 'title', 'picture']
+        fields = ['id', 'title', 'picture', 'picture_derivatives']
 
 
 class SongReadSerializer(serializers.ModelSerializer):
     authors = AuthorReadSerializer(read_only=True, many=True)
     album = AlbumReadSerializer(read_only=True)
+    picture_derivatives = ImageDerivativesField(source='picture')
+    # looked up in context['liked'] (playlists.likes.LikedSongs), no query per song
+    is_liked = serializers.SerializerMethodField()
 
     class Meta:
         model = Song
-        fields = ['id', 'title', 'picture', 'audio', 'authors', 'album']
+        fields = ['id', 'title', 'picture', 'picture_derivatives', 'audio', 'duration', 'authors', 'album',
+                  'is_liked']
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
+    def get_fields(self):
+        # drop the relations up front so they are never loaded, not just hidden from the output
+        fields = super().get_fields()
         if not self.context.get('album', True):
-            data.pop('album')
+            fields.pop('album')
         if not self.context.get('authors', True):
-            data.pop('authors')
-        return data
+            fields.pop('authors')
+        if self.context.get('liked') is None:
+            fields.pop('is_liked')
+        return fields
+
+    def get_is_liked(self, obj):
+        return obj.id in self.context['liked']
 
 
 class AuthorSerializer(serializers.ModelSerializer):
@@ -39,16 +59,18 @@ class AuthorSerializer(serializers.ModelSerializer):
     albums = AlbumReadSerializer(many=True, read_only=True)
     # songs = SongReadSerializer(many=True, read_only=True, context=get_dict(album=True))
     picture = serializers.ImageField(required=False)
+    picture_derivatives = ImageDerivativesField(source='picture')
 
     class Meta:
         model = Author
-        fields = ['id', 'title', 'picture', 'albums']
+        fields = ['id', 'title', 'picture', 'picture_derivatives', 'albums']
         read_only_fields = ['id', 'user', 'created_at']
 
     def create(self, validated_data):
         author = Author(title=validated_data['title'], user=self.context.get('request').user)
         author.picture = validated_data.get('picture', author.picture)
         author.save()
+        update_index(AUTHOR, author.id, author.title)
 
         return author
 
@@ -56,6 +78,7 @@ class AuthorSerializer(serializers.ModelSerializer):
         instance.title = validated_data.get('title', instance.title)
         instance.picture = validated_data.get('picture', instance.picture)
         instance.save()
+        update_index(AUTHOR, instance.id, instance.title)
 
         return instance
 
@@ -64,12 +87,13 @@ class AlbumSerializer(serializers.ModelSerializer):
     # change title, picture, author
     author = serializers.PrimaryKeyRelatedField(queryset=Author.objects.all())
     picture = serializers.ImageField(required=False)
+    picture_derivatives = ImageDerivativesField(source='picture')
 
     # songs = SongReadSerializer(many=True, read_only=True)
 
     class Meta:
         model = Album
-        fields = ['id', 'title', 'author', 'picture']
+        fields = ['id', 'title', 'author', 'picture', 'picture_derivatives']
         read_only_fields = ['id', 'user', 'created_at']
 
     def create(self, validated_data):
@@ -80,17 +104,19 @@ class AlbumSerializer(serializers.ModelSerializer):
         album.picture = validated_data.get('picture', album.picture)
         album.author = author
         album.save()
+        update_index(ALBUM, album.id, album.title)
 
         return album
 
     def update(self, instance, validated_data):
-        authors_data = validated_data.pop('authors', None)
-        authors = validate_exist_and_return_array(authors_data, Author)
-        instance.authors.add(*authors)
+        author_data = validated_data.pop('author', None)
+        if author_data is not None:
+            instance.author = validate_exist_and_return(author_data, Author)
 
         instance.title = validated_data.get('title', instance.title)
         instance.picture = validated_data.get('picture', instance.picture)
         instance.save()
+        update_index(ALBUM, instance.id, instance.title)
 
         return instance
 
@@ -108,11 +134,13 @@ class SongSerializer(serializers.ModelSerializer):
     genres = serializers.PrimaryKeyRelatedField(many=True, queryset=Genre.objects.all())
     authors = serializers.PrimaryKeyRelatedField(many=True, queryset=Author.objects.all())
     picture = serializers.ImageField(required=False)
+    picture_derivatives = ImageDerivativesField(source='picture')
 
     class Meta:
         model = Song
-        fields = ['id', 'title', 'audio', 'picture', 'genres', 'album', 'authors', 'user']
-        read_only_fields = ['id', 'user', 'created_at']
+        fields = ['id', 'title', 'audio', 'picture', 'picture_derivatives', 'genres', 'album', 'authors', 'user',
+                  'duration', 'bitrate', 'sample_rate', 'channels']
+        read_only_fields = ['id', 'user', 'created_at', 'duration', 'bitrate', 'sample_rate', 'channels']
 
     def create(self, validated_data):
         album_data = validated_data.pop('album', None)
@@ -124,13 +152,17 @@ class SongSerializer(serializers.ModelSerializer):
 
         song = Song(title=validated_data['title'], user=self.context.get('request').user,
                     audio=validated_data['audio'])
-        song.picture = validated_data['picture']
+        song.picture = validated_data.get('picture', song.picture)
         song.album = album
+        # probed while it was received by AudioUploadHandler, otherwise read from the file headers now
+        audio_info = getattr(validated_data['audio'], 'audio_info', None) or probe_file(validated_data['audio'])
+        song.duration, song.bitrate, song.sample_rate, song.channels = audio_info
         song.save()
 
         song.genres.add(*genres)
         song.authors.add(*authors)
         song.save()
+        update_index(SONG, song.id, song.title)
 
         return song
 
@@ -149,12 +181,13 @@ class SongSerializer(serializers.ModelSerializer):
         instance.genres.add(*genres)
         instance.authors.add(*authors)
         instance.save()
+        update_index(SONG, instance.id, instance.title)
 
         return instance
 
 
 class UserSongPlaySerializer(serializers.ModelSerializer):
-    song = serializers.PrimaryKeyRelatedField(queryset=Song.objects.all())
+    song = serializers.PrimaryKeyRelatedField(queryset=Song.objects.only('id'))
 
     class Meta:
         model = UserSongPlay
@@ -162,16 +195,111 @@ class UserSongPlaySerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
     def create(self, validated_data):
-        song_id = validated_data.pop('song', None)
-        song = validate_exist_and_return(song_id, Song)
+        song = validated_data['song']
         user = self.context.get('request').user
 
-        try:
-            play = UserSongPlay.objects.get(user=user, song=song)
-        except UserSongPlay.DoesNotExist:
-            play = UserSongPlay(user=user, song=song)
+        # buffered plays are written behind, so an unsaved instance is returned
+        if record_play(song.id, user.id):
+            return UserSongPlay(user=user, song=song)
+        return UserSongPlay.objects.get(user=user, song=song)
+
+
+class PlayStatsQuerySerializer(serializers.Serializer):
+    granularity = serializers.ChoiceField(choices=Granularity.choices, default=Granularity.DAY)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    song_id = serializers.IntegerField(required=False)
+
+
+class PlayHistoryQuerySerializer(serializers.Serializer):
+    granularity = serializers.ChoiceField(choices=Granularity.choices, default=Granularity.DAY)
+    at = serializers.DateTimeField()
+
+
+class PlayBucketSerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    count = serializers.IntegerField()
+
+
+class PlayHistorySerializer(serializers.ModelSerializer):
+    song = SongReadSerializer(read_only=True)
+
+    class Meta:
+        model = UserPlayRollup
+        fields = ['song', 'bucket', 'count']
+
+
+class ChartQuerySerializer(serializers.Serializer):
+    window = serializers.ChoiceField(choices=list(CHART_WINDOWS), default='week')
+    genre_id = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=CHART_SIZE, default=CHART_SIZE)
+
+
+class TypeaheadQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False, default='')
+    k = serializers.IntegerField(min_value=1, max_value=MAX_SUGGESTIONS, default=10)
+
+
+class RecommendationQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    # the "watermark" record of the previous export
+    since = serializers.DateTimeField(required=False, default=None)
+    after_play_id = serializers.IntegerField(min_value=0, default=0)
+    gzip = serializers.BooleanField(default=False)
+
+
+class ChartEntrySerializer(serializers.ModelSerializer):
+    song = SongReadSerializer(read_only=True)
+
+    class Meta:
+        model = ChartEntry
+        fields = ['rank', 'plays', 'song']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False)
+    chunk_count = serializers.IntegerField(read_only=True)
+    missing = serializers.SerializerMethodField()
+    expires_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'chunk_size', 'chunk_count', 'missing', 'expires_at', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def validate_size(self, value):
+        max_size = upload_settings()['MAX_SIZE']
+        if not 0 < value <= max_size:
+            raise serializers.ValidationError(f'Ensure this value is between 1 and {max_size}.')
+        return value
+
+    def validate_chunk_size(self, value):
+        config = upload_settings()
+        if not config['MIN_CHUNK_SIZE'] <= value <= config['MAX_CHUNK_SIZE']:
+            raise serializers.ValidationError(
+                f'Ensure this value is between {config["MIN_CHUNK_SIZE"]} and {config["MAX_CHUNK_SIZE"]}.')
+        return value
+
+    def get_missing(self, obj):
+        return missing_chunks(obj)
+
+    def get_expires_at(self, obj):
+        return serializers.DateTimeField().to_representation(obj.updated_at + upload_settings()['EXPIRY'])
+
+    def create(self, validated_data):
+        session = UploadSession(filename=validated_data['filename'], size=validated_data['size'],
+                                user=self.context.get('request').user)
+        session.chunk_size = validated_data.get('chunk_size', upload_settings()['CHUNK_SIZE'])
+        session.save()
+        create_part_file(session)
+
+        return session
 
-        play.count += 1
-        play.save()
 
-        return play
+class RequestStatsQuerySerializer(serializers.Serializer):
+    order = serializers.ChoiceField(choices=('total_time', 'p95_time', 'queries', 'sql_time', 'duplicate_queries',
+                                             'serialization_time'), default='total_time')
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
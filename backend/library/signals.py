@@ -0,0 +1,109 @@
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .cache import get_response_cache, SONG, ALBUM, AUTHOR
+from .models import Song, Album, Author, Genre
+from .search import index_songs, remove_songs
+from . import typeahead
+
+
+@receiver(post_save, sender=Song)
+def index_saved_song(sender, instance, **kwargs):
+    index_songs([instance.id])
+
+
+@receiver(post_delete, sender=Song)
+def remove_deleted_song(sender, instance, **kwargs):
+    remove_songs([instance.id])
+
+
+@receiver(m2m_changed, sender=Song.authors.through)
+@receiver(m2m_changed, sender=Song.genres.through)
+def index_song_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_songs([instance.id])
+    elif action in ('post_add', 'post_remove'):
+        index_songs(pk_set)
+    elif action == 'pre_clear':
+        # the songs are only known before the clear
+        instance._search_song_ids = list(instance.songs.values_list('id', flat=True))
+    elif action == 'post_clear':
+        index_songs(getattr(instance, '_search_song_ids', []))
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def index_renamed_songs(sender, instance, created, **kwargs):
+    if not created:
+        index_songs(instance.songs.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def collect_related_songs(sender, instance, **kwargs):
+    instance._search_song_ids = list(instance.songs.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def index_related_songs(sender, instance, **kwargs):
+    index_songs(getattr(instance, '_search_song_ids', []))
+
+
+# response cache versions, see library.cache
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def bump_song(sender, instance, **kwargs):
+    get_response_cache().bump(SONG, instance.id)
+
+
+@receiver(m2m_changed, sender=Song.authors.through)
+@receiver(m2m_changed, sender=Song.genres.through)
+def bump_song_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            get_response_cache().bump(SONG, instance.id)
+    elif action in ('post_add', 'post_remove'):
+        get_response_cache().bump(SONG, *pk_set)
+    elif action == 'post_clear':
+        get_response_cache().bump(SONG, *getattr(instance, '_search_song_ids', []))
+
+
+@receiver(post_init, sender=Album)
+def remember_album_author(sender, instance, **kwargs):
+    instance._loaded_author_id = instance.__dict__.get('author_id')
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def bump_album(sender, instance, **kwargs):
+    # authors embed their albums, including the author the album was moved away from
+    get_response_cache().bump(ALBUM, instance.id)
+    get_response_cache().bump(AUTHOR, *{instance.author_id, instance._loaded_author_id} - {None})
+    instance._loaded_author_id = instance.author_id
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def bump_author(sender, instance, **kwargs):
+    get_response_cache().bump(AUTHOR, instance.id)
+
+
+@receiver(post_delete, sender=Genre)
+def bump_genre_songs(sender, instance, **kwargs):
+    # the song-genre rows are deleted without m2m_changed
+    get_response_cache().bump(SONG, *getattr(instance, '_search_song_ids', []))
+
+
+# typeahead suggestions, see library.typeahead
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Author)
+def remove_suggestion(sender, instance, **kwargs):
+    kind, pk = {Song: typeahead.SONG, Album: typeahead.ALBUM, Author: typeahead.AUTHOR}[sender], instance.id
+    transaction.on_commit(lambda: typeahead.remove_from_index(kind, pk))
@@ -0,0 +1,193 @@
+import mimetypes
+import re
+import uuid
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from .blobs import is_blob_name
+
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+_RANGE_SPEC_RE = re.compile(r'^(\d*)-(\d*)$')
+
+
+class AudioFile:
+    """
+    Size, validators and an open handle for the file stored in a FileField.
+    """
+
+    def __init__(self, field_file):
+        self.field_file = field_file
+        self.storage = field_file.storage
+        self.name = field_file.name
+        self.size = field_file.size
+        modified = self.storage.get_modified_time(self.name)
+        self.last_modified = int(modified.timestamp())
+        self.etag = f'"{self.size:x}-{int(modified.timestamp() * 1_000_000):x}"'
+        self.content_type = mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+
+    def open(self):
+        return self.storage.open(self.name, 'rb')
+
+
+def parse_range_header(header: str | None, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parse a "bytes=" Range header into sorted, merged, inclusive (start, end) pairs.
+    Returns None when the header must be ignored and [] when nothing is satisfiable.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = _RANGE_SPEC_RE.match(spec.strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start >= size:
+                continue
+            ranges.append((start, min(end, size - 1)))
+        elif last:
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                # an empty file has no last byte to count from
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+        else:
+            return None
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(header: str | None, audio: AudioFile) -> bool:
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"'):
+        return header == audio.etag
+    if header.startswith('W/'):
+        return False
+    return parse_http_date_safe(header) == audio.last_modified
+
+
+def _iter_range(file, start, end):
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = file.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _iter_single_range(file, start, end):
+    try:
+        yield from _iter_range(file, start, end)
+    finally:
+        file.close()
+
+
+def _multipart_parts(ranges, size, content_type, boundary):
+    for start, end in ranges:
+        head = (f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('ascii')
+        yield head, start, end
+    yield f'\r\n--{boundary}--\r\n'.encode('ascii'), None, None
+
+
+def _iter_multipart(file, parts):
+    try:
+        for head, start, end in parts:
+            yield head
+            if start is not None:
+                yield from _iter_range(file, start, end)
+    finally:
+        file.close()
+
+
+def _sendfile_response(audio: AudioFile, header: str) -> HttpResponse:
+    # Hand the file over to the front server, which serves ranges with sendfile(2) itself.
+    prefix = getattr(settings, 'SONG_STREAM_SENDFILE_PREFIX', settings.MEDIA_URL)
+    response = HttpResponse(content_type=audio.content_type)
+    response[header] = prefix + audio.name
+    return response
+
+
+def _set_validators(response, audio: AudioFile):
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = audio.etag
+    response['Last-Modified'] = http_date(audio.last_modified)
+    if is_blob_name(audio.name):
+        # content-addressed, the bytes behind this name never change
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
+
+
+def stream_audio(request, field_file) -> HttpResponse:
+    """
+    Serve a stored audio file honouring Range, If-Range and If-None-Match.
+    """
+    audio = AudioFile(field_file)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and ('*' in parse_etags(if_none_match) or audio.etag in parse_etags(if_none_match)):
+        return _set_validators(HttpResponseNotModified(), audio)
+
+    sendfile_header = getattr(settings, 'SONG_STREAM_SENDFILE_HEADER', None)
+    if sendfile_header:
+        return _set_validators(_sendfile_response(audio, sendfile_header), audio)
+
+    ranges = None
+    if if_range_matches(request.META.get('HTTP_IF_RANGE'), audio):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE'), audio.size)
+
+    if ranges is None:
+        # FileResponse goes through wsgi.file_wrapper, which lets the server use sendfile(2).
+        response = FileResponse(audio.open(), content_type=audio.content_type)
+        response['Content-Length'] = audio.size
+        return _set_validators(response, audio)
+
+    if not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{audio.size}'
+        return _set_validators(response, audio)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_iter_single_range(audio.open(), start, end),
+                                         status=206, content_type=audio.content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{audio.size}'
+        response['Content-Length'] = end - start + 1
+        return _set_validators(response, audio)
+
+    boundary = uuid.uuid4().hex
+    parts = list(_multipart_parts(ranges, audio.size, audio.content_type, boundary))
+    length = sum(len(head) + (end - start + 1 if start is not None else 0) for head, start, end in parts)
+    response = StreamingHttpResponse(_iter_multipart(audio.open(), parts), status=206,
+                                     content_type=f'multipart/byteranges; boundary={boundary}')
+    response['Content-Length'] = length
+    return _set_validators(response, audio)
@@ -0,0 +1,262 @@
+from typing import NamedTuple
+
+ID3V1_SIZE = 128
+# the original ID3v1 genres, which ID3v2 TCON frames still reference by number
+ID3V1_GENRES = (
+    'Blues', 'Classic Rock', 'Country', 'Dance', 'Disco', 'Funk', 'Grunge', 'Hip-Hop', 'Jazz', 'Metal',
+    'New Age', 'Oldies', 'Other', 'Pop', 'R&B', 'Rap', 'Reggae', 'Rock', 'Techno', 'Industrial',
+    'Alternative', 'Ska', 'Death Metal', 'Pranks', 'Soundtrack', 'Euro-Techno', 'Ambient', 'Trip-Hop', 'Vocal',
+    'Jazz+Funk', 'Fusion', 'Trance', 'Classical', 'Instrumental', 'Acid', 'House', 'Game', 'Sound Clip',
+    'Gospel', 'Noise', 'AlternRock', 'Bass', 'Soul', 'Punk', 'Space', 'Meditative', 'Instrumental Pop',
+    'Instrumental Rock', 'Ethnic', 'Gothic', 'Darkwave', 'Techno-Industrial', 'Electronic', 'Pop-Folk',
+    'Eurodance', 'Dream', 'Southern Rock', 'Comedy', 'Cult', 'Gangsta', 'Top 40', 'Christian Rap', 'Pop/Funk',
+    'Jungle', 'Native American', 'Cabaret', 'New Wave', 'Psychadelic', 'Rave', 'Showtunes', 'Trailer', 'Lo-Fi',
+    'Tribal', 'Acid Punk', 'Acid Jazz', 'Polka', 'Retro', 'Musical', 'Rock & Roll', 'Hard Rock',
+)
+ID3_FRAMES = {
+    'TIT2': 'title', 'TT2': 'title',
+    'TPE1': 'artists', 'TP1': 'artists',
+    'TALB': 'album', 'TAL': 'album',
+    'TCON': 'genres', 'TCO': 'genres',
+}
+VORBIS_FIELDS = {'TITLE': 'title', 'ARTIST': 'artists', 'ALBUM': 'album', 'GENRE': 'genres'}
+RIFF_INFO_FIELDS = {b'INAM': 'title', b'IART': 'artists', b'IPRD': 'album', b'IGNR': 'genres'}
+ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+FRONT_COVER = 3
+PICTURE_MIME_TYPES = {'image/jpeg': '.jpg', 'image/jpg': '.jpg', 'image/png': '.png', 'image/gif': '.gif',
+                      'image/webp': '.webp', 'JPG': '.jpg', 'PNG': '.png'}
+
+
+class Tags(NamedTuple):
+    title: str | None = None
+    artists: tuple[str, ...] = ()
+    album: str | None = None
+    genres: tuple[str, ...] = ()
+    # cover art and the extension of its format
+    picture: bytes | None = None
+    picture_extension: str | None = None
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _split_terminated(data: bytes, encoding: int) -> tuple[bytes, bytes]:
+    # a string ends at a null character, two bytes wide (and aligned) in UTF-16
+    if encoding in (1, 2):
+        for position in range(0, len(data) - 1, 2):
+            if data[position:position + 2] == b'\x00\x00':
+                return data[:position], data[position + 2:]
+        return data, b''
+    position = data.find(b'\x00')
+    return (data, b'') if position == -1 else (data[:position], data[position + 1:])
+
+
+def _id3_text(data: bytes) -> list[str]:
+    if not data or data[0] >= len(ID3_ENCODINGS):
+        return []
+    text = data[1:].decode(ID3_ENCODINGS[data[0]], errors='replace')
+    # ID3v2.4 separates multiple values with nulls
+    return [value.strip() for value in text.split('\x00') if value.strip()]
+
+
+def _id3_genres(values: list[str]) -> list[str]:
+    genres = []
+    for value in values:
+        # ID3v2.3 writes references as "(17)", or "(17)Rock" refined by a name, ID3v2.4 as "17"
+        numbers = []
+        while value.startswith('(') and ')' in value and value[1:value.index(')')].isdigit():
+            numbers.append(int(value[1:value.index(')')]))
+            value = value[value.index(')') + 1:]
+        if value.isdigit():
+            numbers.append(int(value))
+            value = ''
+        if value:
+            genres.append(value)
+        else:
+            genres.extend(ID3V1_GENRES[number] for number in numbers if number < len(ID3V1_GENRES))
+    return genres
+
+
+def _id3_picture(data: bytes, v22: bool) -> tuple[int, str, bytes] | None:
+    if len(data) < 5:
+        return None
+    encoding = data[0]
+    if v22:
+        mime, rest = data[1:4].decode('latin-1'), data[4:]
+    else:
+        mime, rest = _split_terminated(data[1:], 0)
+        mime = mime.decode('latin-1')
+    if not rest:
+        return None
+    _, image = _split_terminated(rest[1:], encoding)
+    return rest[0], mime, image
+
+
+def _read_id3v2(file, values: dict) -> None:
+    header = file.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        file.seek(0)
+        return
+    version, flags = header[3], header[5]
+    data = file.read(_syncsafe(header[6:10]))
+    if version < 4 and flags & 0x80:
+        # ID3v2.2/2.3 unsynchronise the whole tag
+        data = data.replace(b'\xff\x00', b'\xff')
+    position = 0
+    if flags & 0x40 and version >= 3:
+        extended = _syncsafe(data[:4]) if version == 4 else int.from_bytes(data[:4], 'big') + 4
+        position = extended
+
+    id_size, header_size = (3, 6) if version == 2 else (4, 10)
+    pictures = []
+    while position + header_size <= len(data):
+        frame_id = data[position:position + id_size]
+        if not frame_id.strip(b'\x00') or not frame_id.isalnum():
+            break
+        if version == 2:
+            size, frame_flags = int.from_bytes(data[position + 3:position + 6], 'big'), 0
+        else:
+            size_bytes = data[position + 4:position + 8]
+            size = _syncsafe(size_bytes) if version == 4 else int.from_bytes(size_bytes, 'big')
+            frame_flags = int.from_bytes(data[position + 8:position + 10], 'big')
+        body = data[position + header_size:position + header_size + size]
+        position += header_size + size
+
+        if version == 4:
+            # compressed and encrypted frames are skipped
+            if frame_flags & 0x000c:
+                continue
+            if frame_flags & 0x0001:
+                body = body[4:]
+            if frame_flags & 0x0002:
+                body = body.replace(b'\xff\x00', b'\xff')
+        elif version == 3 and frame_flags & 0x00c0:
+            continue
+
+        frame_id = frame_id.decode('latin-1')
+        field = ID3_FRAMES.get(frame_id)
+        if field is not None and field not in values:
+            text = _id3_text(body)
+            if field == 'genres':
+                text = _id3_genres(text)
+            if text:
+                values[field] = text
+        elif frame_id in ('APIC', 'PIC'):
+            picture = _id3_picture(body, frame_id == 'PIC')
+            if picture is not None:
+                pictures.append(picture)
+    _pick_picture(values, pictures)
+
+
+def _read_id3v1(file, size: int, values: dict) -> None:
+    if size < ID3V1_SIZE:
+        return
+    file.seek(size - ID3V1_SIZE)
+    data = file.read(ID3V1_SIZE)
+    if data[:3] != b'TAG':
+        return
+
+    def text(start, length):
+        return data[start:start + length].split(b'\x00')[0].decode('latin-1').strip()
+
+    for field, value in (('title', text(3, 30)), ('artists', text(33, 30)), ('album', text(63, 30))):
+        if value:
+            values.setdefault(field, [value])
+    if data[127] < len(ID3V1_GENRES):
+        values.setdefault('genres', [ID3V1_GENRES[data[127]]])
+
+
+def _read_flac(file, values: dict) -> None:
+    pictures = []
+    last = False
+    while not last:
+        header = file.read(4)
+        if len(header) < 4:
+            break
+        last, kind, size = bool(header[0] & 0x80), header[0] & 0x7f, int.from_bytes(header[1:4], 'big')
+        if kind == 4:
+            data = file.read(size)
+            position = 4 + int.from_bytes(data[:4], 'little')
+            count = int.from_bytes(data[position:position + 4], 'little')
+            position += 4
+            comments = {}
+            for _ in range(count):
+                length = int.from_bytes(data[position:position + 4], 'little')
+                key, _, value = data[position + 4:position + 4 + length].decode('utf-8', errors='replace') \
+                    .partition('=')
+                position += 4 + length
+                field = VORBIS_FIELDS.get(key.upper())
+                if field is not None and value.strip():
+                    comments.setdefault(field, []).append(value.strip())
+            for field, value in comments.items():
+                values.setdefault(field, value)
+        elif kind == 6:
+            data = file.read(size)
+            mime_length = int.from_bytes(data[4:8], 'big')
+            mime = data[8:8 + mime_length].decode('latin-1')
+            position = 8 + mime_length
+            position += 4 + int.from_bytes(data[position:position + 4], 'big') + 16
+            length = int.from_bytes(data[position:position + 4], 'big')
+            pictures.append((int.from_bytes(data[:4], 'big'), mime, data[position + 4:position + 4 + length]))
+        else:
+            file.seek(size, 1)
+    _pick_picture(values, pictures)
+
+
+def _read_riff_info(file, values: dict) -> None:
+    file.seek(12)
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        chunk_id, size = header[:4], int.from_bytes(header[4:8], 'little')
+        if chunk_id == b'LIST' and file.read(4) == b'INFO':
+            data = file.read(size - 4)
+            position = 0
+            while position + 8 <= len(data):
+                sub_id = data[position:position + 4]
+                sub_size = int.from_bytes(data[position + 4:position + 8], 'little')
+                field = RIFF_INFO_FIELDS.get(sub_id)
+                value = data[position + 8:position + 8 + sub_size].split(b'\x00')[0].decode('latin-1').strip()
+                if field is not None and value:
+                    values.setdefault(field, [value])
+                position += 8 + sub_size + (sub_size & 1)
+            return
+        file.seek(size + (size & 1) - (4 if chunk_id == b'LIST' else 0), 1)
+
+
+def _pick_picture(values: dict, pictures: list) -> None:
+    pictures = [(kind, mime, data) for kind, mime, data in pictures if data and mime in PICTURE_MIME_TYPES]
+    if pictures and 'picture' not in values:
+        kind, mime, data = next((picture for picture in pictures if picture[0] == FRONT_COVER), pictures[0])
+        values['picture'] = (data, PICTURE_MIME_TYPES[mime])
+
+
+def read_tags(file, size: int) -> Tags:
+    """
+    Title, artists, album, genres and cover art of an MP3 (ID3v2, ID3v1), FLAC (Vorbis comments, also
+    behind an ID3v2 tag) or WAV (RIFF INFO) file of the given size. Whatever is missing or malformed is
+    left out.
+    """
+    values = {}
+    try:
+        _read_id3v2(file, values)
+        start = file.tell()
+        head = file.read(12)
+        if head[:4] == b'fLaC':
+            file.seek(start + 4)
+            _read_flac(file, values)
+        elif head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            _read_riff_info(file, values)
+        else:
+            _read_id3v1(file, size, values)
+    except (IndexError, ValueError, UnicodeError):
+        pass
+    finally:
+        file.seek(0)
+
+    title, album = values.get('title', [None])[0], values.get('album', [None])[0]
+    picture, extension = values.get('picture', (None, None))
+    return Tags(title=title, artists=tuple(dict.fromkeys(values.get('artists', ()))), album=album,
+                genres=tuple(dict.fromkeys(values.get('genres', ()))), picture=picture, picture_extension=extension)
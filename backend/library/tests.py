@@ -1,3 +1,1383 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+import images
+import instrumentation
+from . import blobs, cache, exports, plays, recommendations, rollups, search, typeahead, uploads, waveforms
+from .audio import AudioInfo, AudioProbe, probe_file
+from .cache import LocalLRUBackend
+from .charts import CHART_WINDOWS, refresh_charts, top_songs
+from .management.commands import benchmark_asgi
+from .imports import ImportedFile, LibraryImporter, place_files, read_file
+from .models import Author, Album, Genre, Song, PlayEvent, ChartEntry, Blob, UserSongPlay, SongWaveform, \
+    Granularity, RollupWatermark, SongPlayRollup, UserPlayRollup
+from .serializers import AlbumReadSerializer
+from .rollups import bucket_start, rollup_plays
+from .streaming import MAX_RANGES, parse_range_header
+from .tags import Tags, read_tags
+from .views import ShortSongView, SongView
+from playlists.models import Collection, Playlist, SongCollection, SongPlaylist
+from playlists.positions import spread_keys
+from playlists.views import CollectionView, PlaylistView
+from utils import increment_counters, _increment_counters_with_updates
+
+
+class ChartsTests(TestCase):
+    def setUp(self):
+        self.rnd = random.Random(0)
+        self.user = User.objects.create_user('charts')
+        author = Author.objects.create(title='author', user=self.user)
+        album = Album.objects.create(title='album', user=self.user, author=author)
+        self.genres = [Genre.objects.create(title=f'genre {i}') for i in range(2)]
+        self.songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=album)
+                      for i in range(30)]
+        for i, song in enumerate(self.songs):
+            song.genres.add(self.genres[i % 2])
+        self.now = timezone.now()
+
+    def play(self, count, span):
+        PlayEvent.objects.bulk_create([
+            PlayEvent(song=self.rnd.choice(self.songs), user=self.user,
+                      played_at=self.now - timedelta(seconds=self.rnd.random() * span.total_seconds()))
+            for _ in range(count)])
+
+    def refresh(self):
+        with mock.patch('library.charts.timezone.now', return_value=self.now):
+            refresh_charts()
+
+    def assertChartsMatchRollups(self):
+        for window in CHART_WINDOWS:
+            for genre in [None, *self.genres]:
+                genre_id = genre.id if genre is not None else None
+                entries = ChartEntry.objects.filter(window=window, genre_id=genre_id).order_by('rank')
+                self.assertEqual([(entry.song_id, entry.plays) for entry in entries],
+                                 [(row['song_id'], row['plays']) for row in top_songs(window, genre_id, now=self.now)],
+                                 (window, genre_id))
+
+    def test_incremental_refresh_matches_recomputation(self):
+        self.play(500, timedelta(days=40))
+        rollup_plays()
+        self.refresh()
+        self.assertChartsMatchRollups()
+
+        for step in (timedelta(hours=5), timedelta(days=2), timedelta(days=9)):
+            # recent plays, late ones inside the windows and ones already out of them
+            self.play(200, timedelta(days=35))
+            self.now += step
+            self.play(50, timedelta(hours=3))
+            rollup_plays()
+            self.refresh()
+            self.assertChartsMatchRollups()
+
+    def test_refresh_before_the_rollup_catches_up(self):
+        self.play(300, timedelta(days=10))
+        rollup_plays()
+        self.refresh()
+        self.play(100, timedelta(days=10))
+        self.refresh()
+        self.assertChartsMatchRollups()
+        rollup_plays()
+        self.refresh()
+        self.assertChartsMatchRollups()
+
+
+class TypeaheadIndexTests(TestCase):
+    def test_memoized_tops_follow_changes(self):
+        rnd = random.Random(0)
+        words = ['sun', 'song', 'sister', 'storm', 'summer', 'moon', 'moth', 'dark', 'side', 'stone']
+        index = typeahead.TypeaheadIndex()
+        index.bulk_load((typeahead.SONG, pk, ' '.join(rnd.sample(words, 2)), rnd.randint(0, 50))
+                        for pk in range(300))
+        index.warm()
+        for _ in range(500):
+            pk = rnd.randrange(320)
+            if rnd.random() < 0.6:
+                index.add(typeahead.SONG, pk, ' '.join(rnd.sample(words, rnd.randint(1, 3))),
+                          rnd.randint(0, 50) if rnd.random() < 0.5 else None)
+            else:
+                index.remove(typeahead.SONG, pk)
+            for prefix in ('s', 'so', 'su', 'm'):
+                self.assertEqual(index.suggest(prefix, typeahead.MAX_SUGGESTIONS),
+                                 [{'type': kind, 'id': pk, 'title': index._docs[(kind, pk)][0]}
+                                  for kind, pk in index._scan(prefix)])
+
+
+@override_settings(TYPEAHEAD_SNAPSHOT='/nonexistent/typeahead.snapshot.json.gz')
+class TypeaheadViewTests(TestCase):
+    def setUp(self):
+        typeahead._index = None
+        self.user = User.objects.create_user('typeahead')
+        author = Author.objects.create(title='Stone Author', user=self.user)
+        self.album = Album.objects.create(title='Stone Album', user=self.user, author=author)
+        self.songs = [Song.objects.create(title=f'Stone {i}', audio='tracks/song.mp3', user=self.user,
+                                          album=self.album) for i in range(8)]
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def tearDown(self):
+        typeahead._index = None
+
+    def suggest(self, **params):
+        return self.client.get('/api/v1/library/typeahead', params, **self.headers)
+
+    def test_k_is_validated(self):
+        self.assertEqual(len(self.suggest(q='sto', k=3).json()), 3)
+        for k in (-1, 0, typeahead.MAX_SUGGESTIONS + 1, 'x'):
+            self.assertEqual(self.suggest(q='sto', k=k).status_code, 400, k)
+
+    def test_deleted_rows_are_no_longer_suggested(self):
+        self.assertEqual(len(self.suggest(q='stone').json()), 10)
+        deleted = self.songs[0].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.songs[0].delete()
+        suggested = {(item['type'], item['id']) for item in self.suggest(q='stone', k=20).json()}
+        self.assertEqual(len(suggested), 9)
+        self.assertNotIn((typeahead.SONG, deleted), suggested)
+        self.assertIn((typeahead.ALBUM, self.album.id), suggested)
+
+        # songs deleted with their album
+        with self.captureOnCommitCallbacks(execute=True):
+            self.album.delete()
+        self.assertEqual([item['type'] for item in self.suggest(q='stone', k=20).json()], [typeahead.AUTHOR])
+
+    def test_imported_rows_are_suggested(self):
+        self.assertEqual(len(self.suggest(q='stone').json()), 10)
+        importer = LibraryImporter(self.user)
+        files = [ImportedFile(path=f'{title}.mp3', size=1, mtime=1, audio=f'blobs/{i}.mp3', audio_info=AudioInfo(),
+                              tags=Tags(title=title, artists=('Stone Author', 'Pebble Author'), album='Pebble Album'),
+                              picture=None, picture_size=0)
+                 for i, title in enumerate(['Pebble One', 'Pebble Two'])]
+        with self.captureOnCommitCallbacks(execute=True):
+            importer.add(files)
+        self.assertEqual(sorted((item['type'], item['title']) for item in self.suggest(q='pebble').json()),
+                         [(typeahead.ALBUM, 'Pebble Album'), (typeahead.AUTHOR, 'Pebble Author'),
+                          (typeahead.SONG, 'Pebble One'), (typeahead.SONG, 'Pebble Two')])
+
+
+class FakeStorage:
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.lookups = 0
+
+    def exists(self, name):
+        self.lookups += 1
+        return name in self.existing
+
+    def url(self, name):
+        return '/media/' + name
+
+
+class DerivativePoolTests(TestCase):
+    def setUp(self):
+        self.pool = images.DerivativePool(1, 10, ready_size=3, retry_after=60)
+        self.largest = lambda name: images.derivative_name(name, max(images.derivative_settings()['SIZES']),
+                                                           images.derivative_settings()['FORMATS'][-1])
+
+    def tearDown(self):
+        self.pool._executor.shutdown()
+
+    def test_ready_names_are_bounded(self):
+        storage = FakeStorage({self.largest(f'{i}.png') for i in range(5)})
+        with mock.patch.object(images, 'mark_ready'):
+            for i in range(5):
+                self.assertTrue(self.pool.ensure(storage, f'{i}.png'))
+        self.assertEqual(list(self.pool._ready), ['2.png', '3.png', '4.png'])
+        self.assertTrue(self.pool.ensure(storage, '4.png'))
+        self.assertEqual(storage.lookups, 5)
+
+    def test_failures_are_retried_after_a_while(self):
+        storage = FakeStorage()
+        with mock.patch.object(images, 'generate_derivatives', side_effect=OSError) as generate, \
+                self.assertLogs('images', 'ERROR'):
+            self.assertFalse(self.pool.ensure(storage, 'broken.png'))
+            self.pool._executor.submit(lambda: None).result()
+            self.assertFalse(self.pool.ensure(storage, 'broken.png'))
+            self.assertEqual(generate.call_count, 1)
+
+            later = time.monotonic() + 61
+            with mock.patch.object(images.time, 'monotonic', return_value=later):
+                self.assertFalse(self.pool.ensure(storage, 'broken.png'))
+                self.pool._executor.submit(lambda: None).result()
+            self.assertEqual(generate.call_count, 2)
+
+    def test_expected_failures_are_one_warning(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location=location)
+            storage.save('not-an-image.png', ContentFile(b'text'))
+            for name, reason in (('missing.png', 'the file is missing'),
+                                 ('not-an-image.png', 'it is not an image')):
+                with self.assertLogs('images', 'WARNING') as logs:
+                    self.assertFalse(self.pool.ensure(storage, name))
+                    self.pool._executor.submit(lambda: None).result()
+                    # not tried again meanwhile
+                    self.assertFalse(self.pool.ensure(storage, name))
+                    self.pool._executor.submit(lambda: None).result()
+                self.assertEqual(logs.output, [f'WARNING:images:No derivatives of {name}, {reason}'])
+                self.assertIsNone(logs.records[0].exc_info)
+
+    def test_default_pictures_are_not_probed_on_save(self):
+        user = User.objects.create_user('defaults')
+        with mock.patch.object(images, 'get_pool', return_value=self.pool), \
+                mock.patch.object(self.pool, 'submit') as submit:
+            author = Author.objects.create(title='author', user=user)
+            album = Album.objects.create(title='album', user=user, author=author)
+            submit.assert_not_called()
+            self.assertFalse(album.picture_derivatives_ready)
+
+            self.pool._set_ready(album.picture.name)
+            album.save()
+            album.refresh_from_db()
+            self.assertTrue(album.picture_derivatives_ready)
+
+            album.picture = 'pictures/albums/cover.png'
+            album.save()
+            submit.assert_called_once_with(album.picture.storage, 'pictures/albums/cover.png')
+            album.refresh_from_db()
+            self.assertFalse(album.picture_derivatives_ready)
+
+    def test_rows_record_readiness(self):
+        user = User.objects.create_user('derivatives')
+        author = Author.objects.create(title='author', user=user)
+        album = Album.objects.create(title='album', user=user, author=author, picture='pictures/albums/a.png')
+        images.mark_ready('pictures/albums/a.png')
+        album.refresh_from_db()
+        self.assertTrue(album.picture_derivatives_ready)
+
+        with mock.patch('library.blobs.ContentAddressedStorage.exists') as exists:
+            data = AlbumReadSerializer(album).data
+        exists.assert_not_called()
+        self.assertEqual(set(data['picture_derivatives']),
+                         {str(size) for size in images.derivative_settings()['SIZES']})
+
+
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def test_saving_an_unreferenced_blob_races_the_collector(self):
+        name = default_storage.save('song.mp3', ContentFile(b'audio'))
+        Blob.objects.filter(name=name).update(last_used_at=timezone.now() - timedelta(days=1))
+        touch_blob = blobs.touch_blob
+
+        def collected_first(*args):
+            # gc_blobs deletes the unreferenced blob right before the next save of the same content touches it
+            self.assertEqual(blobs.collect_garbage(timedelta(0)), 1)
+            touch_blob(*args)
+
+        with mock.patch.object(blobs, 'touch_blob', side_effect=collected_first):
+            self.assertEqual(default_storage.save('again.mp3', ContentFile(b'audio')), name)
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(blobs.collect_garbage(timedelta(hours=1)), 0)
+
+
+
+class ItemNeighboursTests(TestCase):
+    def setUp(self):
+        rnd = np.random.default_rng(0)
+        plays = np.column_stack([rnd.integers(0, 40, 600), rnd.integers(0, 90, 600), rnd.integers(1, 20, 600)])
+        likes = np.column_stack([rnd.integers(0, 40, 100), rnd.integers(0, 90, 100)])
+        self.matrix = recommendations.build_matrix(plays, likes, 2.0, 15)
+
+        # the dense user x song weights and their cosine similarities
+        n_users, n_items = len(self.matrix.indptr) - 1, len(self.matrix.song_ids)
+        dense = np.zeros((n_users, n_items))
+        dense[np.repeat(np.arange(n_users), np.diff(self.matrix.indptr)), self.matrix.items] = self.matrix.weights
+        norms = np.linalg.norm(dense, axis=0)
+        norms[norms == 0] = 1
+        self.similarities = dense.T @ dense / np.outer(norms, norms)
+        np.fill_diagonal(self.similarities, 0)
+
+    def test_matches_the_dense_similarities(self):
+        n_items, k = len(self.matrix.song_ids), 8
+        expected = -np.sort(-self.similarities, axis=1)[:, :k]
+        for block in (1, 7, n_items):
+            for max_pairs in (1, 13, 10 ** 6):
+                budget = recommendations.BYTES_PER_SCORE * n_items * block
+                seen = 0
+                for start, neighbours, scores in recommendations.item_neighbours(self.matrix, k, budget, max_pairs):
+                    for offset in range(len(neighbours)):
+                        song, similar = start + offset, scores[offset] > 0
+                        np.testing.assert_allclose(scores[offset][similar],
+                                                   self.similarities[song, neighbours[offset][similar]])
+                        np.testing.assert_allclose(scores[offset][similar], expected[song][expected[song] > 0])
+                    seen += len(neighbours)
+                self.assertEqual(seen, n_items, (block, max_pairs))
+
+
+def syncsafe(n):
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f])
+
+
+def id3_frame(frame_id, body, version=4, flags=0):
+    size = syncsafe(len(body)) if version == 4 else len(body).to_bytes(4, 'big')
+    return frame_id.encode() + size + flags.to_bytes(2, 'big') + body
+
+
+def id3_text(text, encoding=3):
+    return bytes([encoding]) + text.encode(('latin-1', 'utf-16', 'utf-16-be', 'utf-8')[encoding])
+
+
+def id3_picture(kind, mime, data):
+    return b'\x00' + mime.encode() + b'\x00' + bytes([kind]) + b'cover\x00' + data
+
+
+def id3_tag(frames, version=4, unsynchronise=False):
+    data = b''.join(frames)
+    if unsynchronise:
+        data = data.replace(b'\xff', b'\xff\x00')
+    return b'ID3' + bytes([version, 0, 0x80 if unsynchronise else 0]) + syncsafe(len(data)) + data
+
+
+# an MPEG frame header and some audio after the tag
+AUDIO = b'\xff\xfb\x90\x00' + bytes(400)
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\xff\xd9'
+PNG = b'\x89PNG\r\n\x1a\n\xff\x00'
+
+
+class ReadTagsTests(SimpleTestCase):
+    def read(self, data):
+        return read_tags(BytesIO(data), len(data))
+
+    def test_unsynchronised_tag(self):
+        frames = [id3_frame('TIT2', id3_text('\xffsong', 0), 3), id3_frame('TPE1', id3_text('artist', 0), 3),
+                  id3_frame('APIC', id3_picture(3, 'image/jpeg', JPEG), 3)]
+        tags = self.read(id3_tag(frames, version=3, unsynchronise=True) + AUDIO)
+        self.assertEqual((tags.title, tags.artists), ('\xffsong', ('artist',)))
+        self.assertEqual((tags.picture, tags.picture_extension), (JPEG, '.jpg'))
+
+        # ID3v2.4 flags the unsynchronised frames one by one
+        frame = id3_frame('APIC', id3_picture(3, 'image/jpeg', JPEG).replace(b'\xff', b'\xff\x00'), flags=0x0002)
+        self.assertEqual(self.read(id3_tag([frame]) + AUDIO).picture, JPEG)
+
+    def test_multiple_values_and_genre_references(self):
+        tags = self.read(id3_tag([
+            id3_frame('TIT2', id3_text('title')),
+            id3_frame('TPE1', id3_text('first\x00second\x00first')),
+            id3_frame('TCON', id3_text('17\x00Shoegaze\x00(8)')),
+        ]) + AUDIO)
+        self.assertEqual(tags.title, 'title')
+        self.assertEqual(tags.artists, ('first', 'second'))
+        self.assertEqual(tags.genres, ('Rock', 'Shoegaze', 'Jazz'))
+
+        for text, genres in (('(17)(8)', ('Rock', 'Jazz')), ('(17)Rocky', ('Rocky',)), ('(255)', ()),
+                             ('Jazz', ('Jazz',))):
+            tags = self.read(id3_tag([id3_frame('TCON', id3_text(text, 1), 3)], version=3) + AUDIO)
+            self.assertEqual(tags.genres, genres, text)
+
+    def test_front_cover_is_preferred(self):
+        pictures = [id3_frame('APIC', id3_picture(0, 'image/png', PNG)),
+                    id3_frame('APIC', id3_picture(3, 'image/bmp', b'BM')),
+                    id3_frame('APIC', id3_picture(3, 'image/jpeg', JPEG))]
+        tags = self.read(id3_tag(pictures) + AUDIO)
+        self.assertEqual((tags.picture, tags.picture_extension), (JPEG, '.jpg'))
+        # without a front cover, the first picture of a known format
+        tags = self.read(id3_tag(pictures[:2]) + AUDIO)
+        self.assertEqual((tags.picture, tags.picture_extension), (PNG, '.png'))
+
+    def test_truncated_file(self):
+        data = id3_tag([id3_frame('TIT2', id3_text('title')), id3_frame('TPE1', id3_text('artist')),
+                        id3_frame('APIC', id3_picture(3, 'image/jpeg', JPEG))]) + AUDIO
+        self.assertEqual(self.read(data).title, 'title')
+        for size in range(len(data) - len(AUDIO)):
+            file = BytesIO(data[:size])
+            tags = read_tags(file, size)
+            self.assertIsInstance(tags, Tags)
+            self.assertEqual(file.tell(), 0)
+            if tags.picture is not None:
+                self.assertTrue(JPEG.startswith(tags.picture), size)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(upload_dir.cleanup)
+        self.enterContext(override_settings(CHUNKED_UPLOAD={'DIR': upload_dir.name, 'MIN_CHUNK_SIZE': 1024}))
+        self.user = User.objects.create_user('uploader')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.content = random.Random(0).randbytes(2500)
+        response = self.client.post('/api/v1/library/upload/', {'filename': 'song.mp3', 'size': 2500,
+                                                                'chunk_size': 1024}, **self.headers)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.session = response.json()['id']
+
+    def put(self, index, data, sha256=None):
+        return self.client.put(f'/api/v1/library/upload/{self.session}/chunks/{index}/', data,
+                               content_type='application/octet-stream',
+                               HTTP_X_CHUNK_SHA256=sha256 or hashlib.sha256(data).hexdigest(), **self.headers)
+
+    def test_failed_retry_of_a_recorded_chunk_keeps_its_bytes(self):
+        for index in range(3):
+            response = self.put(index, self.content[index * 1024:(index + 1) * 1024])
+            self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['missing'], [])
+
+        chunk = self.content[1024:2048]
+        bad = bytes(1024)
+        for data, sha256 in ((bad, hashlib.sha256(chunk).hexdigest()), (bad[:100], None), (bad + b'x', None)):
+            self.assertEqual(self.put(1, data, sha256).status_code, 400)
+        with open(uploads.part_path(self.session), 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertEqual(self.client.get(f'/api/v1/library/upload/{self.session}/', **self.headers)
+                         .json()['missing'], [])
+
+
+class ImportLibraryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root, self.root = os.path.join(directory.name, 'media'), os.path.join(directory.name, 'import')
+        self.manifest = os.path.join(directory.name, 'manifest.jsonl')
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        self.enterContext(mock.patch.object(default_storage, 'location', self.media_root))
+        self.user = User.objects.create_user('importer')
+        os.makedirs(self.root)
+        for i in range(7):
+            frames = [id3_frame('TIT2', id3_text(f'track {i}')), id3_frame('TPE1', id3_text(f'artist {i % 2}')),
+                      id3_frame('TALB', id3_text(f'album {i % 2}'))]
+            if i % 3 == 0:
+                frames.append(id3_frame('APIC', id3_picture(3, 'image/png', PNG)))
+            with open(os.path.join(self.root, f'{i}.mp3'), 'wb') as file:
+                file.write(id3_tag(frames) + AUDIO + bytes([i]))
+
+    def test_batches_are_inserted_while_workers_read(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_library', self.root, user='importer', workers=2, batch_size=2,
+                     manifest=self.manifest, stdout=stdout, stderr=stderr)
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertIn('Imported 7 songs', stdout.getvalue())
+        self.assertIn(', 0 failed', stdout.getvalue())
+
+        songs = Song.objects.filter(user=self.user)
+        self.assertEqual(sorted(songs.values_list('title', flat=True)), [f'track {i}' for i in range(7)])
+        names = set(songs.values_list('audio', flat=True)) | {name for name in songs.values_list('picture', flat=True)
+                                                               if name.startswith(blobs.BLOB_PREFIX)}
+        self.assertEqual(len(names), 8)
+        for name in names:
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, name)), name)
+        references = Counter(songs.values_list('audio', flat=True))
+        references.update(songs.values_list('picture', flat=True))
+        references.update(Album.objects.filter(user=self.user).values_list('picture', flat=True))
+        self.assertEqual(dict(Blob.objects.filter(name__in=names).values_list('name', 'refcount')),
+                         {name: references[name] for name in names})
+        self.assertEqual(os.listdir(os.path.join(self.media_root, blobs.BLOB_PREFIX + 'tmp')), [])
+
+    def test_workers_do_not_write_to_the_database(self):
+        # a batch being inserted holds the SQLite write lock
+        with self.assertNumQueries(0):
+            imported = read_file(self.root, '0.mp3', self.media_root, False)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, imported.audio)))
+        place_files([imported], self.media_root, False)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, imported.audio)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, imported.picture)))
+        self.assertEqual(Blob.objects.filter(name__in=[imported.audio, imported.picture]).count(), 2)
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_parse(self):
+        for header, size, expected in (
+                (None, 100, None), ('', 100, None), ('items=0-1', 100, None), ('bytes=', 100, None),
+                ('bytes=5-1', 100, None), ('bytes=a-b', 100, None), ('bytes=-', 100, None),
+                ('bytes=0-0', 100, [(0, 0)]), ('bytes=10-', 100, [(10, 99)]), ('bytes=90-200', 100, [(90, 99)]),
+                ('bytes=-10', 100, [(90, 99)]), ('bytes=-200', 100, [(0, 99)]),
+                ('bytes=0-4, 20-29,5-9', 100, [(0, 9), (20, 29)]), ('bytes=0-50,40-60', 100, [(0, 60)]),
+                ('bytes=100-', 100, []), ('bytes=-0', 100, []), ('bytes=100-,200-300', 100, []),
+                ('bytes=0-', 0, []), ('bytes=-5', 0, []),
+                ('bytes=' + ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1)), 1000, None)):
+            self.assertEqual(parse_range_header(header, size), expected, (header, size))
+
+
+class SongStreamTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.user = User.objects.create_user('listener')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        author = Author.objects.create(title='author', user=self.user)
+        self.album = Album.objects.create(title='album', user=self.user, author=author)
+        self.content = bytes(range(256)) * 4
+        self.song = self.create_song(self.content)
+
+    def create_song(self, content):
+        audio = default_storage.save('song.mp3', ContentFile(content))
+        return Song.objects.create(title='song', audio=audio, user=self.user, album=self.album)
+
+    def stream(self, song=None, **headers):
+        return self.client.get(f'/api/v1/library/song/{(song or self.song).id}/stream/', **self.headers, **headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.stream()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.stream(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_single_ranges(self):
+        for header, start, end in (('bytes=10-19', 10, 19), ('bytes=1000-', 1000, 1023), ('bytes=-24', 1000, 1023),
+                                   ('bytes=0-5000', 0, 1023)):
+            response = self.stream(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/1024')
+            self.assertEqual(int(response['Content-Length']), end - start + 1)
+            self.assertEqual(self.body(response), self.content[start:end + 1])
+
+    def test_unsatisfiable_ranges(self):
+        response = self.stream(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+        empty = self.create_song(b'')
+        for header in ('bytes=-5', 'bytes=0-'):
+            response = self.stream(empty, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_if_range(self):
+        etag = self.stream()['ETag']
+        self.assertEqual(self.stream(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        for validator in ('"stale"', 'W/' + etag, 'Wed, 21 Oct 2015 07:28:00 GMT'):
+            response = self.stream(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(self.body(response), self.content)
+
+    def test_multiple_ranges(self):
+        response = self.stream(HTTP_RANGE='bytes=0-9,100-149,-10')
+        self.assertEqual(response.status_code, 206)
+        content_type, boundary = response['Content-Type'].split('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        for part, (start, end) in zip(parts[1:-1], ((0, 9), (100, 149), (1014, 1023))):
+            head, _, data = part.partition(b'\r\n\r\n')
+            self.assertIn(f'Content-Range: bytes {start}-{end}/1024'.encode(), head)
+            self.assertEqual(data, self.content[start:end + 1] + b'\r\n')
+
+
+class PlayCounterBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('player')
+        author = Author.objects.create(title='author', user=self.user)
+        album = Album.objects.create(title='album', user=self.user, author=author)
+        self.songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=album)
+                      for i in range(2)]
+        # flushes run in the test's thread, the background one only where stated
+        self.enterContext(mock.patch.object(plays.PlayCounterBuffer, '_start'))
+
+    def counts(self):
+        return dict(UserSongPlay.objects.filter(user=self.user).values_list('song_id', 'count'))
+
+    def test_flushed_at_threshold(self):
+        buffer = plays.PlayCounterBuffer(3, 3600)
+        now = timezone.now()
+        buffer.record(self.songs[0].id, self.user.id, now)
+        buffer.record(self.songs[1].id, self.user.id, now)
+        self.assertEqual((len(buffer), self.counts()), (2, {}))
+        buffer.record(self.songs[0].id, self.user.id, now)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.counts(), {self.songs[0].id: 2, self.songs[1].id: 1})
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 3)
+
+    def test_flushed_every_interval(self):
+        flushed = []
+        buffer = plays.PlayCounterBuffer(100, 0.01)
+        with mock.patch.object(plays, 'apply_plays', side_effect=flushed.append), \
+                mock.patch.object(plays.connections, 'close_all'):
+            buffer._thread = threading.Thread(target=buffer._run)
+            buffer._thread.start()
+            buffer.record(self.songs[0].id, self.user.id, timezone.now())
+            deadline = time.monotonic() + 5
+            while not flushed and time.monotonic() < deadline:
+                time.sleep(0.01)
+            buffer.shutdown()
+        self.assertEqual([len(batch) for batch in flushed], [1])
+
+    def test_failed_flush_keeps_the_plays(self):
+        buffer = plays.PlayCounterBuffer(100, 3600)
+        now = timezone.now()
+        buffer.record(self.songs[0].id, self.user.id, now)
+        with mock.patch.object(plays, 'apply_plays', side_effect=OSError):
+            with self.assertRaises(OSError):
+                buffer.flush()
+        self.assertEqual(len(buffer), 1)
+        buffer.record(self.songs[1].id, self.user.id, now)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.counts(), {self.songs[0].id: 1, self.songs[1].id: 1})
+
+    def test_buffered_plays_are_accepted(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        buffer = plays.PlayCounterBuffer(100, 3600)
+        with mock.patch.object(plays, '_buffer', buffer):
+            response = self.client.post('/api/v1/library/play/', {'song': self.songs[0].id}, **headers)
+            self.assertEqual(response.status_code, 202, response.content)
+            self.assertEqual(response.json(), {'song': self.songs[0].id, 'user': self.user.id})
+            self.assertEqual(self.counts(), {})
+            buffer.flush()
+        self.assertEqual(self.counts(), {self.songs[0].id: 1})
+
+        with override_settings(PLAY_COUNTER={'BUFFERED': False}):
+            response = self.client.post('/api/v1/library/play/', {'song': self.songs[0].id}, **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['count'], 2)
+
+
+class IncrementCountersTests(TestCase):
+    def check(self, increment):
+        Blob.objects.create(name='existing', refcount=5)
+        increments = {('existing',): 2, ('new',): 3, ('negative',): -1}
+        # more rows than fit in one statement
+        increments.update({(f'blob {i}',): 1 for i in range(700)})
+        increment(Blob, ('name',), increments, count_field='refcount')
+        increment(Blob, ('name',), {('existing',): -4, ('new',): 1}, count_field='refcount')
+        refcounts = dict(Blob.objects.values_list('name', 'refcount'))
+        self.assertEqual([refcounts.pop(name) for name in ('existing', 'new', 'negative')], [3, 4, -1])
+        self.assertEqual(refcounts, {f'blob {i}': 1 for i in range(700)})
+
+        user = User.objects.create_user('counter')
+        author = Author.objects.create(title='author', user=user)
+        album = Album.objects.create(title='album', user=user, author=author)
+        songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=user, album=album)
+                 for i in range(3)]
+        UserSongPlay.objects.create(user=user, song=songs[0], count=1)
+        increment(UserSongPlay, ('user_id', 'song_id'), {(user.id, song.id): 2 for song in songs})
+        self.assertEqual(dict(UserSongPlay.objects.values_list('song_id', 'count')),
+                         {songs[0].id: 3, songs[1].id: 2, songs[2].id: 2})
+
+    def test_upsert(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.check(increment_counters)
+        self.assertTrue(any('ON CONFLICT' in query['sql'] and 'DO UPDATE' in query['sql']
+                            for query in queries.captured_queries))
+
+    def test_updates_fallback(self):
+        self.check(lambda *args, **kwargs: _increment_counters_with_updates(
+            *args, **{'count_field': 'count', 'batch_size': 500, **kwargs}))
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('searcher')
+        self.author = Author.objects.create(title='Miles', user=self.user)
+        self.album = Album.objects.create(title='Kind', user=self.user, author=self.author)
+        self.genre = Genre.objects.create(title='Jazz')
+        self.song = Song.objects.create(title='So What', audio='tracks/song.mp3', user=self.user, album=self.album)
+
+    def documents(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid, title, authors, album, genres FROM {search.SEARCH_TABLE} ORDER BY rowid')
+            return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    def assertIndexed(self, *documents):
+        self.assertEqual(self.documents(), {self.song.id: document for document in documents})
+
+    def test_song_save_and_delete(self):
+        self.assertIndexed(('So What', '', 'Kind', ''))
+        self.song.title = 'Blue'
+        self.song.save()
+        self.assertIndexed(('Blue', '', 'Kind', ''))
+        self.assertEqual(search.search_song_ids('blu', 10), [self.song.id])
+        self.song.delete()
+        self.assertEqual(self.documents(), {})
+
+    def test_relation_changes(self):
+        coltrane = Author.objects.create(title='Coltrane', user=self.user)
+        self.song.authors.add(self.author, coltrane)
+        self.song.genres.add(self.genre)
+        self.assertIndexed(('So What', 'Miles Coltrane', 'Kind', 'Jazz'))
+        self.song.authors.remove(coltrane)
+        self.assertIndexed(('So What', 'Miles', 'Kind', 'Jazz'))
+        self.song.genres.clear()
+        self.assertIndexed(('So What', 'Miles', 'Kind', ''))
+
+        # from the other side of the relation
+        coltrane.songs.add(self.song)
+        self.genre.songs.add(self.song)
+        self.assertIndexed(('So What', 'Miles Coltrane', 'Kind', 'Jazz'))
+        coltrane.songs.remove(self.song)
+        self.genre.songs.clear()
+        self.assertIndexed(('So What', 'Miles', 'Kind', ''))
+
+    def test_renames(self):
+        self.song.authors.add(self.author)
+        self.song.genres.add(self.genre)
+        self.author.title = 'Davis'
+        self.author.save()
+        self.album.title = 'Blue'
+        self.album.save()
+        self.genre.title = 'Modal'
+        self.genre.save()
+        self.assertIndexed(('So What', 'Davis', 'Blue', 'Modal'))
+        self.assertEqual(search.search_song_ids('modal davis', 10), [self.song.id])
+
+    def test_deletes(self):
+        coltrane = Author.objects.create(title='Coltrane', user=self.user)
+        self.song.authors.add(self.author, coltrane)
+        self.song.genres.add(self.genre)
+        self.genre.delete()
+        coltrane.delete()
+        self.assertIndexed(('So What', 'Miles', 'Kind', ''))
+        self.assertEqual(search.search_song_ids('coltrane', 10), [])
+        self.album.delete()
+        self.assertEqual(self.documents(), {})
+
+    def test_icontains_fallback(self):
+        other = Song.objects.create(title='Freddie', audio='tracks/song.mp3', user=self.user, album=self.album)
+        self.song.authors.add(self.author)
+        self.song.genres.add(self.genre)
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            self.song.title = 'Blue in Green'
+            self.song.save()
+            self.assertEqual(search.search_song_ids('GREEN miles', 10), [self.song.id])
+            self.assertEqual(search.search_song_ids('jazz', 10), [self.song.id])
+            self.assertEqual(search.search_song_ids('kind', 10), [self.song.id, other.id])
+            self.assertEqual(search.search_song_ids('kind', 1, 1), [other.id])
+            self.assertEqual(search.search_song_ids('   ', 10), [])
+        # nothing was written to the index meanwhile
+        self.assertEqual(self.documents()[self.song.id][0], 'So What')
+
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            response = self.client.get('/api/v1/library/song/search', {'q': 'green'}, **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([song['id'] for song in response.json()['results']], [self.song.id])
+
+
+def mp3_frames(count, header=b'\xff\xfb\x90\x00', length=417, first=b''):
+    # MPEG-1 layer III, 128 kbit/s, 44.1 kHz, stereo: 417 byte frames without padding
+    frame = header + bytes(length - 4)
+    return header + first + bytes(length - 4 - len(first)) + frame * (count - 1)
+
+
+def flac_stream(samples, sample_rate=44100, channels=2, audio=4000):
+    value = (sample_rate << 44) | ((channels - 1) << 41) | (15 << 36) | samples
+    streaminfo = bytes(10) + value.to_bytes(8, 'big') + bytes(16)
+    return b'fLaC' + b'\x80' + len(streaminfo).to_bytes(3, 'big') + streaminfo + bytes(audio)
+
+
+def wav_file(data_size, sample_rate=8000, channels=2, declared=None, extra=b''):
+    fmt = (1).to_bytes(2, 'little') + channels.to_bytes(2, 'little') + sample_rate.to_bytes(4, 'little') \
+        + (sample_rate * channels * 2).to_bytes(4, 'little') + (channels * 2).to_bytes(2, 'little') \
+        + (16).to_bytes(2, 'little')
+    chunks = b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt + extra \
+        + b'data' + (data_size if declared is None else declared).to_bytes(4, 'little') + bytes(data_size)
+    return b'RIFF' + (len(chunks) + 4).to_bytes(4, 'little') + b'WAVE' + chunks
+
+
+class AudioProbeTests(SimpleTestCase):
+    def probe(self, data):
+        # fed in small uneven chunks, the way uploads arrive, and read from a file: both agree
+        probe = AudioProbe()
+        for i in range(0, len(data), 7):
+            probe.feed(data[i:i + 7])
+        fed = probe.result(len(data))
+        self.assertEqual(probe_file(ContentFile(data)), fed)
+        return fed
+
+    def test_constant_bitrate_mp3(self):
+        data = mp3_frames(100)
+        self.assertEqual(self.probe(data), AudioInfo(duration=100 * 417 * 8 / 128000, bitrate=128000,
+                                                     sample_rate=44100, channels=2))
+        # the tag is not counted in the duration
+        tagged = id3_tag([id3_frame('TIT2', id3_text('title'))]) + data
+        self.assertEqual(self.probe(tagged).duration, 100 * 417 * 8 / 128000)
+
+    def test_mp3_after_junk(self):
+        # a lone byte pair looking like a frame header is not taken for the stream
+        data = b'\x00\xff\xfb\x90\x00\x12' + mp3_frames(10)
+        info = self.probe(data)
+        self.assertEqual((info.bitrate, info.sample_rate), (128000, 44100))
+        self.assertAlmostEqual(info.duration, 10 * 417 * 8 / 128000)
+
+    def test_xing_mp3(self):
+        xing = b'Xing' + (1).to_bytes(4, 'big') + (1000).to_bytes(4, 'big')
+        # the Xing tag follows the 32 byte side info of a stereo MPEG-1 frame
+        data = mp3_frames(20, first=bytes(32) + xing)
+        info = self.probe(data)
+        self.assertEqual(info.duration, 1000 * 1152 / 44100)
+        self.assertEqual(info.bitrate, round(len(data) * 8 / info.duration))
+
+    def test_vbri_mp3(self):
+        vbri = b'VBRI' + bytes(10) + (500).to_bytes(4, 'big')
+        # mono, the Xing position would be after 17 bytes of side info, VBRI is always after 32
+        data = mp3_frames(20, header=b'\xff\xfb\x90\xc0', first=bytes(32) + vbri)
+        info = self.probe(data)
+        self.assertEqual((info.duration, info.channels), (500 * 1152 / 44100, 1))
+
+    def test_flac(self):
+        data = flac_stream(441000)
+        info = self.probe(data)
+        self.assertEqual(info, AudioInfo(duration=10.0, bitrate=round(len(data) * 8 / 10), sample_rate=44100,
+                                         channels=2))
+        self.assertEqual(self.probe(id3_tag([]) + data).duration, 10.0)
+
+    def test_wav(self):
+        data = wav_file(64000)
+        self.assertEqual(self.probe(data), AudioInfo(duration=2.0, bitrate=256000, sample_rate=8000, channels=2))
+        # odd sized chunks before the data are padded
+        extra = b'LIST' + (3).to_bytes(4, 'little') + b'abc\x00'
+        self.assertEqual(self.probe(wav_file(64000, extra=extra)).duration, 2.0)
+
+    def test_streamed_wav(self):
+        # the data size left unset, the rest of the file is the audio
+        for declared in (0, 0xffffffff):
+            with self.subTest(declared=declared):
+                info = self.probe(wav_file(32000, channels=1, declared=declared))
+                self.assertEqual((info.duration, info.bitrate, info.channels), (2.0, 128000, 1))
+
+    def test_unknown_and_truncated(self):
+        self.assertEqual(self.probe(bytes(5000)), AudioInfo())
+        self.assertEqual(self.probe(b'fLaC\x00'), AudioInfo())
+        info = self.probe(flac_stream(441000)[:30])
+        self.assertEqual((info.duration, info.sample_rate), (None, None))
+
+
+def pcm_wav(samples, sample_rate=8000, width=2, tag=1):
+    """
+    A WAV file of the (frames, channels) array, already in the sample format of the given width.
+    """
+    channels = samples.shape[1]
+    if width == 3:
+        data = samples.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    else:
+        data = samples.tobytes()
+    fmt = tag.to_bytes(2, 'little') + channels.to_bytes(2, 'little') + sample_rate.to_bytes(4, 'little') \
+        + (sample_rate * channels * width).to_bytes(4, 'little') + (channels * width).to_bytes(2, 'little') \
+        + (width * 8).to_bytes(2, 'little')
+    chunks = b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt + b'data' + len(data).to_bytes(4, 'little') + data
+    return b'RIFF' + (len(chunks) + 4).to_bytes(4, 'little') + b'WAVE' + chunks
+
+
+class WaveformTests(SimpleTestCase):
+    def decode(self, data):
+        frame_count, blocks = waveforms.decode_wav(ContentFile(data))
+        return frame_count, np.concatenate(list(blocks))
+
+    def test_sample_formats(self):
+        pcm16 = np.array([[0, -32768], [16384, 32767]], dtype='<i2')
+        self.assertEqual(self.decode(pcm_wav(pcm16))[1].tolist(), [[0, -1], [0.5, 32767 / 32768]])
+        pcm8 = np.array([[128], [0], [192]], dtype=np.uint8)
+        self.assertEqual(self.decode(pcm_wav(pcm8, width=1))[1].tolist(), [[0], [-1], [0.5]])
+        pcm24 = np.array([[-(1 << 23)], [1 << 22], [-1]])
+        self.assertEqual(self.decode(pcm_wav(pcm24, width=3))[1].tolist(), [[-1], [0.5], [-1 / (1 << 23)]])
+        floats = np.array([[0.25, -0.75]], dtype='<f4')
+        frame_count, decoded = self.decode(pcm_wav(floats, width=4, tag=3))
+        self.assertEqual((frame_count, decoded.tolist()), (1, [[0.25, -0.75]]))
+
+        with self.assertRaises(waveforms.UnsupportedAudio):
+            self.decode(pcm_wav(pcm16, tag=2))
+        with self.assertRaises(waveforms.UnsupportedAudio):
+            self.decode(b'RIFF\x00\x00\x00\x00WAVE')
+
+    def test_peaks(self):
+        # a rising sawtooth on the left, its negation on the right, crossing several decode blocks
+        frames = 3 * waveforms.DECODE_BLOCK_FRAMES + 1234
+        left = (np.arange(frames) % 1000 - 500) * 60
+        samples = np.stack([left, -left], axis=1).astype('<i2')
+        data = pcm_wav(samples)
+
+        frame_count, blocks = waveforms.decode_wav(ContentFile(data))
+        mins, maxs = waveforms.compute_peaks(frame_count, blocks)
+        self.assertEqual(len(mins), waveforms.PEAK_LEVELS[0])
+        # the reference: every frame's bucket, all channels together
+        audio = samples.astype(np.float32) / 32768
+        buckets = np.arange(frames) * len(mins) // frames
+        bounds = np.flatnonzero(np.diff(buckets)) + 1
+        np.testing.assert_array_equal(mins, np.minimum.reduceat(audio.min(axis=1), np.concatenate(([0], bounds))))
+        np.testing.assert_array_equal(maxs, np.maximum.reduceat(audio.max(axis=1), np.concatenate(([0], bounds))))
+
+        levels, peaks = waveforms.build_waveform(ContentFile(data))
+        self.assertEqual(levels, list(waveforms.PEAK_LEVELS))
+        self.assertEqual(len(peaks), sum(levels) * 2)
+        peaks = np.frombuffer(peaks, dtype=np.int8)
+        self.assertTrue((peaks[0::2] <= peaks[1::2]).all())
+        bound = round(500 * 60 / 32768 * 127)
+        self.assertEqual((peaks.min(), peaks.max()), (-bound, bound))
+
+    def test_short_audio(self):
+        samples = np.array([[1000], [-2000], [3000]], dtype='<i2')
+        levels, peaks = waveforms.build_waveform(ContentFile(pcm_wav(samples)))
+        self.assertEqual(levels, [3, 3, 3])
+        self.assertEqual(np.frombuffer(peaks[:6], dtype=np.int8).tolist(), [4, 4, -8, -8, 12, 12])
+        with self.assertRaises(waveforms.UnsupportedAudio):
+            waveforms.build_waveform(ContentFile(b'fLaC' + bytes(100)))
+
+
+class SongWaveformViewTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.user = User.objects.create_user('viewer')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        author = Author.objects.create(title='author', user=self.user)
+        self.album = Album.objects.create(title='album', user=self.user, author=author)
+        samples = (np.sin(np.arange(20000) / 10) * 16000).astype('<i2').reshape(-1, 1)
+        audio = default_storage.save('song.wav', ContentFile(pcm_wav(samples)))
+        self.song = Song.objects.create(title='song', audio=audio, user=self.user, album=self.album)
+
+    def get(self, song=None, **params):
+        return self.client.get(f'/api/v1/library/song/{(song or self.song).id}/waveform/', params, **self.headers)
+
+    def test_levels(self):
+        self.assertEqual(self.get().status_code, 404)
+        waveform = waveforms.compute_waveform(self.song)
+        self.assertEqual(waveform.source, self.song.audio.name)
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response['X-Waveform-Peaks'], len(response.content)), ('2048', 4096))
+        self.assertEqual(response.content, bytes(waveform.peaks[:4096]))
+        for count, level in ((100, 128), (128, 128), (129, 512), (5000, 2048)):
+            response = self.get(peaks=count)
+            self.assertEqual(response['X-Waveform-Peaks'], str(level), count)
+            self.assertEqual(len(response.content), level * 2)
+        self.assertEqual(self.get(peaks='many').status_code, 400)
+
+    def test_conditional_get(self):
+        waveforms.compute_waveform(self.song)
+        etag = self.get(peaks=128)['ETag']
+        url = f'/api/v1/library/song/{self.song.id}/waveform/'
+        self.assertEqual(self.client.get(url, {'peaks': 100}, HTTP_IF_NONE_MATCH=etag, **self.headers).status_code, 304)
+        # another level, or the waveform computed again
+        self.assertEqual(self.client.get(url, {'peaks': 512}, HTTP_IF_NONE_MATCH=etag, **self.headers).status_code, 200)
+        waveforms.compute_waveform(self.song)
+        self.assertEqual(self.client.get(url, {'peaks': 128}, HTTP_IF_NONE_MATCH=etag, **self.headers).status_code, 200)
+
+    def test_unsupported_audio(self):
+        SongWaveform.objects.create(song=self.song, source='song.mp3', levels=[], peaks=b'',
+                                    computed_at=timezone.now())
+        response = self.get()
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('not available', response.json()['waveform'])
+
+
+class LocalLRUBackendTests(SimpleTestCase):
+    def test_entries(self):
+        backend = LocalLRUBackend(max_bytes=10, timeout=None)
+        self.assertIsNone(backend.get('a'))
+        backend.set('a', b'aaaa')
+        backend.set('b', b'bbbb')
+        self.assertEqual(backend.get('a'), b'aaaa')
+        # b is the least recently used
+        backend.set('c', b'cccc')
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), (b'aaaa', None, b'cccc'))
+        self.assertEqual(backend.size, 8)
+        backend.set('a', b'a')
+        self.assertEqual(backend.size, 5)
+        backend.set('d', bytes(11))
+        self.assertIsNone(backend.get('d'))
+
+    def test_timeout(self):
+        backend = LocalLRUBackend(timeout=60)
+        with mock.patch.object(cache.time, 'monotonic', return_value=1000):
+            backend.set('a', b'aaaa')
+        with mock.patch.object(cache.time, 'monotonic', return_value=1059):
+            self.assertEqual(backend.get('a'), b'aaaa')
+        with mock.patch.object(cache.time, 'monotonic', return_value=1061):
+            self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.size, 0)
+
+    def test_versions_are_bounded(self):
+        backend = LocalLRUBackend(max_versions=2)
+        a, b = backend.get_version('a'), backend.get_version('b')
+        backend.bump_version('a')
+        self.assertEqual(backend.get_version('a'), a + 1)
+        self.assertEqual(backend.get_version('b'), b)
+        # a is the least recently used
+        backend.bump_version('c')
+        self.assertEqual(len(backend._versions), 2)
+        self.assertEqual(list(backend._versions), ['b', 'c'])
+        for _ in range(1000):
+            backend.get_version(f'key {_}')
+        self.assertEqual(len(backend._versions), 2)
+        # a version that was dropped comes back above every value it had
+        self.assertGreater(backend.get_version('a'), a + 1)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.backend = LocalLRUBackend()
+        self.enterContext(mock.patch.object(cache, '_cache', cache.ResponseCache(self.backend)))
+        self.user = User.objects.create_user('cached')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        author = Author.objects.create(title='author', user=self.user)
+        album = Album.objects.create(title='album', user=self.user, author=author)
+        self.songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=album)
+                      for i in range(2)]
+        # a response is only kept once the pictures' derivatives are there
+        Song.objects.update(picture_derivatives_ready=True)
+
+    def get(self, song):
+        return self.client.get(f'/api/v1/library/song/{song.id}/', **self.headers)
+
+    def test_hit_and_miss(self):
+        first = self.get(self.songs[0])
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.get(self.songs[0])
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.get(self.songs[1])['X-Cache'], 'MISS')
+        self.assertEqual(cache.get_response_cache().stats()[cache.SONG],
+                         {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333})
+
+    def test_bumped_after_commit(self):
+        self.get(self.songs[0])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.songs[0].title = 'renamed'
+            self.songs[0].save()
+            Song.objects.update(picture_derivatives_ready=True)
+            # until the change commits, readers keep the old version
+            self.assertEqual(self.get(self.songs[0])['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+        response = self.get(self.songs[0])
+        self.assertEqual((response['X-Cache'], response.json()['title']), ('MISS', 'renamed'))
+        self.assertEqual(self.get(self.songs[0])['X-Cache'], 'HIT')
+        # the other song was not touched
+        self.get(self.songs[1])
+        self.assertEqual(self.get(self.songs[1])['X-Cache'], 'HIT')
+
+    def test_eviction(self):
+        size = len(self.get(self.songs[0]).content)
+        self.backend.max_bytes = size + size // 2
+        self.get(self.songs[1])
+        self.assertEqual(self.get(self.songs[0])['X-Cache'], 'MISS')
+        self.assertEqual(self.get(self.songs[0])['X-Cache'], 'HIT')
+        self.assertEqual(self.get(self.songs[1])['X-Cache'], 'MISS')
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('async')
+        self.headers = {'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        author = Author.objects.create(title='author', user=self.user, picture='')
+        self.album = Album.objects.create(title='album', user=self.user, author=author, picture='')
+        songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=self.album,
+                                     picture='') for i in range(3)]
+        for song in songs:
+            song.authors.add(author)
+        self.songs = songs
+        self.song = songs[0]
+        self.playlist = Playlist.objects.create(title='playlist', user=self.user, picture='')
+        SongPlaylist.objects.bulk_create([SongPlaylist(playlist=self.playlist, song=song, position=position)
+                                          for song, position in zip(songs, spread_keys(len(songs)))])
+        collection, _ = Collection.objects.get_or_create(user=self.user, defaults={'picture': ''})
+        SongCollection.objects.create(collection=collection, song=songs[1])
+
+    def responses(self, view, url, **params):
+        """
+        The response of the sync view, then of the async one through the ASGI handler; the sync get must not
+        run then.
+        """
+        with mock.patch.object(cache, '_cache', None):
+            sync = self.client.get(url, params, headers=self.headers)
+        with benchmark_asgi.Command().views(True), mock.patch.object(cache, '_cache', None), \
+                mock.patch.object(view, 'get', side_effect=AssertionError('the sync handler ran')):
+            self.assertTrue(view.view_is_async)
+            async_response = async_to_sync(self.async_client.get)(url, params, headers=self.headers)
+        self.assertFalse(view.view_is_async)
+        return sync, async_response
+
+    def assertSameResponses(self, view, url, **params):
+        sync, async_response = self.responses(view, url, **params)
+        self.assertEqual(sync.status_code, async_response.status_code)
+        self.assertEqual(sync.json(), async_response.json())
+        self.assertEqual(sync.get('ETag'), async_response.get('ETag'))
+        return sync
+
+    def test_short_song_view(self):
+        response = self.assertSameResponses(ShortSongView, '/api/v1/library/song/short', album_id=self.album.id)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertSameResponses(ShortSongView, '/api/v1/library/song/short', song_id=self.song.id)
+        self.assertEqual(self.assertSameResponses(ShortSongView, '/api/v1/library/song/short',
+                                                  song_id=0).status_code, 404)
+
+    def test_song_view(self):
+        response = self.assertSameResponses(SongView, f'/api/v1/library/song/{self.song.id}/')
+        self.assertEqual(response.json()['title'], 'song 0')
+        self.assertEqual(self.assertSameResponses(SongView, '/api/v1/library/song/0/').status_code, 404)
+
+    def test_playlist_view(self):
+        response = self.assertSameResponses(PlaylistView, f'/api/v1/playlist/{self.playlist.id}/')
+        self.assertEqual(len(response.json()['songs']), 3)
+        self.assertEqual(self.assertSameResponses(PlaylistView, '/api/v1/playlist/0/').status_code, 404)
+
+    def test_collection_view(self):
+        response = self.assertSameResponses(CollectionView, '/api/v1/playlist/liked/')
+        self.assertEqual([song['id'] for song in response.json()['songs']], [self.songs[1].id])
+
+
+class ExportCatalogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.user = User.objects.create_user('exporter')
+        self.genre = Genre.objects.create(title='Jazz')
+        author = Author.objects.create(title='author', user=self.user, picture='')
+        album = Album.objects.create(title='album', user=self.user, author=author, picture='')
+        self.songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=album,
+                                          picture='') for i in range(5)]
+        for song in self.songs:
+            song.authors.add(author)
+        self.songs[0].genres.add(self.genre)
+        self.playlist = Playlist.objects.create(title='playlist', user=self.user, picture='')
+        SongPlaylist.objects.bulk_create([SongPlaylist(playlist=self.playlist, song=song, position=position)
+                                          for song, position in zip(self.songs[:3], spread_keys(3))])
+        self.plays = [PlayEvent.objects.create(song=song, user=self.user, played_at=timezone.now())
+                      for song in self.songs[:2]]
+
+    def export(self, *args):
+        output = os.path.join(self.directory, 'export.ndjson')
+        call_command('export_catalog', '--output', output, '--state', os.path.join(self.directory, 'state.json'),
+                     '--chunk-size', '2', *args, stderr=StringIO())
+        return output
+
+    @staticmethod
+    def records(lines):
+        records = [json.loads(line) for line in lines]
+        return {kind: [record for record in records if record['type'] == kind]
+                for kind in dict.fromkeys(record['type'] for record in records)}
+
+    def test_ndjson(self):
+        with open(self.export(), encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        records = self.records(lines)
+        self.assertEqual(list(records), ['genre', 'author', 'album', 'song', 'play', 'playlist', 'watermark'])
+        self.assertEqual([song['id'] for song in records['song']], [song.id for song in self.songs])
+        song = records['song'][0]
+        self.assertEqual((song['title'], song['album']['title'], song['authors'][0]['title'], song['genres']),
+                         ('song 0', 'album', 'author', [{'id': self.genre.id, 'title': 'Jazz'}]))
+        self.assertEqual(records['playlist'][0]['songs'], [song.id for song in self.songs[:3]])
+        self.assertEqual([play['id'] for play in records['play']], [play.id for play in self.plays])
+        self.assertEqual(records['watermark'][0]['after_play_id'], self.plays[-1].id)
+        self.assertEqual(lines[-1], json.dumps(records['watermark'][0], separators=(',', ':')))
+
+    def test_gzip(self):
+        with mock.patch.object(exports, 'WRITE_SIZE', 200):
+            with open(self.export(), 'rb') as file:
+                plain = file.read()
+            os.remove(os.path.join(self.directory, 'state.json'))
+            with gzip.open(self.export('--gzip'), 'rb') as file:
+                unpacked = file.read()
+        # the same records but the watermark, stamped with the time of each export
+        self.assertEqual(plain.splitlines()[:-1], unpacked.splitlines()[:-1])
+        # several blocks, one gzip member
+        self.assertGreater(len(plain), 1000)
+
+    def test_incremental(self):
+        self.export()
+        # the rows of the first export were written a while ago
+        hour_ago = timezone.now() - timedelta(hours=1)
+        for model in (Author, Album, Song, Playlist):
+            model.objects.update(updated_at=hour_ago)
+        with open(self.export(), encoding='utf-8') as file:
+            records = self.records(file)
+        self.assertEqual(list(records), ['genre', 'watermark'])
+
+        self.songs[3].title = 'renamed'
+        self.songs[3].save()
+        play = PlayEvent.objects.create(song=self.songs[4], user=self.user, played_at=timezone.now())
+        with open(self.export(), encoding='utf-8') as file:
+            records = self.records(file)
+        self.assertEqual([song['title'] for song in records['song']], ['renamed'])
+        self.assertEqual([record['id'] for record in records['play']], [play.id])
+        self.assertNotIn('author', records)
+        self.assertNotIn('album', records)
+        # the renamed song is not in the playlist
+        self.assertNotIn('playlist', records)
+
+        self.songs[0].title = 'in the playlist'
+        self.songs[0].save()
+        with open(self.export(), encoding='utf-8') as file:
+            records = self.records(file)
+        self.assertEqual([song['id'] for song in records['song']], [self.songs[0].id, self.songs[3].id])
+        self.assertEqual([playlist['id'] for playlist in records['playlist']], [self.playlist.id])
+        self.assertNotIn('play', records)
+
+
+def request_record(**fields):
+    defaults = {'method': 'GET', 'route': 'song', 'status': 200, 'started_at': 0.0, 'duration': 0.1,
+                'queries': 1, 'sql_time': 0.01, 'duplicates': (), 'serialization_time': 0.0, 'response_size': 10}
+    return instrumentation.RequestRecord(**{**defaults, **fields})
+
+
+class RequestLogTests(SimpleTestCase):
+    def test_bounded(self):
+        log = instrumentation.RequestLog(3, 2)
+        for i in range(5):
+            log.add(request_record(route=f'route {i % 2}', duration=i, queries=i), slow=i >= 1)
+        self.assertEqual(len(log), 3)
+        # the last three: 2, 3 and 4
+        routes = {route['route']: route for route in log.routes()}
+        self.assertEqual((routes['route 0']['requests'], routes['route 0']['total_time']), (2, 6))
+        self.assertEqual((routes['route 1']['requests'], routes['route 1']['max_queries']), (1, 3))
+        self.assertEqual([route['route'] for route in log.routes('max_time', limit=1)], ['route 0'])
+        # the last two slow ones, latest first
+        self.assertEqual([record['duration'] for record in log.slow()], [4, 3])
+        self.assertEqual(len(log.slow(limit=1)), 1)
+
+    def test_duplicates(self):
+        profile = instrumentation.RequestProfile()
+        profile.statements.update({'SELECT 1 WHERE id IN (%s)': 2, 'SELECT 1 WHERE id IN (%s, %s)': 1,
+                                   'SELECT 2': 1})
+        self.assertEqual(profile.duplicates(), (('SELECT 1 WHERE id IN (%s, ...)', 3),))
+
+
+class RequestProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        # a fresh log, the middleware is loaded by the first request of the test client
+        self.enterContext(mock.patch.object(instrumentation, '_log', None))
+        self.user = User.objects.create_user('profiled')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        author = Author.objects.create(title='author', user=self.user, picture='')
+        album = Album.objects.create(title='album', user=self.user, author=author, picture='')
+        self.songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=album,
+                                          picture='') for i in range(3)]
+        self.url = f'/api/v1/library/song/short?album_id={album.id}'
+
+    def test_queries_are_counted(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        log = instrumentation.get_request_log()
+        self.assertEqual(len(log), 1)
+        [route] = log.routes()
+        self.assertEqual((route['method'], route['route'], route['requests']), ('GET', 'short-song', 1))
+        self.assertEqual(route['queries'], len(queries))
+        self.assertEqual(route['response_size'], len(response.content))
+        self.assertGreater(route['sql_time'], 0)
+        # outside of a request nothing is counted
+        Song.objects.count()
+        self.assertEqual(log.routes()[0]['queries'], len(queries))
+
+    def test_async_queries_are_counted(self):
+        # the ASGI handler loads the middleware in the event loop's thread, the test database connection
+        # of this one was opened before
+        instrumentation._install_query_recorder(connection=connection)
+        with benchmark_asgi.Command().views(True), CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(self.async_client.get)(self.url, headers={
+                'authorization': self.headers['HTTP_AUTHORIZATION']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(instrumentation.get_request_log().routes()[0]['queries'], len(queries))
+
+    def test_slow_requests(self):
+        with override_settings(REQUEST_PROFILING={'SLOW_REQUEST_QUERIES': 1000, 'SLOW_REQUEST_TIME': 60}):
+            with self.assertNoLogs('instrumentation', 'WARNING'):
+                self.client.get(self.url, **self.headers)
+        self.assertEqual(instrumentation.get_request_log().slow(), [])
+
+        with override_settings(REQUEST_PROFILING={'SLOW_REQUEST_QUERIES': 1}):
+            self.client = self.client_class()
+            with self.assertLogs('instrumentation', 'WARNING') as logs:
+                self.client.get(self.url, **self.headers)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Slow request GET /api/v1/library/song/short (short-song)', logs.output[0])
+        [slow] = instrumentation.get_request_log().slow()
+        self.assertEqual((slow['route'], slow['status']), ('short-song', 200))
+        self.assertEqual(len(instrumentation.get_request_log()), 2)
+
+    def test_disabled(self):
+        with override_settings(REQUEST_PROFILING={'ENABLED': False, 'SLOW_REQUEST_QUERIES': 1}):
+            with self.assertNoLogs('instrumentation', 'WARNING'):
+                response = self.client.get(self.url, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(instrumentation.get_request_log()), 0)
+
+
+class RollupPlaysTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rolled')
+        author = Author.objects.create(title='author', user=self.user, picture='')
+        album = Album.objects.create(title='album', user=self.user, author=author, picture='')
+        self.songs = [Song.objects.create(title=f'song {i}', audio='tracks/song.mp3', user=self.user, album=album,
+                                          picture='') for i in range(3)]
+        self.now = timezone.now()
+        self.rnd = random.Random(0)
+
+    def play(self, count):
+        return PlayEvent.objects.bulk_create([
+            PlayEvent(song=self.rnd.choice(self.songs), user=self.user,
+                      played_at=self.now - timedelta(hours=self.rnd.random() * 24 * 40))
+            for _ in range(count)])
+
+    def rollup(self, **kwargs):
+        with mock.patch('library.rollups.timezone.now', return_value=self.now):
+            return rollup_plays(**kwargs)
+
+    def assertRolledUp(self, events):
+        for granularity in Granularity:
+            expected = Counter((bucket_start(event.played_at, granularity), event.song_id) for event in events)
+            rows = SongPlayRollup.objects.filter(granularity=granularity)
+            self.assertEqual({(row.bucket, row.song_id): row.count for row in rows}, expected, granularity)
+            rows = UserPlayRollup.objects.filter(granularity=granularity)
+            self.assertEqual(sum(row.count for row in rows), len(events))
+
+    def test_rerun_is_idempotent(self):
+        events = self.play(200)
+        self.assertEqual(self.rollup(batch_size=64), 200)
+        self.assertRolledUp(events)
+        self.assertEqual(self.rollup(), 0)
+        self.assertRolledUp(events)
+        events += self.play(10)
+        self.assertEqual(self.rollup(), 10)
+        self.assertRolledUp(events)
+
+    def test_late_events_with_lower_ids(self):
+        events = self.play(5)
+        last = events[-1].id
+        # a transaction got last + 1 and last + 2 and has not committed yet, a later one has
+        later = [PlayEvent.objects.create(id=last + 3 + i, song=self.songs[i], user=self.user,
+                                          played_at=self.now - timedelta(days=i)) for i in range(3)]
+        self.assertEqual(self.rollup(), 5)
+        self.assertRolledUp(events)
+        self.assertEqual(RollupWatermark.objects.get().last_id, last)
+
+        late = [PlayEvent.objects.create(id=last + 1 + i, song=self.songs[0], user=self.user, played_at=self.now)
+                for i in range(2)]
+        self.now += timedelta(seconds=10)
+        self.assertEqual(self.rollup(), 5)
+        self.assertRolledUp(events + late + later)
+        self.assertEqual(self.rollup(), 0)
+
+    def test_missing_ids_are_given_up_on(self):
+        events = self.play(5)
+        # rolled back: the next ids never show up
+        later = [PlayEvent.objects.create(id=events[-1].id + 3, song=self.songs[1], user=self.user,
+                                          played_at=self.now)]
+        self.assertEqual(self.rollup(), 5)
+        self.now += rollups.GAP_TIMEOUT / 2
+        self.assertEqual(self.rollup(), 0)
+        self.now += rollups.GAP_TIMEOUT
+        self.assertEqual(self.rollup(), 1)
+        self.assertRolledUp(events + later)
+        self.assertEqual(RollupWatermark.objects.get().last_id, later[0].id)
@@ -0,0 +1,257 @@
+import gzip
+import heapq
+import json
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import Song, Album, Author, UserSongPlay
+
+SONG, ALBUM, AUTHOR = 'song', 'album', 'author'
+MAX_SUGGESTIONS = 20
+# prefixes matching more index keys than this get their top suggestions memoized
+SCAN_LIMIT = 256
+SNAPSHOT_VERSION = 1
+
+_END = '\U0010ffff'
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(ch if ch.isalnum() else ' ' for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.split())
+
+
+def index_keys(title: str) -> list[str]:
+    """
+    A title is reachable from the start of any of its words: "dark side" -> "dark side", "side".
+    """
+    words = normalize(title).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class TypeaheadIndex:
+    """
+    Sorted array of (key, kind, id) with per-document popularity weights. A lookup is a bisect
+    for the prefix range plus a top-k over it; wide ranges (short prefixes) are memoized. A change
+    merges the document into the memoized tops of its prefixes, only a top losing a member (a removal,
+    a rename, a lower weight) is scanned again.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._docs = {}
+        self._top = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, kind: str, pk: int, title: str, weight: int | None = None) -> None:
+        ref = (kind, pk)
+        with self._lock:
+            old = self._docs.get(ref)
+            if weight is None:
+                weight = old[1] if old else 0
+            if old is not None:
+                self._remove_keys(kind, pk, old[2])
+            keys = index_keys(title)
+            self._docs[ref] = (title, weight, keys)
+            for key in keys:
+                insort(self._entries, (key, kind, pk))
+            self._version += 1
+
+            prefixes = _prefixes(keys)
+            stale = [prefix for prefix in _prefixes(old[2]) - prefixes if ref in self._top.get(prefix, ())] \
+                if old is not None else []
+            for prefix in prefixes:
+                top = self._top.get(prefix)
+                if top is None:
+                    continue
+                if old is not None and weight < old[1] and ref in top:
+                    # a document ranked below it may now belong in the top
+                    stale.append(prefix)
+                else:
+                    self._top[prefix] = self._top_refs([*(other for other in top if other != ref), ref])
+            for prefix in stale:
+                self._top[prefix] = self._scan(prefix)
+
+    def remove(self, kind: str, pk: int) -> None:
+        ref = (kind, pk)
+        with self._lock:
+            old = self._docs.pop(ref, None)
+            if old is None:
+                return
+            self._remove_keys(kind, pk, old[2])
+            self._version += 1
+            for prefix in _prefixes(old[2]):
+                if ref in self._top.get(prefix, ()):
+                    self._top[prefix] = self._scan(prefix)
+
+    def bulk_load(self, docs) -> None:
+        """
+        Replace the index with docs, an iterable of (kind, id, title, weight).
+        """
+        entries, index = [], {}
+        for kind, pk, title, weight in docs:
+            keys = index_keys(title)
+            index[(kind, pk)] = (title, weight, keys)
+            entries.extend((key, kind, pk) for key in keys)
+        entries.sort()
+        with self._lock:
+            self._entries, self._docs, self._top = entries, index, {}
+            self._version += 1
+
+    def suggest(self, text: str, k: int = 10) -> list[dict]:
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        k = min(k, MAX_SUGGESTIONS)
+
+        top = self._top.get(prefix)
+        if top is None:
+            version, entries = self._version, self._entries
+            lo = bisect_left(entries, (prefix,))
+            hi = bisect_left(entries, (prefix + _END,), lo)
+            top = self._top_refs({(kind, pk) for _, kind, pk in entries[lo:hi]})
+            if hi - lo > SCAN_LIMIT:
+                with self._lock:
+                    # a concurrent update may have made this top stale
+                    if version == self._version:
+                        self._top[prefix] = top
+
+        result = []
+        for ref in top[:k]:
+            doc = self._docs.get(ref)
+            if doc is not None:
+                result.append({'type': ref[0], 'id': ref[1], 'title': doc[0]})
+        return result
+
+    def warm(self, max_length: int = 2) -> None:
+        """
+        Memoize every prefix up to max_length so the first keystrokes never scan a wide range. Only the
+        longest prefixes are scanned; the top of a shorter prefix is merged from its children's tops.
+        """
+        version = self._version
+        groups = defaultdict(set)
+        for key, kind, pk in self._entries:
+            groups[key[:max_length]].add((kind, pk))
+
+        current = {prefix: self._top_refs(refs) for prefix, refs in groups.items()}
+        memo = {}
+        for length in range(max_length - 1, 0, -1):
+            parents = defaultdict(set)
+            for prefix, top in current.items():
+                if len(prefix) > length:
+                    memo[prefix] = top
+                parents[prefix[:length]].update(top)
+            current = {prefix: self._top_refs(refs) for prefix, refs in parents.items()}
+        memo.update(current)
+
+        with self._lock:
+            if version == self._version:
+                self._top.update(memo)
+
+    def _top_refs(self, refs) -> list[tuple[str, int]]:
+        docs = self._docs
+        return heapq.nlargest(MAX_SUGGESTIONS, refs,
+                              key=lambda ref: (docs[ref][1], -ref[1]) if ref in docs else (-1, 0))
+
+    def _scan(self, prefix: str) -> list[tuple[str, int]]:
+        lo = bisect_left(self._entries, (prefix,))
+        hi = bisect_left(self._entries, (prefix + _END,), lo)
+        return self._top_refs({(kind, pk) for _, kind, pk in self._entries[lo:hi]})
+
+    def _remove_keys(self, kind, pk, keys):
+        for key in keys:
+            i = bisect_left(self._entries, (key, kind, pk))
+            if i < len(self._entries) and self._entries[i] == (key, kind, pk):
+                del self._entries[i]
+
+
+def _prefixes(keys) -> set[str]:
+    return {key[:length] for key in keys for length in range(1, len(key) + 1)}
+
+
+def catalog_docs():
+    """
+    (kind, id, title, weight) for the whole catalog, weighted by UserSongPlay counts.
+    """
+    song_plays = dict(UserSongPlay.objects.values('song_id').annotate(plays=Sum('count'))
+                      .values_list('song_id', 'plays'))
+    album_plays, author_plays = {}, {}
+    for song_id, album_id in Song.objects.values_list('id', 'album_id').iterator():
+        album_plays[album_id] = album_plays.get(album_id, 0) + song_plays.get(song_id, 0)
+    for song_id, author_id in Song.authors.through.objects.values_list('song_id', 'author_id').iterator():
+        author_plays[author_id] = author_plays.get(author_id, 0) + song_plays.get(song_id, 0)
+
+    for kind, model, plays in ((SONG, Song, song_plays), (ALBUM, Album, album_plays), (AUTHOR, Author, author_plays)):
+        for pk, title in model.objects.values_list('id', 'title').iterator():
+            yield kind, pk, title, plays.get(pk, 0)
+
+
+def _docs_created_after(max_ids: dict):
+    # rows created since the snapshot have no plays worth weighting yet
+    for kind, model in ((SONG, Song), (ALBUM, Album), (AUTHOR, Author)):
+        for pk, title in model.objects.filter(id__gt=max_ids[kind]).values_list('id', 'title').iterator():
+            yield kind, pk, title, 0
+
+
+def write_snapshot(path=None) -> int:
+    docs = [list(doc) for doc in catalog_docs()]
+    with gzip.open(path or settings.TYPEAHEAD_SNAPSHOT, 'wt', encoding='utf-8') as file:
+        json.dump({'version': SNAPSHOT_VERSION, 'docs': docs}, file, separators=(',', ':'))
+    return len(docs)
+
+
+def load_index(path=None) -> TypeaheadIndex:
+    """
+    Build the index from the snapshot file and catch up with rows created after it was written.
+    Without a snapshot the index is built straight from the database.
+    """
+    index = TypeaheadIndex()
+    try:
+        with gzip.open(path or settings.TYPEAHEAD_SNAPSHOT, 'rt', encoding='utf-8') as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        snapshot = None
+
+    if snapshot is None or snapshot.get('version') != SNAPSHOT_VERSION:
+        index.bulk_load(catalog_docs())
+    else:
+        docs = [tuple(doc) for doc in snapshot['docs']]
+        max_ids = {kind: max((pk for doc_kind, pk, _, _ in docs if doc_kind == kind), default=0)
+                   for kind in (SONG, ALBUM, AUTHOR)}
+        docs.extend(_docs_created_after(max_ids))
+        index.bulk_load(docs)
+    index.warm()
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> TypeaheadIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    return _index
+
+
+def update_index(kind: str, pk: int, title: str) -> None:
+    # only a loaded index is kept up to date, rows created before a load are caught up from the database
+    if _index is not None:
+        _index.add(kind, pk, title)
+
+
+def remove_from_index(kind: str, pk: int) -> None:
+    if _index is not None:
+        _index.remove(kind, pk)
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.utils import timezone
+
+from .audio import AudioProbe
+from .models import UploadSession, UploadChunk
+
+DEFAULT_CHUNKED_UPLOAD = {
+    'DIR': os.path.join(settings.BASE_DIR, 'uploads'),
+    'CHUNK_SIZE': 8 * 1024 * 1024,
+    'MIN_CHUNK_SIZE': 256 * 1024,
+    'MAX_CHUNK_SIZE': 64 * 1024 * 1024,
+    'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+    'EXPIRY': timedelta(hours=24),
+}
+READ_SIZE = 64 * 1024
+
+
+class ChunkError(Exception):
+    pass
+
+
+def upload_settings() -> dict:
+    return {**DEFAULT_CHUNKED_UPLOAD, **getattr(settings, 'CHUNKED_UPLOAD', {})}
+
+
+def part_path(session_id) -> str:
+    return os.path.join(upload_settings()['DIR'], f'{session_id}.part')
+
+
+class AssembledFile(File):
+    """
+    The part file of a finished session. Having a temporary_file_path lets the storage move it into
+    place instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class AudioUploadHandler(TemporaryFileUploadHandler):
+    """
+    Receives one form field (audio) straight to a temporary file, hashing it and parsing its container
+    headers while the chunks arrive. The file comes out with sha256 and audio_info attributes, so it is
+    never read again: content-addressed storage moves it into place under that hash. Other fields are
+    left to the next handlers.
+    """
+
+    def __init__(self, request=None, field_name='audio'):
+        super().__init__(request)
+        self.field_name = field_name
+        self.active = False
+
+    def new_file(self, field_name, *args, **kwargs):
+        self.active = field_name == self.field_name
+        if self.active:
+            super().new_file(field_name, *args, **kwargs)
+            self.digest = hashlib.sha256()
+            self.probe = AudioProbe()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.digest.update(raw_data)
+        self.probe.feed(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        file.audio_info = self.probe.result(file_size)
+        return file
+
+
+def create_part_file(session: UploadSession) -> None:
+    os.makedirs(upload_settings()['DIR'], exist_ok=True)
+    with open(part_path(session.id), 'wb') as file:
+        # sparse on most filesystems, chunks are written at their offset in any order
+        file.truncate(session.size)
+
+
+def write_chunk(session: UploadSession, index: int, stream, sha256: str) -> UploadChunk:
+    """
+    Receive one chunk from stream into a temporary file, hashing it on the way, and copy it into the part
+    file at its offset once its length and checksum match. A failed chunk leaves the part file untouched,
+    a recorded chunk sent again included, and is simply sent again.
+    """
+    if not 0 <= index < session.chunk_count:
+        raise ChunkError(f'Chunk index must be between 0 and {session.chunk_count - 1}.')
+    expected = session.chunk_length(index)
+
+    digest, size = hashlib.sha256(), 0
+    with tempfile.TemporaryFile(dir=upload_settings()['DIR']) as received:
+        while size <= expected:
+            data = stream.read(min(READ_SIZE, expected + 1 - size))
+            if not data:
+                break
+            size += len(data)
+            if size > expected:
+                break
+            digest.update(data)
+            received.write(data)
+
+        if size != expected:
+            raise ChunkError(f'Chunk {index} must be {expected} bytes long.')
+        if digest.hexdigest() != sha256.lower():
+            raise ChunkError(f'Checksum of chunk {index} does not match.')
+
+        received.seek(0)
+        with open(part_path(session.id), 'r+b') as file:
+            file.seek(index * session.chunk_size)
+            shutil.copyfileobj(received, file, READ_SIZE)
+
+    chunk, _ = UploadChunk.objects.update_or_create(session=session, index=index,
+                                                    defaults={'size': size, 'sha256': sha256.lower()})
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return chunk
+
+
+def missing_chunks(session: UploadSession) -> list[int]:
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.chunk_count) if index not in received]
+
+
+def discard_session(session: UploadSession) -> None:
+    path = part_path(session.id)
+    session.delete()
+    transaction.on_commit(lambda: _remove(path))
+
+
+def collect_stale_sessions(expiry: timedelta | None = None) -> int:
+    """
+    Delete sessions without activity within expiry, and part files no session refers to.
+    Returns the number of sessions deleted.
+    """
+    config = upload_settings()
+    cutoff = timezone.now() - (expiry or config['EXPIRY'])
+    stale = list(UploadSession.objects.filter(updated_at__lt=cutoff).values_list('id', flat=True))
+    UploadSession.objects.filter(id__in=stale).delete()
+    for session_id in stale:
+        _remove(part_path(session_id))
+
+    if os.path.isdir(config['DIR']):
+        live = {str(pk) for pk in UploadSession.objects.values_list('id', flat=True)}
+        for entry in os.scandir(config['DIR']):
+            session_id, extension = os.path.splitext(entry.name)
+            if extension == '.part' and session_id not in live \
+                    and entry.stat().st_mtime < cutoff.timestamp():
+                _remove(entry.path)
+    return len(stale)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
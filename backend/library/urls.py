@@ -1,14 +1,32 @@
 from django.urls import path
 
 from .views import (SongView, AuthorView, AlbumView, GenreListCreateView, GenreRetrieveUpdateDestroyView, ShortSongView,
-                    UserSongPlayView)
+                    UserSongPlayView, SongStreamView, PlayStatsView, PlayHistoryView, ChartView,
+                    SongSearchView, TypeaheadView, UploadSessionView, UploadChunkView, UploadCompleteView,
+                    SongWaveformView, ResponseCacheStatsView, RecommendationsView, CatalogExportView,
+                    RequestStatsView)
 
 urlpatterns = [
     path('song/short', ShortSongView.as_view(), name='short-song'),
+    path('song/search', SongSearchView.as_view(), name='song-search'),
+    path('typeahead', TypeaheadView.as_view(), name='typeahead'),
     path('song/', SongView.as_view(), name='song'),
     path('song/<int:pk>/', SongView.as_view(), name='song_update'),
+    path('song/<int:pk>/stream/', SongStreamView.as_view(), name='song_stream'),
+    path('song/<int:pk>/waveform/', SongWaveformView.as_view(), name='song_waveform'),
+    path('upload/', UploadSessionView.as_view(), name='upload'),
+    path('upload/<uuid:pk>/', UploadSessionView.as_view(), name='upload_session'),
+    path('upload/<uuid:pk>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload_chunk'),
+    path('upload/<uuid:pk>/complete/', UploadCompleteView.as_view(), name='upload_complete'),
     path('play/', UserSongPlayView.as_view(), name='play'),
     path('play/<int:pk>', UserSongPlayView.as_view(), name='play'),
+    path('stats/plays/', PlayStatsView.as_view(), name='play-stats'),
+    path('stats/history/', PlayHistoryView.as_view(), name='play-history'),
+    path('charts/', ChartView.as_view(), name='charts'),
+    path('recommendations/', RecommendationsView.as_view(), name='recommendations'),
+    path('cache/stats/', ResponseCacheStatsView.as_view(), name='response-cache-stats'),
+    path('stats/requests/', RequestStatsView.as_view(), name='request-stats'),
+    path('export/', CatalogExportView.as_view(), name='catalog-export'),
 
     path('author/', AuthorView.as_view(), name='author'),
     path('author/<int:pk>/', AuthorView.as_view(), name='author_change'),
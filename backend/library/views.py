@@ -1,40 +1,63 @@
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+
 from rest_framework import generics
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from users.authentication import StatelessJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import exceptions
-from rest_framework.pagination import PageNumberPagination
 
-from .models import Author, Song, Album, Genre, UserSongPlay
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+
+from .models import Author, Song, Album, Genre, UserSongPlay, SongPlayRollup, UserPlayRollup, \
+    ChartEntry, UploadSession, SongWaveform
 from .serializers import SongSerializer, AuthorSerializer, AlbumSerializer, GenreSerializer, SongReadSerializer, \
-    UserSongPlaySerializer
+    UserSongPlaySerializer, PlayStatsQuerySerializer, PlayHistoryQuerySerializer, PlayBucketSerializer, \
+    PlayHistorySerializer, ChartQuerySerializer, ChartEntrySerializer, UploadSessionSerializer, \
+    RecommendationQuerySerializer, ExportQuerySerializer, RequestStatsQuerySerializer, TypeaheadQuerySerializer
+from .rollups import bucket_start
+from .recommendations import recommend
+from .search import search_song_ids
+from .typeahead import get_index
+from .pagination import SongCursorPagination, SearchResultsPagination
+from .querysets import song_read_queryset
+from .cache import get_response_cache, SONG, ALBUM, AUTHOR
+from .exports import CatalogExport, Watermark
+from .streaming import stream_audio
+from .waveforms import level_peaks
+from .uploads import AudioUploadHandler, AssembledFile, ChunkError, write_chunk, missing_chunks, discard_session, \
+    part_path
 from utils import convert_form_to_data
+from async_views import AsyncReadMixin
+from instrumentation import get_request_log, serializing
+from playlists.likes import liked_songs
 from exceptions import NO_PK_PROVIDED, OBJECT_NOT_EXIST
 
 from users.permissions import IsOwnerOrPostOnly, IsSuperUser, IsOwner
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 50
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
-class ShortSongView(APIView):
-    authentication_classes = (JWTAuthentication,)
+class ShortSongView(AsyncReadMixin, APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrPostOnly,)
-    pagination_class = StandardResultsSetPagination
+    pagination_class = SongCursorPagination
 
-    def get(self, request):
+    def lookup(self, request):
+        """
+        (model, many, context, pk) of the query parameter, None without one.
+        """
         query_param_to_model = {
             'song_id': (Song, False, {}),
             'genre_id': (Genre, True, {}),
             'author_id': (Author, True, {'authors': False}),
             'album_id': (Album, True, {'album': False}),
         }
-        query_params = request.query_params
+        query_params = {key: value for key, value in request.query_params.items() if key in query_param_to_model}
 
         query_count = 0
         for key in query_params:
@@ -46,17 +69,85 @@ class ShortSongView(APIView):
             if value is None:
                 continue
             model, many, context = query_param_to_model[key]
-            try:
-                obj = model.objects.get(pk=value)
-            except model.DoesNotExist:
-                raise exceptions.NotFound(OBJECT_NOT_EXIST(model))
-            obj = obj.songs if many else obj
-            serializer = SongReadSerializer(obj, many=many, context=context)
-            return Response(serializer.data, status=200)
+            return model, many, {**context, 'liked': liked_songs(request.user)}, value
+        return None
+
+    def get(self, request):
+        lookup = self.lookup(request)
+        if lookup is None:
+            return None
+        model, many, context, pk = lookup
+        try:
+            if many:
+                obj = model.objects.only('id').get(pk=pk)
+                obj = song_read_queryset(obj.songs.all(), context)
+            else:
+                obj = song_read_queryset(context=context).get(pk=pk)
+        except model.DoesNotExist:
+            raise exceptions.NotFound(OBJECT_NOT_EXIST(model))
+        return self.respond(request, obj, many, context)
+
+    async def aget(self, request):
+        lookup = self.lookup(request)
+        if lookup is None:
+            return None
+        model, many, context, pk = lookup
+        try:
+            if many:
+                obj = await model.objects.only('id').aget(pk=pk)
+                obj = song_read_queryset(obj.songs.all(), context)
+            else:
+                obj = await song_read_queryset(context=context).aget(pk=pk)
+        except model.DoesNotExist:
+            raise exceptions.NotFound(OBJECT_NOT_EXIST(model))
+        # the is_liked lookups may load the liked songs
+        return await sync_to_async(self.respond)(request, obj, many, context)
+
+    def respond(self, request, songs, many, context):
+        if not many:
+            with serializing():
+                data = SongReadSerializer(songs, context=context).data
+            return Response(data, status=200)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(songs, request, view=self)
+        with serializing():
+            data = SongReadSerializer(page, many=True, context=context).data
+        return paginator.get_paginated_response(data)
+
+
+class SongSearchView(APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    pagination_class = SearchResultsPagination
+
+    def get(self, request):
+        text = request.query_params.get('q', '')
+        if not text.strip():
+            raise exceptions.ParseError({'q': 'No search query provided.'})
+
+        paginator = self.pagination_class()
+        song_ids = paginator.paginate_search(lambda limit, offset: search_song_ids(text, limit, offset), request)
+        songs = song_read_queryset().in_bulk(song_ids)
+        serializer = SongReadSerializer([songs[pk] for pk in song_ids if pk in songs], many=True,
+                                        context={'liked': liked_songs(request.user)})
+        return paginator.get_paginated_response(serializer.data)
+
+
+class TypeaheadView(APIView):
+    # answered from the in-process index, no query per keystroke
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        query = TypeaheadQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        suggestions = get_index().suggest(query.validated_data['q'], query.validated_data['k'])
+        return Response(suggestions, status=200)
 
 
-class SongView(APIView):
-    authentication_classes = (JWTAuthentication,)
+class SongView(AsyncReadMixin, APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrPostOnly,)
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
@@ -65,14 +156,33 @@ class SongView(APIView):
         if pk is None:
             raise exceptions.ParseError(NO_PK_PROVIDED)
 
-        try:
-            song = Song.objects.get(pk=pk)
-        except Song.DoesNotExist:
-            raise exceptions.NotFound(OBJECT_NOT_EXIST(Song))
-        serializer = SongSerializer(song, context={'request': request})
-        return Response(serializer.data, status=200)
+        def build():
+            try:
+                song = Song.objects.prefetch_related('genres', 'authors').get(pk=pk)
+            except Song.DoesNotExist:
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(Song))
+            return SongSerializer(song, context={'request': request}).data
+
+        return get_response_cache().respond(request, SONG, pk, build)
+
+    async def aget(self, request, *args, **kwargs):
+        pk = kwargs.get('pk', None)
+        if pk is None:
+            raise exceptions.ParseError(NO_PK_PROVIDED)
+
+        async def build():
+            try:
+                song = await Song.objects.prefetch_related('genres', 'authors').aget(pk=pk)
+            except Song.DoesNotExist:
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(Song))
+            # picture derivatives are looked up on disk
+            return await sync_to_async(lambda: SongSerializer(song, context={'request': request}).data)()
+
+        return await get_response_cache().arespond(request, SONG, pk, build)
 
     def post(self, request):
+        # must be in place before request.data parses the body
+        request.upload_handlers.insert(0, AudioUploadHandler(request))
         form_data = convert_form_to_data(request.data)
         serializer = SongSerializer(data=form_data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -99,10 +209,9 @@ class SongView(APIView):
         return Response(serializer.data, status=200)
 
 
-class AlbumView(APIView):
-    authentication_classes = (JWTAuthentication,)
+class SongStreamView(APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrPostOnly,)
-    parser_classes = [MultiPartParser, FormParser, JSONParser]
 
     def get(self, request, *args, **kwargs):
         pk = kwargs.get('pk', None)
@@ -110,12 +219,187 @@ class AlbumView(APIView):
             raise exceptions.ParseError(NO_PK_PROVIDED)
 
         try:
-            album = Album.objects.get(pk=pk)
-        except Album.DoesNotExist:
-            raise exceptions.NotFound(OBJECT_NOT_EXIST(Album))
-        serializer = AlbumSerializer(album, context={'request': request})
+            song = Song.objects.only('id', 'user_id', 'audio').get(pk=pk)
+        except Song.DoesNotExist:
+            raise exceptions.NotFound(OBJECT_NOT_EXIST(Song))
+        self.check_object_permissions(request, song)
+
+        if not song.audio or not song.audio.storage.exists(song.audio.name):
+            raise exceptions.NotFound({'audio': 'File does not exist'})
+        return stream_audio(request, song.audio)
+
+
+class SongWaveformView(APIView):
+    # int8 min/max pairs, a few kilobytes, precomputed by `manage.py compute_waveforms`
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwnerOrPostOnly,)
+
+    def get(self, request, *args, **kwargs):
+        pk = kwargs.get('pk', None)
+        if pk is None:
+            raise exceptions.ParseError(NO_PK_PROVIDED)
+        try:
+            count = int(request.query_params['peaks']) if 'peaks' in request.query_params else None
+        except ValueError:
+            raise exceptions.ParseError({'peaks': 'A valid integer is required.'})
+
+        try:
+            waveform = SongWaveform.objects.select_related('song').only('song__id', 'song__user_id', 'levels',
+                                                                        'peaks', 'computed_at').get(song_id=pk)
+        except SongWaveform.DoesNotExist:
+            raise exceptions.NotFound({'waveform': 'Waveform is not computed yet'})
+        self.check_object_permissions(request, waveform.song)
+        if not waveform.levels:
+            raise exceptions.NotFound({'waveform': 'Waveform is not available for this audio format'})
+
+        level, peaks = level_peaks(waveform, count)
+        etag = f'"{int(waveform.computed_at.timestamp() * 1_000_000):x}-{level}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(peaks, content_type='application/octet-stream')
+        response['ETag'] = etag
+        response['X-Waveform-Peaks'] = level
+        return response
+
+
+class ResponseCacheStatsView(APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsSuperUser,)
+
+    def get(self, request):
+        return Response(get_response_cache().stats(), status=200)
+
+
+class RequestStatsView(APIView):
+    # the routes of this process costing the most, see instrumentation.RequestProfilingMiddleware
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsSuperUser,)
+
+    def get(self, request):
+        query = RequestStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        log = get_request_log()
+        return Response({
+            'requests': len(log),
+            'routes': log.routes(query.validated_data['order'], query.validated_data['limit']),
+            'slow': log.slow(query.validated_data['limit']),
+        }, status=200)
+
+
+class CatalogExportView(APIView):
+    # NDJSON stream of the catalog, plays and playlists, see library.exports
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsSuperUser,)
+
+    def get(self, request):
+        query = ExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        compress = query.validated_data['gzip']
+
+        export = CatalogExport(Watermark(query.validated_data['since'], query.validated_data['after_play_id']))
+        response = StreamingHttpResponse(export.chunks(compress),
+                                         content_type='application/gzip' if compress else 'application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="catalog.ndjson{".gz" if compress else ""}"'
+        return response
+
+
+class UploadSessionMixin:
+    def get_session(self, request, pk):
+        try:
+            session = UploadSession.objects.get(pk=pk)
+        except UploadSession.DoesNotExist:
+            raise exceptions.NotFound(OBJECT_NOT_EXIST(UploadSession))
+        self.check_object_permissions(request, session)
+        return session
+
+
+class UploadSessionView(UploadSessionMixin, APIView):
+    # resumable upload: create a session, PUT its chunks in any order, then complete it into a song
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwner,)
+
+    def get(self, request, *args, **kwargs):
+        session = self.get_session(request, kwargs.get('pk'))
+        serializer = UploadSessionSerializer(session)
         return Response(serializer.data, status=200)
 
+    def post(self, request):
+        serializer = UploadSessionSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data, status=201)
+
+    def delete(self, request, *args, **kwargs):
+        session = self.get_session(request, kwargs.get('pk'))
+        discard_session(session)
+        return Response(status=204)
+
+
+class UploadChunkView(UploadSessionMixin, APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwner,)
+
+    def put(self, request, *args, **kwargs):
+        session = self.get_session(request, kwargs.get('pk'))
+        sha256 = request.headers.get('X-Chunk-SHA256')
+        if not sha256:
+            raise exceptions.ParseError({'X-Chunk-SHA256': 'No chunk checksum provided.'})
+
+        # the body is read straight from the request stream, never buffered as a whole
+        try:
+            chunk = write_chunk(session, kwargs['index'], request.stream or BytesIO(), sha256)
+        except ChunkError as error:
+            raise exceptions.ValidationError({'chunk': str(error)})
+        return Response({'index': chunk.index, 'size': chunk.size, 'missing': missing_chunks(session)},
+                        status=200)
+
+
+class UploadCompleteView(UploadSessionMixin, APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwner,)
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+
+    def post(self, request, *args, **kwargs):
+        session = self.get_session(request, kwargs.get('pk'))
+        missing = missing_chunks(session)
+        if missing:
+            raise exceptions.ValidationError({'chunks': f'Missing chunks: {", ".join(map(str, missing))}.'})
+
+        form_data = convert_form_to_data(request.data) if 'data' in request.data else request.data.copy()
+        with open(part_path(session.id), 'rb') as file:
+            form_data['audio'] = AssembledFile(file, name=session.filename)
+            serializer = SongSerializer(data=form_data, context={'request': request})
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                if not UploadSession.objects.select_for_update().filter(pk=session.pk).exists():
+                    raise exceptions.NotFound(OBJECT_NOT_EXIST(UploadSession))
+                serializer.save()
+                discard_session(session)
+
+        return Response(serializer.data, status=201)
+
+
+class AlbumView(APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwnerOrPostOnly,)
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+
+    def get(self, request, *args, **kwargs):
+        pk = kwargs.get('pk', None)
+        if pk is None:
+            raise exceptions.ParseError(NO_PK_PROVIDED)
+
+        def build():
+            try:
+                album = Album.objects.get(pk=pk)
+            except Album.DoesNotExist:
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(Album))
+            return AlbumSerializer(album, context={'request': request}).data
+
+        return get_response_cache().respond(request, ALBUM, pk, build)
+
     def post(self, request):
         form_data = convert_form_to_data(request.data)
         serializer = AlbumSerializer(data=form_data, context={'request': request})
@@ -144,7 +428,7 @@ class AlbumView(APIView):
 
 
 class AuthorView(APIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrPostOnly,)
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
@@ -153,12 +437,14 @@ class AuthorView(APIView):
         if pk is None:
             raise exceptions.ParseError(NO_PK_PROVIDED)
 
-        try:
-            author = Author.objects.get(pk=pk)
-        except Author.DoesNotExist:
-            raise exceptions.NotFound(OBJECT_NOT_EXIST(Author))
-        serializer = AuthorSerializer(author, context={'request': request})
-        return Response(serializer.data, status=200)
+        def build():
+            try:
+                author = Author.objects.get(pk=pk)
+            except Author.DoesNotExist:
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(Author))
+            return AuthorSerializer(author, context={'request': request}).data
+
+        return get_response_cache().respond(request, AUTHOR, pk, build)
 
     def post(self, request):
         form_data = convert_form_to_data(request.data)
@@ -188,7 +474,7 @@ class AuthorView(APIView):
 
 
 class UserSongPlayView(APIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwner,)
 
     def get(self, request, *args, **kwargs):
@@ -208,19 +494,99 @@ class UserSongPlayView(APIView):
     def post(self, request):
         serializer = UserSongPlaySerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        play = serializer.save()
+        if play.pk is None:
+            return Response({'song': play.song_id, 'user': play.user_id}, status=202)
         return Response(serializer.data, status=200)
 
 
+class PlayStatsView(APIView):
+    # reads only the rollups maintained by `manage.py rollup_plays`
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        query = PlayStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        if params.get('song_id') is not None:
+            rollups = SongPlayRollup.objects.filter(song_id=params['song_id'])
+        else:
+            rollups = UserPlayRollup.objects.filter(user=request.user)
+        rollups = rollups.filter(granularity=params['granularity'])
+        if params.get('since') is not None:
+            rollups = rollups.filter(bucket__gte=bucket_start(params['since'], params['granularity']))
+        if params.get('until') is not None:
+            rollups = rollups.filter(bucket__lte=params['until'])
+
+        buckets = rollups.values('bucket').annotate(count=Sum('count')).order_by('bucket')
+        serializer = PlayBucketSerializer(buckets, many=True)
+        return Response(serializer.data, status=200)
+
+
+class PlayHistoryView(APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        query = PlayHistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        granularity = query.validated_data['granularity']
+        bucket = bucket_start(query.validated_data['at'], granularity)
+
+        rollups = UserPlayRollup.objects.filter(user=request.user, granularity=granularity, bucket=bucket) \
+            .prefetch_related(Prefetch('song', queryset=song_read_queryset())).order_by('-count')
+        serializer = PlayHistorySerializer(rollups, many=True, context={'liked': liked_songs(request.user)})
+        return Response(serializer.data, status=200)
+
+
+class ChartView(APIView):
+    # serves the charts materialized by `manage.py refresh_charts`
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        query = ChartQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        entries = ChartEntry.objects.filter(window=params['window'], genre_id=params.get('genre_id')) \
+            .prefetch_related(Prefetch('song', queryset=song_read_queryset())).order_by('rank')[:params['limit']]
+        entries = list(entries)
+        return Response({
+            'window': params['window'],
+            'genre': params.get('genre_id'),
+            'computed_at': entries[0].computed_at if entries else None,
+            'songs': ChartEntrySerializer(entries, many=True, context={'liked': liked_songs(request.user)}).data,
+        }, status=200)
+
+
+class RecommendationsView(APIView):
+    # reads the neighbour table built by `manage.py build_recommendations`
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        query = RecommendationQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        song_ids = recommend(request.user, query.validated_data['limit'])
+        songs = song_read_queryset().in_bulk(song_ids)
+        serializer = SongReadSerializer([songs[pk] for pk in song_ids if pk in songs], many=True,
+                                        context={'liked': liked_songs(request.user)})
+        return Response({'songs': serializer.data}, status=200)
+
+
 class GenreListCreateView(generics.ListCreateAPIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
 
 
 class GenreRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
@@ -0,0 +1,184 @@
+import numpy as np
+
+from django.utils import timezone
+
+from .models import Song, SongWaveform
+
+# peaks per zoom level, finest first; every level is reduced from the previous one
+PEAK_LEVELS = (2048, 512, 128)
+DECODE_BLOCK_FRAMES = 64 * 1024
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xfffe
+
+
+class UnsupportedAudio(Exception):
+    pass
+
+
+def _read_exact(file, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) < size:
+        raise UnsupportedAudio('Truncated file.')
+    return data
+
+
+def decode_wav(file):
+    """
+    Open a WAV file for decoding: returns (frame_count, blocks) where blocks yields float arrays of shape
+    (frames, channels) scaled to [-1, 1], DECODE_BLOCK_FRAMES frames at a time.
+    """
+    header = _read_exact(file, 12)
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise UnsupportedAudio('Not a WAV file.')
+
+    fmt = None
+    while True:
+        chunk = file.read(8)
+        if len(chunk) < 8:
+            raise UnsupportedAudio('No data chunk.')
+        chunk_id, size = chunk[:4], int.from_bytes(chunk[4:8], 'little')
+        if chunk_id == b'fmt ':
+            fmt = _read_exact(file, size + (size & 1))
+        elif chunk_id == b'data':
+            break
+        else:
+            file.seek(size + (size & 1), 1)
+    if fmt is None or len(fmt) < 16:
+        raise UnsupportedAudio('No fmt chunk.')
+
+    tag = int.from_bytes(fmt[0:2], 'little')
+    channels = int.from_bytes(fmt[2:4], 'little')
+    bits = int.from_bytes(fmt[14:16], 'little')
+    if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        tag = int.from_bytes(fmt[24:26], 'little')
+    width = bits // 8
+    if channels < 1 or (tag, width) not in ((WAVE_FORMAT_PCM, 1), (WAVE_FORMAT_PCM, 2), (WAVE_FORMAT_PCM, 3),
+                                            (WAVE_FORMAT_PCM, 4), (WAVE_FORMAT_IEEE_FLOAT, 4),
+                                            (WAVE_FORMAT_IEEE_FLOAT, 8)):
+        raise UnsupportedAudio(f'Unsupported WAV encoding (format {tag}, {bits} bits).')
+
+    frame_size = width * channels
+    if size in (0, 0xffffffff):
+        # written as a stream, the data runs to the end of the file
+        size = file.size - file.tell()
+    frame_count = size // frame_size
+
+    def blocks():
+        remaining = frame_count
+        while remaining > 0:
+            frames = min(DECODE_BLOCK_FRAMES, remaining)
+            data = file.read(frames * frame_size)
+            frames = len(data) // frame_size
+            if not frames:
+                return
+            remaining -= frames
+            yield _to_float(data[:frames * frame_size], tag, width).reshape(frames, channels)
+
+    return frame_count, blocks()
+
+
+def _to_float(data: bytes, tag: int, width: int) -> np.ndarray:
+    if tag == WAVE_FORMAT_IEEE_FLOAT:
+        return np.frombuffer(data, dtype='<f4' if width == 4 else '<f8').astype(np.float32)
+    if width == 1:
+        # 8 bit WAV is unsigned
+        return (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8)
+                   | (raw[:, 2].astype(np.int8).astype(np.int32) << 16))
+        return samples.astype(np.float32) / (1 << 23)
+    dtype = '<i2' if width == 2 else '<i4'
+    return np.frombuffer(data, dtype=dtype).astype(np.float32) / (1 << (8 * width - 1))
+
+
+# decoders by the first bytes of the file; other containers are skipped until a decoder is available
+DECODERS = (
+    (b'RIFF', decode_wav),
+)
+
+
+def compute_peaks(frame_count: int, blocks, resolution: int = PEAK_LEVELS[0]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Min and max of every one of resolution equal slices of the audio, all channels together.
+    """
+    buckets = max(min(resolution, frame_count), 1)
+    mins = np.full(buckets, np.inf, dtype=np.float32)
+    maxs = np.full(buckets, -np.inf, dtype=np.float32)
+
+    start = 0
+    for block in blocks:
+        frame_min, frame_max = block.min(axis=1), block.max(axis=1)
+        index = np.arange(start, start + len(block), dtype=np.int64) * buckets // max(frame_count, 1)
+        # a block covers runs of consecutive buckets, reduce each run then merge into the totals
+        runs = np.flatnonzero(np.diff(index)) + 1
+        runs = np.concatenate(([0], runs))
+        np.minimum.at(mins, index[runs], np.minimum.reduceat(frame_min, runs))
+        np.maximum.at(maxs, index[runs], np.maximum.reduceat(frame_max, runs))
+        start += len(block)
+
+    empty = np.isinf(mins)
+    mins[empty], maxs[empty] = 0, 0
+    return mins, maxs
+
+
+def reduce_peaks(mins: np.ndarray, maxs: np.ndarray, count: int) -> tuple[np.ndarray, np.ndarray]:
+    if count >= len(mins):
+        return mins, maxs
+    bounds = np.arange(count, dtype=np.int64) * len(mins) // count
+    return np.minimum.reduceat(mins, bounds), np.maximum.reduceat(maxs, bounds)
+
+
+def quantize(mins: np.ndarray, maxs: np.ndarray) -> bytes:
+    """
+    Interleaved min/max pairs as int8.
+    """
+    peaks = np.empty(len(mins) * 2, dtype=np.int8)
+    peaks[0::2] = np.clip(np.round(mins * 127), -128, 127)
+    peaks[1::2] = np.clip(np.round(maxs * 127), -128, 127)
+    return peaks.tobytes()
+
+
+def build_waveform(file) -> tuple[list[int], bytes]:
+    """
+    Decode file and return the peak count of every level and the levels' int8 peaks, finest first.
+    """
+    head = file.read(4)
+    file.seek(0)
+    decoder = next((decoder for magic, decoder in DECODERS if head == magic), None)
+    if decoder is None:
+        raise UnsupportedAudio('No decoder for this format.')
+
+    mins, maxs = compute_peaks(*decoder(file))
+    levels, payload = [], []
+    for count in PEAK_LEVELS:
+        mins, maxs = reduce_peaks(mins, maxs, count)
+        levels.append(len(mins))
+        payload.append(quantize(mins, maxs))
+    return levels, b''.join(payload)
+
+
+def compute_waveform(song: Song) -> SongWaveform:
+    with song.audio.open('rb') as file:
+        levels, peaks = build_waveform(file)
+    waveform, _ = SongWaveform.objects.update_or_create(
+        song=song, defaults={'source': song.audio.name, 'levels': levels, 'peaks': peaks,
+                             'computed_at': timezone.now()})
+    return waveform
+
+
+def level_peaks(waveform: SongWaveform, count: int | None = None) -> tuple[int, bytes]:
+    """
+    The coarsest level with at least count peaks (the finest one when count is None), as (peaks, bytes).
+    """
+    offset, chosen = 0, None
+    for level in waveform.levels:
+        if chosen is None or count is None or level >= count:
+            chosen = (level, offset)
+        if count is None:
+            break
+        offset += level * 2
+    level, offset = chosen
+    return level, bytes(waveform.peaks[offset:offset + level * 2])
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class PlaylistsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'playlists'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from images import register_derivatives
+        from library.blobs import register_blob_fields
+        from .models import Playlist, Collection
+        for model in (Playlist, Collection):
+            register_derivatives(model, 'picture')
+            register_blob_fields(model, 'picture')
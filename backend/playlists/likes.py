@@ -0,0 +1,88 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Collection, SongCollection
+
+DEFAULT_LIKED_SONGS = {
+    'BACKEND': 'library.cache.LocalLRUBackend',
+    'OPTIONS': {},
+}
+
+
+def pack(song_ids) -> bytes:
+    """
+    Sorted unique ids as a typecode byte followed by a uint32 (uint64 if needed) array.
+    """
+    song_ids = sorted(set(song_ids))
+    typecode = 'I' if not song_ids or song_ids[-1] < 2 ** 32 else 'Q'
+    return typecode.encode() + array(typecode, song_ids).tobytes()
+
+
+def unpack(data: bytes) -> array:
+    song_ids = array(chr(data[0]))
+    song_ids.frombytes(data[1:])
+    return song_ids
+
+
+class LikedSongs:
+    """
+    The songs a user liked, loaded on the first lookup from the cache, or with a single query whose result
+    is cached. The version is the revision of the user's collection, which every like and unlike bumps in
+    the database, so every worker agrees on it and a cached set of an older revision is never reached.
+    """
+
+    def __init__(self, backend, user_id: int, version: int | None = None):
+        self.backend = backend
+        self.user_id = user_id
+        self._version = version
+        self._song_ids = None
+
+    @property
+    def version(self) -> int:
+        # read before the set is loaded, a concurrent change can only leave it under the version it obsoletes
+        if self._version is None:
+            self._version = (Collection.objects.filter(user_id=self.user_id)
+                             .values_list('revision', flat=True).first()) or 0
+        return self._version
+
+    def __contains__(self, song_id: int) -> bool:
+        song_ids = self._load()
+        index = bisect_left(song_ids, song_id)
+        return index < len(song_ids) and song_ids[index] == song_id
+
+    def _load(self) -> array:
+        if self._song_ids is None:
+            key = f'liked:{self.user_id}:{self.version}'
+            data = self.backend.get(key)
+            if data is None:
+                data = pack(SongCollection.objects.filter(collection__user_id=self.user_id)
+                            .values_list('song_id', flat=True))
+                self.backend.set(key, data)
+            self._song_ids = unpack(data)
+        return self._song_ids
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = {**DEFAULT_LIKED_SONGS, **getattr(settings, 'LIKED_SONGS', {})}
+                options = {key.lower(): value for key, value in config['OPTIONS'].items()}
+                _backend = import_string(config['BACKEND'])(**options)
+    return _backend
+
+
+def liked_songs(user, version: int | None = None) -> LikedSongs | None:
+    """
+    version is the revision of the user's collection when the caller already has it loaded.
+    """
+    return LikedSongs(get_backend(), user.pk, version) if user.is_authenticated else None
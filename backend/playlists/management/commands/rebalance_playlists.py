@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from playlists.models import Playlist
+from playlists.positions import rebalance, playlists_to_rebalance
+
+
+class Command(BaseCommand):
+    help = 'Respace the song positions of playlists whose keys grew too long (or of every playlist).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebalance every playlist.')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            playlist_ids = Playlist.objects.values_list('id', flat=True)
+        else:
+            playlist_ids = playlists_to_rebalance()
+        playlist_ids = list(playlist_ids)
+        for playlist_id in playlist_ids:
+            rebalance(playlist_id)
+        self.stdout.write(f'Rebalanced {len(playlist_ids)} playlists.')
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0026_alter_song_users_plays'),
+        ('playlists', '0005_alter_collection_songs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='songcollection',
+            index=models.Index(fields=['collection', 'created_at'], name='playlists_s_collect_bae301_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='songplaylist',
+            index=models.Index(fields=['playlist', 'created_at'], name='playlists_s_playlis_36669d_idx'),
+        ),
+    ]
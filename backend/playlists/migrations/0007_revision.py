@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0006_songplaylist_songcollection_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
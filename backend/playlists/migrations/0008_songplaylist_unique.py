@@ -0,0 +1,30 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:34
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # toggling could race into the same song twice, keep the first row of each pair
+    SongPlaylist = apps.get_model('playlists', 'SongPlaylist')
+    duplicates = (SongPlaylist.objects.values('playlist_id', 'song_id')
+                  .annotate(first=Min('id'), rows=Count('id')).filter(rows__gt=1))
+    for row in duplicates:
+        SongPlaylist.objects.filter(playlist_id=row['playlist_id'], song_id=row['song_id']) \
+            .exclude(id=row['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0033_song_waveform'),
+        ('playlists', '0007_revision'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='songplaylist',
+            unique_together={('playlist', 'song')},
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.4 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+def assign_positions(apps, schema_editor):
+    # existing playlists keep the order they were shown in, oldest first
+    from playlists.positions import spread_keys
+    SongPlaylist = apps.get_model('playlists', 'SongPlaylist')
+    playlist_ids = SongPlaylist.objects.values_list('playlist_id', flat=True).distinct()
+    for playlist_id in playlist_ids:
+        rows = list(SongPlaylist.objects.filter(playlist_id=playlist_id).order_by('created_at', 'id'))
+        for row, key in zip(rows, spread_keys(len(rows))):
+            row.position = key
+        SongPlaylist.objects.bulk_update(rows, ['position'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0033_song_waveform'),
+        ('playlists', '0008_songplaylist_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='songplaylist',
+            name='playlists_s_playlis_36669d_idx',
+        ),
+        migrations.AddField(
+            model_name='songplaylist',
+            name='position',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(assign_positions, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='songplaylist',
+            unique_together={('playlist', 'position'), ('playlist', 'song')},
+        ),
+    ]
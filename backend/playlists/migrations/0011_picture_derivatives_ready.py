@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='picture_derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='picture_derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
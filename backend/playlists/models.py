@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Now
 from library.models import Song
 from users.models import User
 
@@ -7,13 +9,25 @@ class SongPlaylist(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
     playlist = models.ForeignKey('Playlist', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # fractional key (playlists.positions), moving a song rewrites this row only
+    position = models.CharField(max_length=255)
+
+    class Meta:
+        # the (playlist, position) index serves the ordered pages
+        unique_together = (('playlist', 'song'), ('playlist', 'position'))
 
 
 class Playlist(models.Model):
     title = models.CharField(max_length=100)
     picture = models.ImageField(upload_to='picture/playlists/', default='picture/playlists/default.jpg')
+    # set by images.DerivativePool once the derivatives of picture are written
+    picture_derivatives_ready = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='playlists')
     songs = models.ManyToManyField(Song, through=SongPlaylist, blank=True)
+    # bumped by every change of the playlist or its songs, the ETag of its responses
+    revision = models.PositiveIntegerField(default=0)
+    # moves with the revision, the watermark of incremental exports
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class SongCollection(models.Model):
@@ -21,9 +35,22 @@ class SongCollection(models.Model):
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['collection', 'created_at'])]
+
 
 # playlist of liked
 class Collection(models.Model):
     picture = models.ImageField(upload_to='picture/playlists/', default='picture/playlists/collection-default.jpg')
+    # set by images.DerivativePool once the derivatives of picture are written
+    picture_derivatives_ready = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='collection')
     songs = models.ManyToManyField(Song, through=SongCollection, related_name='collections')
+    revision = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+
+def bump_revision(instance: Playlist | Collection) -> None:
+    # an F() update, concurrent changes never end up sharing a revision
+    type(instance).objects.filter(pk=instance.pk).update(revision=F('revision') + 1, updated_at=Now())
+    instance.refresh_from_db(fields=['revision', 'updated_at'])
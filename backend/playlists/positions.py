@@ -0,0 +1,154 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Length
+
+from .models import Playlist, SongPlaylist, bump_revision
+
+logger = logging.getLogger(__name__)
+
+# positions are base 36 fractions written without the leading '0.' and never ending in '0', so comparing
+# them as strings compares the fractions; digits and lowercase letters sort the same under any collation
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+# moves into the same gap lengthen the keys, a playlist is respaced once one gets longer than this
+REBALANCE_LENGTH = 16
+
+
+def _midpoint(a: str, b: str | None) -> str:
+    # a < b, b None standing for 1
+    if b is not None:
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else '0') == b[n]:
+            n += 1
+        if n:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    low = DIGITS.index(a[0]) if a else 0
+    high = DIGITS.index(b[0]) if b is not None else BASE
+    if high - low > 1:
+        return DIGITS[(low + high) // 2]
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[low] + _midpoint(a[1:], None)
+
+
+def _after(a: str) -> str:
+    # appending bumps the first digit instead of halving the gap to 1, keys grow by one digit every 35 appends
+    if a and a[0] == DIGITS[-1]:
+        return a[0] + _after(a[1:])
+    return DIGITS[DIGITS.index(a[0]) + 1] if a else DIGITS[1]
+
+
+def key_between(a: str | None, b: str | None) -> str:
+    """
+    A key sorting after a and before b, None meaning the start or the end of the list.
+    """
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f'{a!r} does not sort before {b!r}.')
+    if b is None:
+        return _after(a or '')
+    return _midpoint(a or '', b)
+
+
+def keys_between(a: str | None, b: str | None, count: int) -> list[str]:
+    """
+    count ascending keys between a and b, bisecting so they stay short.
+    """
+    if count <= 0:
+        return []
+    if b is None:
+        end = key_between(a, None)
+        return keys_between(a, end, count - 1) + [end]
+    middle = key_between(a, b)
+    return keys_between(a, middle, count // 2) + [middle] + keys_between(middle, b, count - count // 2 - 1)
+
+
+def _encode(value: int, length: int) -> str:
+    digits = []
+    for _ in range(length):
+        value, digit = divmod(value, BASE)
+        digits.append(DIGITS[digit])
+    return ''.join(reversed(digits)).rstrip('0')
+
+
+def spread_keys(count: int) -> list[str]:
+    """
+    count ascending keys of equal length, evenly spread over the first half of the key space so appends
+    stay short too.
+    """
+    length = 1
+    while BASE ** length < 2 * (count + 1) * BASE:
+        length += 1
+    step = BASE ** length // (2 * (count + 1))
+    return [_encode((i + 1) * step, length) for i in range(count)]
+
+
+def rebalance(playlist_id: int) -> int:
+    """
+    Respace the positions of a playlist keeping its order. Returns the number of songs.
+    """
+    with transaction.atomic():
+        playlist = Playlist.objects.select_for_update().filter(pk=playlist_id).first()
+        if playlist is None:
+            return 0
+        rows = SongPlaylist.objects.filter(playlist=playlist)
+        entries = list(rows.order_by('position').only('id', 'position'))
+        # (playlist, position) is unique: move the old keys out of the way ('~' sorts after every digit) first
+        rows.update(position=Concat(Value('~'), F('position')))
+        for entry, key in zip(entries, spread_keys(len(entries))):
+            entry.position = key
+        SongPlaylist.objects.bulk_update(entries, ['position'], batch_size=500)
+        # the order is the same but the cursors of the old keys are not
+        bump_revision(playlist)
+    return len(entries)
+
+
+def playlists_to_rebalance():
+    return (SongPlaylist.objects.annotate(length=Length('position')).filter(length__gt=REBALANCE_LENGTH)
+            .values_list('playlist_id', flat=True).distinct())
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='playlist-rebalance')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _run_rebalance(playlist_id: int) -> None:
+    try:
+        rebalance(playlist_id)
+    except Exception:
+        # the next long key schedules it again, the rebalance_playlists command catches the rest
+        logger.exception('Failed to rebalance playlist %s', playlist_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(playlist_id)
+        connections.close_all()
+
+
+def schedule_rebalance(playlist_id: int) -> None:
+    def submit():
+        with _pending_lock:
+            if playlist_id in _pending:
+                return
+            _pending.add(playlist_id)
+        _executor.submit(_run_rebalance, playlist_id)
+    transaction.on_commit(submit)
+
+
+def check_keys(playlist_id: int, keys: list[str]) -> None:
+    if any(len(key) > REBALANCE_LENGTH for key in keys):
+        schedule_rebalance(playlist_id)
+
+
+def append_keys(playlist: Playlist, count: int) -> list[str]:
+    """
+    Keys for count songs added at the end of the playlist. The caller holds the playlist row lock.
+    """
+    last = (SongPlaylist.objects.filter(playlist=playlist).order_by('-position')
+            .values_list('position', flat=True).first())
+    keys = keys_between(last, None, count)
+    check_keys(playlist.pk, keys)
+    return keys
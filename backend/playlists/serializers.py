@@ -1,20 +1,32 @@
 from rest_framework import serializers, fields
-from .models import Playlist, Collection
+from .models import Playlist, Collection, bump_revision
 from library.serializers import SongReadSerializer
 from library.models import Song
 from utils import validate_exist_and_return_array, validate_exist_and_return
 from relations import RelatedFieldOptimized
+from images import ImageDerivativesField
+
+PLAYLIST_CHANGE_MAX_SONGS = 1000
 
 
 class CollectionSerializer(serializers.ModelSerializer):
-    songs = SongReadSerializer(many=True, read_only=True)
+    # a page of songs can be passed in context['songs'], otherwise the whole list is serialized
+    songs = serializers.SerializerMethodField()
+    songs_ordering = None
     picture = fields.ImageField(required=False)
+    picture_derivatives = ImageDerivativesField(source='picture')
 
     class Meta:
         model = Collection
-        fields = ['id', 'picture', 'user', 'songs']
+        fields = ['id', 'picture', 'picture_derivatives', 'user', 'songs']
         read_only_fields = ['user', 'id']
 
+    def get_songs(self, obj):
+        songs = self.context.get('songs')
+        if songs is None:
+            songs = obj.songs.order_by(self.songs_ordering) if self.songs_ordering else obj.songs.all()
+        return SongReadSerializer(songs, many=True, context=self.context).data
+
     def create(self, validated_data):
         if validated_data.get('songs') is not None:
             validated_data.pop('songs')
@@ -25,18 +37,20 @@ class CollectionSerializer(serializers.ModelSerializer):
         if validated_data.get('songs') is not None:
             validated_data.pop('songs')
         instance.picture = validated_data.get('picture', instance.picture)
-        instance.save()
+        # the revision is only ever changed by bump_revision
+        instance.save(update_fields=['picture'])
+        bump_revision(instance)
 
         return instance
 
 
 class PlaylistSerializer(CollectionSerializer):
-    songs = SongReadSerializer(many=True, read_only=True)
     picture = fields.ImageField(required=False)
+    songs_ordering = 'songplaylist__position'
 
     class Meta:
         model = Playlist
-        fields = ['id', 'title', 'picture', 'user', 'songs']
+        fields = ['id', 'title', 'picture', 'picture_derivatives', 'user', 'songs']
         read_only_fields = ['user', 'id']
 
     def create(self, validated_data):
@@ -51,6 +65,31 @@ class PlaylistSerializer(CollectionSerializer):
             validated_data.pop('songs')
         instance.title = validated_data.get('title', instance.title)
         instance.picture = validated_data.get('picture', instance.picture)
-        instance.save()
+        instance.save(update_fields=['title', 'picture'])
+        bump_revision(instance)
 
         return instance
+
+
+class PlaylistSongsChangeSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list,
+                                max_length=PLAYLIST_CHANGE_MAX_SONGS)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list,
+                                   max_length=PLAYLIST_CHANGE_MAX_SONGS)
+
+    def validate(self, attrs):
+        both = set(attrs['add']) & set(attrs['remove'])
+        if both:
+            raise serializers.ValidationError({'add': f'Songs both added and removed: {sorted(both)}.'})
+        return attrs
+
+
+class PlaylistSongMoveSerializer(serializers.Serializer):
+    # the song the moved one goes after (null for the top) or before (null for the bottom)
+    after = serializers.IntegerField(required=False, allow_null=True)
+    before = serializers.IntegerField(required=False, allow_null=True)
+
+    def validate(self, attrs):
+        if len(attrs) != 1:
+            raise serializers.ValidationError('Exactly one of after and before is required.')
+        return attrs
@@ -0,0 +1,47 @@
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import post_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from library.models import Song, Album, Author
+from .models import Playlist, Collection
+
+
+def bump_lists(**lookups) -> None:
+    """
+    Bump the revision of the playlists and collections holding the songs matching lookups.
+    """
+    for model, relation in ((Playlist, 'songplaylist__song'), (Collection, 'songcollection__song')):
+        model.objects.filter(**{f'{relation}__{key}': value for key, value in lookups.items()}) \
+            .update(revision=F('revision') + 1, updated_at=Now())
+
+
+@receiver(post_save, sender=Song)
+@receiver(pre_delete, sender=Song)
+def bump_song_lists(sender, instance, created=False, **kwargs):
+    # the lists embed their songs, editing or deleting one changes every list it is in
+    if created:
+        return
+    bump_lists(pk=instance.pk)
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Author)
+@receiver(pre_delete, sender=Author)
+def bump_related_lists(sender, instance, created=False, **kwargs):
+    # and with them their album and authors; deleting an album deletes its songs, deleting an author only
+    # its song rows, before which they are still found
+    if created:
+        return
+    bump_lists(**{'album' if sender is Album else 'authors': instance})
+
+
+@receiver(m2m_changed, sender=Song.authors.through)
+def bump_author_lists(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_lists(pk=instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        bump_lists(pk__in=pk_set)
+    elif action == 'pre_clear':
+        bump_lists(authors=instance)
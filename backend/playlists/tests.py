@@ -1,3 +1,244 @@
-from django.test import TestCase
+import random
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from library.cache import LocalLRUBackend
+from library.models import Author, Album, Song
+from . import likes
+from .models import Collection, Playlist, SongPlaylist
+from .positions import DIGITS, key_between, keys_between, rebalance, spread_keys
+
+
+def create_songs(user, count):
+    author = Author.objects.create(title=f'{user.username} author', user=user)
+    album = Album.objects.create(title=f'{user.username} album', user=user, author=author)
+    return [Song.objects.create(title=f'{user.username} song {i}', audio='tracks/song.mp3', user=user, album=album)
+            for i in range(count)]
+
+
+class PositionKeyTests(SimpleTestCase):
+    def assertKeysBetween(self, keys, low=None, high=None):
+        for key in keys:
+            self.assertTrue(key and key[-1] != '0' and set(key) <= set(DIGITS), key)
+        bounded = [key for key in [low, *keys, high] if key is not None]
+        self.assertEqual(bounded, sorted(set(bounded)))
+
+    def test_random_inserts_keep_the_order(self):
+        rnd = random.Random(0)
+        keys = []
+        for _ in range(2000):
+            index = rnd.randint(0, len(keys))
+            low = keys[index - 1] if index else None
+            high = keys[index] if index < len(keys) else None
+            key = key_between(low, high)
+            self.assertKeysBetween([key], low, high)
+            keys.insert(index, key)
+        self.assertKeysBetween(keys)
+
+    def test_repeated_inserts_at_the_front(self):
+        keys = ['1']
+        for _ in range(500):
+            keys.insert(0, key_between(None, keys[0]))
+        self.assertKeysBetween(keys)
+
+    def test_repeated_inserts_into_the_same_gap(self):
+        for low, high in (('1', '2'), (None, '1'), ('z', None), ('0001', '0002'), ('y', 'yz1')):
+            keys = []
+            for _ in range(300):
+                keys.insert(0, key_between(low, keys[0] if keys else high))
+            self.assertKeysBetween(keys, low, high)
+            keys = []
+            for _ in range(300):
+                keys.append(key_between(keys[-1] if keys else low, high))
+            self.assertKeysBetween(keys, low, high)
+
+    def test_bulk_keys(self):
+        for low, high in ((None, None), ('1', '2'), ('zz', None), (None, '01'), ('h', 'h1')):
+            for count in (0, 1, 2, 35, 36, 500):
+                keys = keys_between(low, high, count)
+                self.assertEqual(len(keys), count)
+                self.assertKeysBetween(keys, low, high)
+        for count in (1, 17, 1000, 50000):
+            keys = spread_keys(count)
+            self.assertEqual(len(keys), count)
+            self.assertKeysBetween(keys)
+            # the second half of the key space is left to appends
+            self.assertLess(keys[-1], 'i')
+
+    def test_bounds_out_of_order(self):
+        for low, high in (('2', '1'), ('1', '1'), ('11', '1')):
+            with self.assertRaises(ValueError):
+                key_between(low, high)
+
+
+class PlaylistSongsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice')
+        self.songs = create_songs(self.user, 2)
+        self.other = create_songs(User.objects.create_user('bob'), 1)[0]
+        self.playlist = Playlist.objects.create(title='playlist', user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_only_own_songs_are_added(self):
+        missing = max(song.id for song in [*self.songs, self.other]) + 1
+        response = self.client.post(f'/api/v1/playlist/{self.playlist.id}/songs/',
+                                    {'add': [self.songs[0].id, self.other.id, missing]},
+                                    content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual(body['added'], [self.songs[0].id])
+        self.assertEqual(body['forbidden'], [self.other.id])
+        self.assertEqual(body['not_found'], [missing])
+        self.assertEqual(list(SongPlaylist.objects.filter(playlist=self.playlist).values_list('song_id', flat=True)),
+                         [self.songs[0].id])
+
+
+class LikedVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('carol')
+        self.songs = create_songs(self.user, 2)
+        Collection.objects.get_or_create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def liked(self, **headers):
+        return self.client.get('/api/v1/playlist/liked/', **self.headers, **headers)
+
+    def test_etags_agree_across_workers_and_follow_likes(self):
+        with mock.patch.object(likes, '_backend', LocalLRUBackend()):
+            etag = self.liked()['ETag']
+        # another worker, with its own in-process cache
+        with mock.patch.object(likes, '_backend', LocalLRUBackend()):
+            self.assertEqual(self.liked(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            response = self.client.post(f'/api/v1/playlist/like/{self.songs[0].id}', **self.headers)
+            self.assertEqual(response.status_code, 200, response.content)
+        with mock.patch.object(likes, '_backend', LocalLRUBackend()):
+            response = self.liked(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([song['id'] for song in response.json()['songs']], [self.songs[0].id])
+
+
+class PlaylistSongMoveViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dave')
+        self.songs = create_songs(self.user, 5)
+        self.playlist = Playlist.objects.create(title='playlist', user=self.user)
+        SongPlaylist.objects.bulk_create([SongPlaylist(playlist=self.playlist, song=song, position=key)
+                                          for song, key in zip(self.songs, spread_keys(len(self.songs)))])
+        self.outsider = create_songs(User.objects.create_user('erin'), 1)[0]
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def move(self, song, **anchor):
+        return self.client.post(f'/api/v1/playlist/{self.playlist.id}/songs/{song.id}/move/', anchor,
+                                content_type='application/json', **self.headers)
+
+    def order(self):
+        return list(SongPlaylist.objects.filter(playlist=self.playlist).order_by('position')
+                    .values_list('song_id', flat=True))
+
+    def test_moves(self):
+        a, b, c, d, e = self.songs
+        for song, anchor, expected in ((c, {'after': None}, [c, a, b, d, e]),
+                                       (c, {'before': None}, [a, b, d, e, c]),
+                                       (a, {'after': d.id}, [b, d, a, e, c]),
+                                       (c, {'before': b.id}, [c, b, d, a, e]),
+                                       (e, {'after': None}, [e, c, b, d, a]),
+                                       (a, {'before': None}, [e, c, b, d, a])):
+            response = self.move(song, **anchor)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(self.order(), [song.id for song in expected], (song.title, anchor))
+
+    def test_invalid_anchors(self):
+        a, b = self.songs[:2]
+        before = self.order()
+        self.assertEqual(self.move(a, after=a.id).status_code, 400)
+        self.assertEqual(self.move(a, before=a.id).status_code, 400)
+        self.assertEqual(self.move(a).status_code, 400)
+        self.assertEqual(self.move(a, after=b.id, before=None).status_code, 400)
+        self.assertEqual(self.move(a, after=self.outsider.id).status_code, 404)
+        self.assertEqual(self.move(self.outsider, after=a.id).status_code, 404)
+        self.assertEqual(self.order(), before)
+
+    def test_rebalance_keeps_the_order(self):
+        first, second = self.songs[:2]
+        # every song squeezed in right after the first one lengthens the keys
+        for song in self.songs[2:] * 10:
+            self.assertEqual(self.move(song, after=first.id).status_code, 200)
+        self.assertEqual(self.move(second, before=None).status_code, 200)
+        order = self.order()
+        revision = Playlist.objects.get(pk=self.playlist.pk).revision
+        positions = SongPlaylist.objects.filter(playlist=self.playlist).values_list('position', flat=True)
+        self.assertGreater(max(map(len, positions)), 5)
+
+        self.assertEqual(rebalance(self.playlist.id), len(self.songs))
+        self.assertEqual(self.order(), order)
+        self.assertLessEqual(max(map(len, positions.all())), 2)
+        self.assertGreater(Playlist.objects.get(pk=self.playlist.pk).revision, revision)
+
+
+class SongListETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('grace')
+        self.songs = create_songs(self.user, 3)
+        self.playlist = Playlist.objects.create(title='playlist', user=self.user)
+        SongPlaylist.objects.bulk_create([SongPlaylist(playlist=self.playlist, song=song, position=key)
+                                          for song, key in zip(self.songs[:2], spread_keys(2))])
+        self.collection, _ = Collection.objects.get_or_create(user=self.user)
+        self.collection.songs.add(self.songs[0])
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.urls = [f'/api/v1/playlist/{self.playlist.id}/', '/api/v1/playlist/liked/']
+
+    def get(self, url, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, **self.headers, **headers)
+
+    def assertChanged(self, change, description):
+        etags = {url: self.get(url)['ETag'] for url in self.urls}
+        for url, etag in etags.items():
+            self.assertEqual(self.get(url, etag).status_code, 304, (url, description))
+        change()
+        for url, etag in etags.items():
+            response = self.get(url, etag)
+            self.assertEqual(response.status_code, 200, (url, description))
+            self.assertNotEqual(response['ETag'], etag, (url, description))
+
+    def test_unchanged_list_is_not_modified(self):
+        for url in self.urls:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            not_modified = self.get(url, response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+            self.assertEqual(not_modified.content, b'')
+        # changes to songs in neither list
+        Song.objects.filter(pk=self.songs[2].pk).get().save()
+        self.assertEqual(self.get(self.urls[0], self.get(self.urls[0])['ETag']).status_code, 304)
+
+    def test_embedded_changes_modify_the_lists(self):
+        song = self.songs[0]
+        album, author = song.album, song.album.author
+        song.authors.add(author)
+        other = Author.objects.create(title='other', user=self.user)
+
+        def rename(instance):
+            instance.title += ' renamed'
+            instance.save()
+
+        def new_picture(instance):
+            instance.picture = 'pictures/albums/new.png'
+            instance.save()
+
+        self.assertChanged(lambda: rename(song), 'song renamed')
+        self.assertChanged(lambda: rename(album), 'album renamed')
+        self.assertChanged(lambda: new_picture(album), 'album picture')
+        self.assertChanged(lambda: rename(author), 'author renamed')
+        self.assertChanged(lambda: song.authors.add(other), 'author added')
+        self.assertChanged(lambda: song.authors.remove(other), 'author removed')
+        self.assertChanged(lambda: other.songs.add(song), 'song added to an author')
+        self.assertChanged(lambda: other.songs.clear(), 'author cleared')
+        self.assertChanged(lambda: other.songs.add(song) or other.delete(), 'author deleted')
+        self.assertChanged(lambda: self.client.post(f'/api/v1/playlist/like/{self.songs[2].id}', **self.headers),
+                           'like')
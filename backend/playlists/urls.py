@@ -1,10 +1,12 @@
 from django.urls import path
-from .views import PlaylistView, CollectionView, PlaylistListChangeView
+from .views import PlaylistView, CollectionView, PlaylistListChangeView, PlaylistSongsView, PlaylistSongMoveView
 
 urlpatterns = [
     path("", PlaylistView.as_view(), name="playlists"),
     path("<int:pk>/", PlaylistView.as_view(), name="playlist"),
     path("song/", PlaylistListChangeView.as_view(), name="playlist-change"),
+    path("<int:pk>/songs/", PlaylistSongsView.as_view(), name="playlist-songs"),
+    path("<int:pk>/songs/<int:song>/move/", PlaylistSongMoveView.as_view(), name="playlist-song-move"),
 
     path("like/<int:pk>", CollectionView.as_view(), name="song_like"),
     path("liked/", CollectionView.as_view(), name="collection"),
@@ -1,24 +1,88 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from users.authentication import StatelessJWTAuthentication
 from rest_framework import exceptions
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Prefetch
+from django.utils.http import parse_etags
 
 from library.models import Song
+from library.pagination import SongListCursorPagination, SongPositionCursorPagination
+from library.querysets import song_read_queryset
 from utils import convert_form_to_data
+from async_views import AsyncReadMixin
+from instrumentation import serializing
 from rest_framework.generics import RetrieveUpdateDestroyAPIView
-from users.permissions import IsOwnerOrReadOnly
+from users.permissions import IsOwnerOrReadOnly, IsOwner
 from rest_framework.permissions import IsAuthenticated
 
-from .models import Playlist, Collection, SongCollection, SongPlaylist
-from .serializers import CollectionSerializer, PlaylistSerializer
+from .models import Playlist, Collection, SongCollection, SongPlaylist, bump_revision
+from .likes import LikedSongs, liked_songs
+from .positions import append_keys, check_keys, key_between
+from .serializers import CollectionSerializer, PlaylistSerializer, PlaylistSongsChangeSerializer, \
+    PlaylistSongMoveSerializer
 from exceptions import NO_PK_PROVIDED, OBJECT_NOT_EXIST
 
 
-class PlaylistView(APIView):
-    authentication_classes = (JWTAuthentication,)
+class SongListPaginationMixin:
+    pagination_class = SongListCursorPagination
+
+    @staticmethod
+    def liked(request, instance) -> LikedSongs:
+        # one per request, the ETag and the is_liked flags share its version; a collection is the user's own
+        liked = getattr(request, '_liked_songs', None)
+        if liked is None:
+            version = instance.revision if isinstance(instance, Collection) else None
+            liked = request._liked_songs = liked_songs(request.user, version)
+        return liked
+
+    def song_list_etag(self, request, instance) -> str:
+        # the songs carry the requesting user's is_liked flags, their likes are part of the version
+        liked = self.liked(request, instance)
+        return f'"{instance._meta.model_name}-{instance.pk}-{instance.revision}-{liked.version}"'
+
+    def not_modified(self, request, instance) -> Response | None:
+        """
+        304 when the client already has the current revision, checked before any song is loaded.
+        """
+        etag = self.song_list_etag(request, instance)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=304)
+            response['ETag'] = etag
+            return response
+        return None
+
+    def song_list(self, request, instance, serializer_class, rows):
+        """
+        The GET of a song list: permissions, then a 304 or the page of songs. Run in one thread by the async
+        views, the permission classes and the liked songs may query.
+        """
+        self.check_object_permissions(request, instance)
+        not_modified = self.not_modified(request, instance)
+        if not_modified is not None:
+            return not_modified
+        return self.paginate_song_list(request, instance, rows, serializer_class)
+
+    def paginate_song_list(self, request, instance, rows, serializer_class):
+        paginator = self.pagination_class()
+        rows = rows.prefetch_related(Prefetch('song', queryset=song_read_queryset()))
+        page = paginator.paginate_queryset(rows, request, view=self)
+        serializer = serializer_class(instance, context={'songs': [row.song for row in page],
+                                                         'liked': self.liked(request, instance)})
+        with serializing():
+            data = serializer.data
+        response = paginator.get_paginated_response(data)
+        response['ETag'] = self.song_list_etag(request, instance)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class PlaylistView(AsyncReadMixin, SongListPaginationMixin, APIView):
+    pagination_class = SongPositionCursorPagination
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly,)
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
@@ -31,10 +95,19 @@ class PlaylistView(APIView):
             playlist = Playlist.objects.get(pk=pk)
         except Playlist.DoesNotExist:
             raise exceptions.NotFound(OBJECT_NOT_EXIST(Playlist))
-        self.check_object_permissions(request, playlist)
+        return self.song_list(request, playlist, PlaylistSerializer, SongPlaylist.objects.filter(playlist=playlist))
 
-        serializer = PlaylistSerializer(playlist)
-        return Response(serializer.data, status=200)
+    async def aget(self, request, *args, **kwargs):
+        pk = kwargs.get('pk', None)
+        if pk is None:
+            raise exceptions.ParseError(NO_PK_PROVIDED)
+
+        try:
+            playlist = await Playlist.objects.aget(pk=pk)
+        except Playlist.DoesNotExist:
+            raise exceptions.NotFound(OBJECT_NOT_EXIST(Playlist))
+        return await sync_to_async(self.song_list)(request, playlist, PlaylistSerializer,
+                                                   SongPlaylist.objects.filter(playlist=playlist))
 
     def post(self, request):
         form_data = convert_form_to_data(request.data)
@@ -60,7 +133,8 @@ class PlaylistView(APIView):
         serializer.is_valid(raise_exception=True)
         serializer.save()
 
-        return Response(serializer.data, status=200)
+        rows = SongPlaylist.objects.filter(playlist=playlist)
+        return self.paginate_song_list(request, playlist, rows, PlaylistSerializer)
 
     def delete(self, request, *args, **kwargs):
         pk = kwargs.get('pk', None)
@@ -78,8 +152,9 @@ class PlaylistView(APIView):
         return Response(status=204)
 
 
-class PlaylistListChangeView(APIView):
-    authentication_classes = (JWTAuthentication,)
+class PlaylistListChangeView(SongListPaginationMixin, APIView):
+    pagination_class = SongPositionCursorPagination
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly,)
 
     def post(self, request):
@@ -95,31 +170,139 @@ class PlaylistListChangeView(APIView):
         self.check_object_permissions(request, playlist)
         self.check_object_permissions(request, song)
 
-        try:
-            song_playlist = SongPlaylist.objects.get(Q(song=song) & Q(playlist=playlist))
-            song_playlist.delete()
-        except SongPlaylist.DoesNotExist:
-            SongPlaylist.objects.create(song=song, playlist=playlist)
+        with transaction.atomic():
+            # appended positions are read from the last song, adds to a playlist are serialized
+            Playlist.objects.select_for_update().get(pk=playlist.pk)
+            try:
+                song_playlist = SongPlaylist.objects.get(Q(song=song) & Q(playlist=playlist))
+                song_playlist.delete()
+            except SongPlaylist.DoesNotExist:
+                SongPlaylist.objects.create(song=song, playlist=playlist, position=append_keys(playlist, 1)[0])
+            bump_revision(playlist)
+
+        rows = SongPlaylist.objects.filter(playlist=playlist)
+        return self.paginate_song_list(request, playlist, rows, PlaylistSerializer)
 
-        serializer = PlaylistSerializer(playlist)
-        return Response(serializer.data, status=200)
 
+class PlaylistSongsView(SongListPaginationMixin, APIView):
+    # batch add/remove in one transaction, answered with the diff instead of the playlist; added songs
+    # go to the end in the order they were given. Only the user's own songs are added, as with
+    # PlaylistListChangeView
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwner,)
+
+    def post(self, request, *args, **kwargs):
+        pk = kwargs.get('pk', None)
+        if pk is None:
+            raise exceptions.ParseError(NO_PK_PROVIDED)
+        serializer = PlaylistSongsChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = list(dict.fromkeys(serializer.validated_data['add']))
+        add, remove = set(order), set(serializer.validated_data['remove'])
+
+        with transaction.atomic():
+            try:
+                playlist = Playlist.objects.select_for_update().get(pk=pk)
+            except Playlist.DoesNotExist:
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(Playlist))
+            self.check_object_permissions(request, playlist)
+
+            rows = SongPlaylist.objects.filter(playlist=playlist)
+            owners = dict(Song.objects.filter(id__in=add).values_list('id', 'user_id'))
+            forbidden = {song_id for song_id, user_id in owners.items() if user_id != request.user.id}
+            present = set(rows.filter(song_id__in=add | remove).values_list('song_id', flat=True))
+            added = owners.keys() - forbidden - present
+            removed = remove & present
+            appended = [song_id for song_id in order if song_id in added]
+            SongPlaylist.objects.bulk_create([SongPlaylist(playlist=playlist, song_id=song_id, position=position)
+                                              for song_id, position in zip(appended, append_keys(playlist,
+                                                                                                 len(appended)))],
+                                             ignore_conflicts=True)
+            if removed:
+                rows.filter(song_id__in=removed).delete()
+            if added or removed:
+                bump_revision(playlist)
+
+        response = Response({
+            'playlist': playlist.id,
+            'added': sorted(added),
+            'removed': sorted(removed),
+            'not_found': sorted(add - owners.keys()),
+            'forbidden': sorted(forbidden),
+        }, status=200)
+        response['ETag'] = self.song_list_etag(request, playlist)
+        return response
+
+
+class PlaylistSongMoveView(SongListPaginationMixin, APIView):
+    # a move writes the new position of the moved song only, its neighbours keep theirs
+    authentication_classes = (StatelessJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwner,)
 
-class CollectionView(APIView):
-    authentication_classes = (JWTAuthentication,)
+    def post(self, request, *args, **kwargs):
+        pk, song_id = kwargs.get('pk', None), kwargs.get('song', None)
+        if pk is None or song_id is None:
+            raise exceptions.ParseError(NO_PK_PROVIDED)
+        serializer = PlaylistSongMoveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        (side, anchor_id), = serializer.validated_data.items()
+        if anchor_id == song_id:
+            raise exceptions.ValidationError({side: 'A song cannot be moved next to itself.'})
+
+        with transaction.atomic():
+            try:
+                playlist = Playlist.objects.select_for_update().get(pk=pk)
+            except Playlist.DoesNotExist:
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(Playlist))
+            self.check_object_permissions(request, playlist)
+
+            rows = SongPlaylist.objects.filter(playlist=playlist)
+            positions = dict(rows.filter(song_id__in=[song_id, anchor_id]).values_list('song_id', 'position'))
+            if song_id not in positions or (anchor_id is not None and anchor_id not in positions):
+                raise exceptions.NotFound(OBJECT_NOT_EXIST(SongPlaylist))
+            others = rows.exclude(song_id=song_id).values_list('position', flat=True)
+            anchor = positions.get(anchor_id)
+            # the neighbour on the other side of the anchor, one step on the (playlist, position) index
+            if side == 'after':
+                lower = anchor
+                upper = others.filter(position__gt=anchor) if anchor is not None else others
+                upper = upper.order_by('position').first()
+            else:
+                upper = anchor
+                lower = others.filter(position__lt=anchor) if anchor is not None else others
+                lower = lower.order_by('-position').first()
+
+            position = key_between(lower, upper)
+            rows.filter(song_id=song_id).update(position=position)
+            check_keys(playlist.pk, [position])
+            bump_revision(playlist)
+
+        response = Response({'playlist': playlist.id, 'song': song_id, 'position': position}, status=200)
+        response['ETag'] = self.song_list_etag(request, playlist)
+        return response
+
+
+class CollectionView(AsyncReadMixin, SongListPaginationMixin, APIView):
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly,)
 
     def get(self, request, *args, **kwargs):
+        try:
+            collection = Collection.objects.get(user=request.user)
+        except Collection.DoesNotExist:
+            raise exceptions.NotFound(OBJECT_NOT_EXIST(Collection))
+        return self.song_list(request, collection, CollectionSerializer,
+                              SongCollection.objects.filter(collection=collection))
+
+    async def aget(self, request, *args, **kwargs):
         user = request.user
 
         try:
-            collection = Collection.objects.get(user=user)
+            collection = await Collection.objects.aget(user=user)
         except Collection.DoesNotExist:
             raise exceptions.NotFound(OBJECT_NOT_EXIST(Collection))
-        self.check_object_permissions(request, collection)
-
-        serializer = CollectionSerializer(collection)
-        return Response(serializer.data, status=200)
+        return await sync_to_async(self.song_list)(request, collection, CollectionSerializer,
+                                                   SongCollection.objects.filter(collection=collection))
 
     def post(self, request, *args, **kwargs):
         pk = kwargs.get('pk', None)
@@ -139,7 +322,7 @@ class CollectionView(APIView):
             song_collection.delete()
         except SongCollection.DoesNotExist:
             SongCollection.objects.create(collection=collection, song=song)
+        bump_revision(collection)
 
-        serializer = CollectionSerializer(collection)
-
-        return Response(serializer.data, status=200)
+        rows = SongCollection.objects.filter(collection=collection)
+        return self.paginate_song_list(request, collection, rows, CollectionSerializer)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from . import blacklist  # noqa: F401
+        from images import register_derivatives
+        from library.blobs import register_blob_fields
+        from .models import Profile
+        register_derivatives(Profile, 'profile_pic')
+        register_blob_fields(Profile, 'profile_pic')
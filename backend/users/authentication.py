@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+DEFAULT_STATELESS_AUTH = {
+    'MAX_USERS': 10000,
+    # seconds another process may keep using a deactivated or demoted user's cached state
+    'TTL': 60,
+}
+
+# loaded up front, any other field is deferred and loaded from the database when it is read; in model field
+# order, as from_db expects
+USER_STATE_FIELDS = tuple(field.attname for field in User._meta.concrete_fields
+                          if field.attname in ('id', 'username', 'is_active', 'is_staff', 'is_superuser'))
+
+
+def stateless_auth_settings() -> dict:
+    return {**DEFAULT_STATELESS_AUTH, **getattr(settings, 'STATELESS_AUTH', {})}
+
+
+class UserStateCache:
+    """
+    LRU of the USER_STATE_FIELDS values of recently authenticated users, each kept for ttl seconds.
+    """
+
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> tuple | None:
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is None:
+                return None
+            expires, state = entry
+            if expires < time.monotonic():
+                del self._states[user_id]
+                return None
+            self._states.move_to_end(user_id)
+            return state
+
+    def set(self, user_id, state: tuple) -> None:
+        with self._lock:
+            self._states[user_id] = (time.monotonic() + self.ttl, state)
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+
+    def discard(self, user_id) -> None:
+        with self._lock:
+            self._states.pop(user_id, None)
+
+
+_states = None
+_states_lock = threading.Lock()
+
+
+def get_user_states() -> UserStateCache:
+    global _states
+    if _states is None:
+        with _states_lock:
+            if _states is None:
+                config = stateless_auth_settings()
+                _states = UserStateCache(config['MAX_USERS'], config['TTL'])
+    return _states
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_state(sender, instance, **kwargs):
+    get_user_states().discard(instance.pk)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that skips the User query on safe methods: the user is built from the token's user id
+    and a cached copy of USER_STATE_FIELDS, reading any other field loads it. It is still a User instance, so
+    filtering on it and comparing it to obj.user work as usual. Other methods load the User row as
+    JWTAuthentication does.
+    """
+
+    def authenticate(self, request):
+        if request.method not in SAFE_METHODS:
+            return super().authenticate(request)
+
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_token_user(validated_token), validated_token
+
+    def get_token_user(self, validated_token) -> User:
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        states = get_user_states()
+        state = states.get(user_id)
+        if state is None:
+            state = (User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+                     .values_list(*USER_STATE_FIELDS).first())
+            if state is None:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            states.set(user_id, state)
+
+        user = User.from_db(DEFAULT_DB_ALIAS, USER_STATE_FIELDS, state)
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
@@ -0,0 +1,160 @@
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+DEFAULT_TOKEN_BLACKLIST_FILTER = {
+    'CAPACITY': 100_000,
+    'ERROR_RATE': 0.001,
+    # seconds between reads of the rows other processes blacklisted, the longest another process
+    # accepts a token that was just blacklisted
+    'SYNC_INTERVAL': 1.0,
+    # seconds between rebuilds, which drop the tokens that expired since
+    'REBUILD_INTERVAL': 3600,
+}
+# ids are taken at insert but visible at commit, a sync reads again the ids of the last seconds
+SYNC_OVERLAP = 5.0
+
+
+def blacklist_filter_settings() -> dict:
+    return {**DEFAULT_TOKEN_BLACKLIST_FILTER, **getattr(settings, 'TOKEN_BLACKLIST_FILTER', {})}
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # double hashing: k positions out of one 128 bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        new = False
+        for position in self._positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                self.bits[position >> 3] |= 1 << (position & 7)
+                new = True
+        self.count += new
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """
+    Bloom filter of the JTIs of blacklisted, unexpired tokens. Built from the database on first use, updated
+    by every blacklist write of this process and by reading the rows other processes wrote every
+    sync_interval seconds. Rebuilt larger once it holds capacity tokens, and every rebuild_interval seconds.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, sync_interval: float, rebuild_interval: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self._bloom = None
+        self._built_at = self._synced_at = 0.0
+        # (time, highest id read) of the last syncs
+        self._watermarks = deque()
+        self._lock = threading.Lock()
+
+    def _read(self, bloom: BloomFilter, after_id: int) -> int:
+        rows = (BlacklistedToken.objects.filter(id__gt=after_id, token__expires_at__gt=aware_utcnow())
+                .values_list('id', 'token__jti'))
+        last_id = after_id
+        for row_id, jti in rows.iterator():
+            bloom.add(jti)
+            last_id = max(last_id, row_id)
+        return last_id
+
+    def _rebuild(self, now: float) -> None:
+        count = BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow()).count()
+        bloom = BloomFilter(max(self.capacity, 2 * count), self.error_rate)
+        last_id = self._read(bloom, 0)
+        self._bloom, self._built_at, self._synced_at = bloom, now, now
+        self._watermarks = deque([(now, last_id)])
+
+    def _sync(self, now: float) -> None:
+        while len(self._watermarks) > 1 and self._watermarks[1][0] <= now - SYNC_OVERLAP:
+            self._watermarks.popleft()
+        last_id = self._read(self._bloom, self._watermarks[0][1])
+        self._watermarks.append((now, max(last_id, self._watermarks[-1][1])))
+        self._synced_at = now
+
+    def __contains__(self, jti: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if (self._bloom is None or self._bloom.count >= self._bloom.capacity
+                    or now - self._built_at >= self.rebuild_interval):
+                self._rebuild(now)
+            elif now - self._synced_at >= self.sync_interval:
+                self._sync(now)
+            return jti in self._bloom
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._bloom = None
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_blacklist_filter() -> BlacklistFilter:
+    global _filter
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                config = blacklist_filter_settings()
+                _filter = BlacklistFilter(config['CAPACITY'], config['ERROR_RATE'], config['SYNC_INTERVAL'],
+                                          config['REBUILD_INTERVAL'])
+    return _filter
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_to_blacklist_filter(sender, instance, created, **kwargs):
+    # a rolled back write leaves a false positive behind, which only costs a query
+    if created:
+        get_blacklist_filter().add(instance.token.jti)
+
+
+def purge_expired() -> int:
+    """
+    Delete the outstanding and blacklisted tokens that expired, they fail validation anyway.
+    Returns the number of blacklist entries deleted.
+    """
+    now = aware_utcnow()
+    blacklisted = BlacklistedToken.objects.filter(token__expires_at__lte=now).count()
+    OutstandingToken.objects.filter(expires_at__lte=now).delete()
+    get_blacklist_filter().invalidate()
+    return blacklisted
+
+
+class FilteredRefreshToken(RefreshToken):
+    """
+    RefreshToken that only queries the blacklist for tokens the filter may contain.
+    """
+
+    def check_blacklist(self) -> None:
+        if self.payload[api_settings.JTI_CLAIM] in get_blacklist_filter():
+            super().check_blacklist()
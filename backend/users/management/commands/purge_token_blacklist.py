@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.blacklist import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete the blacklisted and outstanding refresh tokens that have expired.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and purge every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            purged = purge_expired()
+            self.stdout.write(f'Purged {purged} expired blacklist entries.')
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_remove_profile_id_alter_profile_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='profile_pic_derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -6,3 +6,5 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
     bio = models.TextField(max_length=500, blank=True)
     profile_pic = models.ImageField(default='default.jpg', upload_to='profile_pics')
+    # set by images.DerivativePool once the derivatives of profile_pic are written
+    profile_pic_derivatives_ready = models.BooleanField(default=False)
@@ -1,10 +1,13 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from django.contrib.auth.models import User
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
 from playlists.models import Collection
 
 from users.models import Profile
+from users.blacklist import FilteredRefreshToken
+from images import ImageDerivativesField
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -47,13 +50,18 @@ class ProfileSerializer(serializers.ModelSerializer):
     username = serializers.StringRelatedField(source='user.username', read_only=True)
     bio = serializers.CharField(allow_blank=True, required=False)
     profile_pic = serializers.ImageField(required=False)
+    profile_pic_derivatives = ImageDerivativesField(source='profile_pic')
 
     class Meta:
         model = Profile
-        fields = ['username', 'bio', 'profile_pic']
+        fields = ['username', 'bio', 'profile_pic', 'profile_pic_derivatives']
 
     def update(self, instance, validated_data):
         instance.bio = validated_data.get('bio', instance.bio)
         instance.profile_pic = validated_data.get('profile_pic', instance.profile_pic)
         instance.save()
         return instance
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
@@ -1,3 +1,158 @@
-from django.test import TestCase
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from library.models import UploadSession
+from . import authentication, blacklist
+from .authentication import StatelessJWTAuthentication
+from .blacklist import BlacklistFilter, BloomFilter
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(2000, 0.01)
+        keys = [f'jti-{i}' for i in range(2000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertGreater(bloom.count, 1990)
+        false_positives = sum(f'other-{i}' in bloom for i in range(20000))
+        self.assertLess(false_positives, 20000 * 0.03)
+
+
+class BlacklistFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('frank', password='secret-password')
+        self.now = 1000.0
+        self.enterContext(mock.patch.object(blacklist.time, 'monotonic', side_effect=lambda: self.now))
+        # a fresh process-wide filter, and the one another process would hold
+        self.enterContext(mock.patch.object(blacklist, '_filter', None))
+        self.filter = BlacklistFilter(4, 0.01, sync_interval=1.0, rebuild_interval=3600)
+
+    def blacklist_tokens(self, count):
+        tokens = [RefreshToken.for_user(self.user) for _ in range(count)]
+        for token in tokens:
+            token.blacklist()
+        return [str(token['jti']) for token in tokens]
+
+    def test_rotated_refresh_is_rejected(self):
+        response = self.client.post('/api/v1/user/token/', {'username': 'frank', 'password': 'secret-password'})
+        self.assertEqual(response.status_code, 200, response.content)
+        refresh = response.json()['refresh']
+        # the filter is built before the rotation blacklists the token
+        self.assertNotIn(str(RefreshToken(refresh)['jti']), blacklist.get_blacklist_filter())
+
+        response = self.client.post('/api/v1/user/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotEqual(response.json()['refresh'], refresh)
+        response = self.client.post('/api/v1/user/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, 401, response.content)
+        self.assertIn('blacklisted', str(response.json()))
+
+    def test_rebuilt_larger_when_full(self):
+        self.assertNotIn('unknown', self.filter)
+        jtis = self.blacklist_tokens(5)
+        for jti in jtis:
+            self.filter.add(jti)
+        self.assertEqual(self.filter._bloom.capacity, 4)
+
+        self.assertIn(jtis[0], self.filter)
+        self.assertEqual(self.filter._bloom.capacity, 10)
+        self.assertTrue(all(jti in self.filter for jti in jtis))
+
+    def test_sync_reads_rows_of_other_processes(self):
+        self.assertNotIn('unknown', self.filter)
+        # written by another process: only the database has them
+        jtis = self.blacklist_tokens(2)
+        self.assertFalse(any(jti in self.filter for jti in jtis))
+
+        self.now += 1.5
+        self.assertTrue(all(jti in self.filter for jti in jtis))
+        later = self.blacklist_tokens(1)
+        self.now += 1.5
+        self.assertIn(later[0], self.filter)
+
+
+class StatelessJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        # a fresh process-wide state cache
+        self.enterContext(mock.patch.object(authentication, '_states', None))
+        self.user = User.objects.create_user('grace', email='grace@example.com')
+        self.factory = RequestFactory()
+
+    def authenticate(self, token=None, method='get'):
+        token = token or AccessToken.for_user(self.user)
+        request = getattr(self.factory, method)('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return StatelessJWTAuthentication().authenticate(request)[0]
+
+    def test_cached_state(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertIsInstance(user, User)
+        self.assertEqual((user.pk, user.username, user.is_active, user.is_staff), (self.user.pk, 'grace', True, False))
+        # other fields are deferred
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'grace@example.com')
+        # unsafe methods load the user as usual
+        with self.assertNumQueries(1):
+            self.authenticate(method='post')
+
+    def test_state_forgotten_on_save_and_delete(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertTrue(self.authenticate().is_active)
+        token = AccessToken.for_user(self.user)
+        self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User not found'):
+            self.authenticate(token)
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User is inactive'):
+            self.authenticate()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User is inactive'):
+            self.authenticate(method='post')
+
+    def test_state_expires(self):
+        with mock.patch.object(authentication.time, 'monotonic', return_value=1000):
+            self.authenticate()
+        # deactivated by another process, no signal reaches this one
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with mock.patch.object(authentication.time, 'monotonic', return_value=1059):
+            self.assertTrue(self.authenticate().is_active)
+        with mock.patch.object(authentication.time, 'monotonic', return_value=1061):
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate()
+
+    def test_owner_permission(self):
+        other = User.objects.create_user('heidi')
+        session = UploadSession.objects.create(user=self.user, filename='song.mp3', size=10, chunk_size=10)
+        url = f'/api/v1/library/upload/{session.id}/'
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        with tempfile.TemporaryDirectory() as tmp, override_settings(CHUNKED_UPLOAD={'DIR': tmp}):
+            with CaptureQueriesContext(connection) as first:
+                response = self.client.get(url, **headers)
+            self.assertEqual(response.status_code, 200, response.content)
+            # the user built from the cached state is still equal to session.user
+            with CaptureQueriesContext(connection) as second:
+                response = self.client.get(url, **headers)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(len(second), len(first) - 1)
+
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(other)}')
+            self.assertEqual(response.status_code, 403, response.content)
@@ -2,11 +2,11 @@ from django.shortcuts import render
 from django.contrib.auth.models import User
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import StatelessJWTAuthentication
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from rest_framework_simplejwt.tokens import RefreshToken
 
+from .blacklist import FilteredRefreshToken
 from .models import Profile
 from .serializers import RegisterSerializer, ProfileSerializer
 from .permissions import IsOwner, IsOwnerOrReadOnly
@@ -25,7 +25,7 @@ class RegisterView(APIView):
 
 
 class ProfileView(APIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsOwnerOrReadOnly,)
 
     def get(self, request, pk):
@@ -48,7 +48,7 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             refresh_token = request.data['refresh_token']
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
         except Exception as e:
             return Response(status=400)
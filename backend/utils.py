@@ -1,5 +1,8 @@
 import json
+from collections import defaultdict
 
+from django.db import connections, router
+from django.db.models import F
 from django.http import QueryDict
 from rest_framework import parsers
 from rest_framework.exceptions import NotFound
@@ -37,3 +40,54 @@ def convert_form_to_data(data: dict) -> dict:
         **({'picture': data['picture']} if data.get('picture') else {})
     }
     return form_data
+
+
+def increment_counters(model: type[models.Model], key_fields: tuple[str, ...], increments: dict[tuple, int],
+                       count_field: str = 'count', batch_size: int = 500) -> None:
+    """
+    Add increments {key: n} to count_field of the model rows identified by key_fields, creating missing rows.
+    key_fields must be covered by a unique constraint. On SQLite and PostgreSQL every batch is a single
+    INSERT .. ON CONFLICT DO UPDATE SET count = count + n, elsewhere rows are inserted with
+    ON CONFLICT DO NOTHING and bumped with UPDATEs grouped by the leading key fields and n.
+    """
+    if not increments:
+        return
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return _increment_counters_with_updates(model, key_fields, increments, count_field, batch_size)
+
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in (*key_fields, count_field)]
+    table = qn(model._meta.db_table)
+    columns = [qn(field.column) for field in fields]
+    *key_columns, count_column = columns
+    # stay under SQLite's default limit of 999 bound parameters per statement
+    rows_per_statement = max(1, min(batch_size, 999 // len(fields)))
+
+    items = list(increments.items())
+    with connection.cursor() as cursor:
+        for i in range(0, len(items), rows_per_statement):
+            chunk = items[i:i + rows_per_statement]
+            params = [field.get_db_prep_save(value, connection)
+                      for key, n in chunk for field, value in zip(fields, (*key, n))]
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(chunk))
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {placeholders} '
+                f'ON CONFLICT ({", ".join(key_columns)}) '
+                f'DO UPDATE SET {count_column} = {table}.{count_column} + excluded.{count_column}',
+                params,
+            )
+
+
+def _increment_counters_with_updates(model, key_fields, increments, count_field, batch_size):
+    model.objects.bulk_create([model(**dict(zip(key_fields, key))) for key in increments],
+                              ignore_conflicts=True, batch_size=batch_size)
+
+    *group_fields, last_field = key_fields
+    grouped = defaultdict(list)
+    for key, n in increments.items():
+        grouped[(*key[:-1], n)].append(key[-1])
+    for (*group, n), values in grouped.items():
+        for i in range(0, len(values), batch_size):
+            model.objects.filter(**dict(zip(group_fields, group)), **{f'{last_field}__in': values[i:i + batch_size]}) \
+                .update(**{count_field: F(count_field) + n})